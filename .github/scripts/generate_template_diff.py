@@ -3,21 +3,32 @@
 """
 This script generates HTML diffs for modified QC templates.
 
+The previous revisions of all modified templates are found with a single
+``git log`` over their paths and read with a single ``git cat-file --batch``
+instead of three git commands per template; the diffs are then computed and
+rendered in a process pool. A diff file is only rewritten when the diff
+itself changed.
+
 Usage:
-    python generate_template_diff.py <modified_templates_file> <output_dir>
+    python generate_template_diff.py <modified_templates_file> <output_dir> [--workers N]
 
 Arguments:
     modified_templates_file: File containing list of modified template paths
     output_dir: Directory to save HTML diff files
+    --workers: Processes computing the diffs, one per CPU by default
 """
 
+import argparse
+import hashlib
 import json
 import os
-import sys
+import re
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
 
-import jsondiff
 from jinja2 import Template
 
 # Define HTML template for diff visualization
@@ -27,6 +38,7 @@ HTML_TEMPLATE = """
 <head>
     <title>{{ template_name }} Diff: {{ old_rev }} → {{ new_rev }}</title>
     <meta charset="utf-8">
+    <meta name="diff-digest" content="{{ digest }}">
     <style>
         body { font-family: Arial, sans-serif; margin: 40px; }
         h1 { color: #333; }
@@ -118,42 +130,99 @@ HTML_TEMPLATE = """
 """
 
 
-def load_template(file_path):
-    """Load a template file from the given path."""
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except Exception as e:
-        print(f"Error loading template {file_path}: {e}")
-        return None
+# Digest of the diff data and HTML template an HTML file was rendered from
+DIGEST_PATTERN = re.compile(rb'<meta name="diff-digest" content="([0-9a-f]+)">')
 
+# Marks the commit hashes in the output of git log
+COMMIT_MARKER = b"\x01"
 
-def get_previous_revision(template_path):
-    """Get the previous revision of a template from git history."""
-    import subprocess
-    
-    # Get the current directory
-    repo_root = subprocess.check_output(
-        ["git", "rev-parse", "--show-toplevel"], text=True
-    ).strip()
-    
-    # Get list of commits that modified this file
-    commits = subprocess.check_output(
-        ["git", "log", "--format=%H", template_path], text=True
-    ).strip().split('\n')
-    
-    if len(commits) <= 1:
-        return None  # No previous revision
-    
-    # Get previous version of the file
-    prev_content = subprocess.check_output(
-        ["git", "show", f"{commits[1]}:{template_path}"], text=True
+
+def git_root():
+    """Get the top-level directory of the repository."""
+    return subprocess.check_output(["git", "rev-parse", "--show-toplevel"], text=True).strip()
+
+
+def get_previous_commits(repo_root, template_paths):
+    """
+    Find the commit holding the previous revision of each template.
+
+    As with ``git log <path>`` for each template, the previous revision is in
+    the second most recent commit that modified the file; the history is
+    walked once for all templates, and only as far back as needed.
+
+    Returns:
+        Template path -> commit, for the templates with a previous revision
+    """
+    commits_seen = {path: 0 for path in template_paths}
+    previous = {}
+    if not template_paths:
+        return previous
+
+    process = subprocess.Popen(
+        ["git", "--literal-pathspecs", "log", "--stdin", "-z", "--name-only", "--format=%x01%H"],
+        cwd=repo_root, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
     )
-    
+    # git reads all paths before it starts writing
+    process.stdin.write(b"--\n" + b"".join(os.fsencode(path) + b"\n" for path in template_paths))
+    process.stdin.close()
+
+    commit = None
+    pending = b""
     try:
-        return json.loads(prev_content)
-    except json.JSONDecodeError:
-        return None
+        for chunk in iter(lambda: process.stdout.read1(65536), b""):
+            # Commit hashes and file names, each terminated by a NUL
+            *tokens, pending = (pending + chunk).split(b"\0")
+            for token in tokens:
+                if token.startswith(COMMIT_MARKER):
+                    commit = token[1:].decode()
+                    continue
+                path = os.fsdecode(token.lstrip(b"\n"))
+                if path not in commits_seen or path in previous:
+                    continue
+                commits_seen[path] += 1
+                if commits_seen[path] == 2:
+                    previous[path] = commit
+                    if len(previous) == len(commits_seen):
+                        return previous
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, process.args)
+    return previous
+
+
+def read_objects(repo_root, object_names):
+    """
+    Read objects such as ``<commit>:<path>`` with one ``git cat-file --batch``.
+
+    Returns:
+        The content of each object, or None for objects that are missing
+    """
+    if not object_names:
+        return []
+    output = subprocess.run(
+        ["git", "cat-file", "--batch"],
+        cwd=repo_root, check=True, capture_output=True,
+        input=b"".join(name.encode() + b"\n" for name in object_names),
+    ).stdout
+
+    contents = []
+    position = 0
+    for _ in object_names:
+        header_end = output.index(b"\n", position)
+        header = output[position:header_end]
+        position = header_end + 1
+        if header.endswith(b" missing"):
+            contents.append(None)
+            continue
+        _, object_type, size = header.split()
+        content = output[position:position + int(size)]
+        contents.append(content if object_type == b"blob" else None)
+        # Each object is followed by a newline
+        position += int(size) + 1
+    return contents
 
 
 def generate_diff(old_template, new_template):
@@ -224,60 +293,111 @@ def generate_diff(old_template, new_template):
     return result
 
 
+@lru_cache(maxsize=None)
+def html_template():
+    """Compile the HTML template, once per process."""
+    return Template(HTML_TEMPLATE)
+
+
 def render_html_diff(diff_data):
     """Render the diff data as HTML using the template."""
-    template = Template(HTML_TEMPLATE)
-    return template.render(**diff_data)
+    return html_template().render(**diff_data)
+
+
+def diff_digest(diff_data):
+    """Digest of the diff data, leaving out when it was generated, and of the HTML template."""
+    data = {key: value for key, value in diff_data.items() if key != "generated_date"}
+    # A change to the page layout must regenerate unchanged diffs too
+    data["html_template"] = hashlib.sha256(HTML_TEMPLATE.encode()).hexdigest()
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def process_template(job):
+    """
+    Generate the diff of one template; runs in a worker process.
+
+    Returns:
+        The messages to report for the template
+    """
+    template_path, previous_content, output_file = job
+    try:
+        with open(template_path, 'r', encoding='utf-8') as f:
+            current_template = json.load(f)
+    except Exception as e:
+        return [f"Error loading template {template_path}: {e}", "  Failed to load current template, skipping"]
+
+    try:
+        previous_template = json.loads(previous_content) if previous_content is not None else None
+    except json.JSONDecodeError:
+        previous_template = None
+    if not previous_template:
+        return ["  No previous revision found, skipping"]
+
+    # Generate structured diff
+    diff_data = generate_diff(previous_template, current_template)
+
+    # Skip if no changes detected
+    if not diff_data["header_changes"] and not diff_data["steps_changes"]:
+        return ["  No changes detected, skipping"]
+
+    # Leave the file alone if it already shows this diff
+    diff_data["digest"] = diff_digest(diff_data)
+    try:
+        with open(output_file, 'rb') as f:
+            existing = DIGEST_PATTERN.search(f.read())
+    except FileNotFoundError:
+        existing = None
+    if existing and existing.group(1).decode() == diff_data["digest"]:
+        return [f"  Diff unchanged: {output_file}"]
+
+    html_content = render_html_diff(diff_data)
+    with open(output_file, 'w', encoding='utf-8') as f:
+        f.write(html_content)
+    return [f"  Diff generated: {output_file}"]
+
+
+def print_results(template_paths, results):
+    for template_path, messages in zip(template_paths, results):
+        print(f"Processing {template_path}...")
+        for message in messages:
+            print(message)
 
 
 def main():
-    if len(sys.argv) != 3:
-        print(f"Usage: {sys.argv[0]} <modified_templates_file> <output_dir>")
-        sys.exit(1)
-    
-    modified_templates_file = sys.argv[1]
-    output_dir = sys.argv[2]
-    
+    parser = argparse.ArgumentParser(description="Generate HTML diffs for modified QC templates.")
+    parser.add_argument("modified_templates_file", help="File containing list of modified template paths")
+    parser.add_argument("output_dir", help="Directory to save HTML diff files")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Processes computing the diffs")
+    args = parser.parse_args()
+
     # Ensure output directory exists
-    os.makedirs(output_dir, exist_ok=True)
-    
+    os.makedirs(args.output_dir, exist_ok=True)
+
     # Read list of modified templates
-    with open(modified_templates_file, 'r') as f:
+    with open(args.modified_templates_file, 'r') as f:
         modified_templates = [line.strip() for line in f if line.strip()]
-    
-    for template_path in modified_templates:
-        print(f"Processing {template_path}...")
-        
-        # Load current template
-        current_template = load_template(template_path)
-        if not current_template:
-            print(f"  Failed to load current template, skipping")
-            continue
-        
-        # Get previous revision from git history
-        previous_template = get_previous_revision(template_path)
-        if not previous_template:
-            print(f"  No previous revision found, skipping")
-            continue
-        
-        # Generate structured diff
-        diff_data = generate_diff(previous_template, current_template)
-        
-        # Skip if no changes detected
-        if not diff_data["header_changes"] and not diff_data["steps_changes"]:
-            print(f"  No changes detected, skipping")
-            continue
-        
-        # Render HTML
-        html_content = render_html_diff(diff_data)
-        
-        # Save HTML diff
-        template_name = Path(template_path).stem
-        output_file = os.path.join(output_dir, f"{template_name}_diff.html")
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write(html_content)
-        
-        print(f"  Diff generated: {output_file}")
+
+    # Previous revisions of all templates, read from git in one pass
+    repo_root = git_root()
+    git_paths = [Path(os.path.relpath(os.path.abspath(path), repo_root)).as_posix() for path in modified_templates]
+    previous_commits = get_previous_commits(repo_root, sorted(set(git_paths)))
+    with_previous = sorted({path for path in git_paths if path in previous_commits})
+    previous_contents = dict(zip(
+        with_previous, read_objects(repo_root, [f"{previous_commits[path]}:{path}" for path in with_previous])
+    ))
+
+    jobs = [
+        (template_path, previous_contents.get(git_path),
+         os.path.join(args.output_dir, f"{Path(template_path).stem}_diff.html"))
+        for template_path, git_path in zip(modified_templates, git_paths)
+    ]
+    workers = max(1, min(args.workers, len(jobs)))
+    if workers == 1:
+        print_results(modified_templates, map(process_template, jobs))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            chunksize = max(1, len(jobs) // (workers * 4))
+            print_results(modified_templates, pool.map(process_template, jobs, chunksize=chunksize))
 
 
 if __name__ == "__main__":
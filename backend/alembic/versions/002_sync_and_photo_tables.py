@@ -0,0 +1,165 @@
+"""Sync change log, template stats, revisions and photo tables
+
+Revision ID: 002
+Revises: 001
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = "002"
+down_revision = "001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Create Enum types
+    op.execute("CREATE TYPE changeop AS ENUM ('upsert', 'delete')")
+    op.execute("CREATE TYPE ocrstatus AS ENUM ('pending', 'done', 'failed')")
+
+    # Results are loaded per checklist
+    op.create_index(
+        op.f("ix_qcresult_qc_doc_id"), "qcresult", ["qc_doc_id"], unique=False
+    )
+
+    # Create tables
+    op.create_table(
+        "changelog",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("entity", sa.String(length=20), nullable=False),
+        sa.Column("entity_id", sa.Integer(), nullable=False),
+        sa.Column("parent_id", sa.Integer(), nullable=True),
+        sa.Column(
+            "op", postgresql.ENUM(name="changeop", create_type=False), nullable=False
+        ),
+        sa.Column("txid", sa.BigInteger(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(op.f("ix_changelog_txid"), "changelog", ["txid"], unique=False)
+
+    op.create_table(
+        "templatestats",
+        sa.Column("template_id", sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column("step_count", sa.Integer(), nullable=False),
+        sa.Column("checklist_count", sa.Integer(), nullable=False),
+        sa.Column("finished_count", sa.Integer(), nullable=False),
+        sa.Column("first_pass_count", sa.Integer(), nullable=False),
+        sa.Column("execution_time_total", sa.Integer(), nullable=False),
+        sa.Column("execution_time_count", sa.Integer(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("template_id"),
+    )
+
+    op.create_table(
+        "photoblob",
+        sa.Column("sha256", sa.String(length=64), nullable=False),
+        sa.Column("extension", sa.String(length=10), nullable=False),
+        sa.Column("size", sa.Integer(), nullable=False),
+        sa.Column("ref_count", sa.Integer(), nullable=False),
+        sa.Column("encoded_name", sa.String(length=255), nullable=True),
+        sa.Column("encoded_size", sa.Integer(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("sha256"),
+    )
+
+    op.create_table(
+        "photo",
+        sa.Column("filename", sa.String(length=255), nullable=True),
+        sa.Column("original_filename", sa.String(length=255), nullable=True),
+        sa.Column("checklist_id", sa.Integer(), nullable=True),
+        sa.Column("note", sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("uploaded_by_id", sa.Integer(), nullable=True),
+        sa.Column("size", sa.Integer(), nullable=False),
+        sa.Column("original_size", sa.Integer(), nullable=False),
+        sa.Column("sha256", sa.String(length=64), nullable=True),
+        sa.Column(
+            "ocr_status",
+            postgresql.ENUM(name="ocrstatus", create_type=False),
+            nullable=False,
+        ),
+        sa.Column("ocr_text", sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+        sa.Column("ocr_serials", sa.JSON(), nullable=True),
+        sa.Column("phash", sa.BigInteger(), nullable=True),
+        sa.Column("phash_at", sa.DateTime(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["checklist_id"],
+            ["qcdoc.id"],
+        ),
+        sa.ForeignKeyConstraint(
+            ["uploaded_by_id"],
+            ["user.id"],
+        ),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(op.f("ix_photo_filename"), "photo", ["filename"], unique=False)
+    op.create_index(op.f("ix_photo_sha256"), "photo", ["sha256"], unique=False)
+    op.create_index(op.f("ix_photo_ocr_status"), "photo", ["ocr_status"], unique=False)
+    op.create_index(op.f("ix_photo_phash_at"), "photo", ["phash_at"], unique=False)
+
+    op.create_table(
+        "steprevision",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("digest", sa.String(length=64), nullable=False),
+        sa.Column("code", sa.String(length=20), nullable=False),
+        sa.Column("content", sa.JSON(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("digest"),
+    )
+
+    op.create_table(
+        "templaterevision",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("template_id", sa.Integer(), nullable=False),
+        sa.Column("revision", sa.String(length=10), nullable=False),
+        sa.Column(
+            "status",
+            postgresql.ENUM(name="templatestatus", create_type=False),
+            nullable=False,
+        ),
+        sa.Column("header", sa.JSON(), nullable=True),
+        sa.Column("step_revision_ids", sa.JSON(), nullable=True),
+        sa.Column("digest", sa.String(length=64), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("template_id", "revision"),
+    )
+    op.create_index(
+        op.f("ix_templaterevision_template_id"),
+        "templaterevision",
+        ["template_id"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    # Drop tables
+    op.drop_index(
+        op.f("ix_templaterevision_template_id"), table_name="templaterevision"
+    )
+    op.drop_table("templaterevision")
+    op.drop_table("steprevision")
+    op.drop_index(op.f("ix_photo_phash_at"), table_name="photo")
+    op.drop_index(op.f("ix_photo_ocr_status"), table_name="photo")
+    op.drop_index(op.f("ix_photo_sha256"), table_name="photo")
+    op.drop_index(op.f("ix_photo_filename"), table_name="photo")
+    op.drop_table("photo")
+    op.drop_table("photoblob")
+    op.drop_table("templatestats")
+    op.drop_index(op.f("ix_changelog_txid"), table_name="changelog")
+    op.drop_table("changelog")
+    op.drop_index(op.f("ix_qcresult_qc_doc_id"), table_name="qcresult")
+
+    # Drop Enum types
+    op.execute("DROP TYPE IF EXISTS ocrstatus")
+    op.execute("DROP TYPE IF EXISTS changeop")
@@ -0,0 +1,43 @@
+"""Step position
+
+Revision ID: 003
+Revises: 002
+Create Date: 2026-10-17 13:00:00.000000
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "003"
+down_revision = "002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "step", sa.Column("position", sa.Integer(), server_default="0", nullable=False)
+    )
+
+    # Existing steps keep their creation order
+    op.execute("""
+        UPDATE step SET position = numbered.position
+        FROM (
+            SELECT id, row_number() OVER (PARTITION BY template_id ORDER BY id) - 1 AS position
+            FROM step
+        ) AS numbered
+        WHERE step.id = numbered.id
+    """)
+    op.create_index(
+        "ix_step_template_id_position",
+        "step",
+        ["template_id", "position"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_step_template_id_position", table_name="step")
+    op.drop_column("step", "position")
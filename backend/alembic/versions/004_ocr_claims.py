@@ -0,0 +1,31 @@
+"""OCR claims
+
+Revision ID: 004
+Revises: 003
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "004"
+down_revision = "003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute(
+        "ALTER TYPE ocrstatus ADD VALUE IF NOT EXISTS 'processing' AFTER 'pending'"
+    )
+    op.add_column("photo", sa.Column("ocr_claimed_at", sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    # Enum values cannot be dropped; claimed photos are recognized again
+    op.execute(
+        "UPDATE photo SET ocr_status = 'pending' WHERE ocr_status = 'processing'"
+    )
+    op.drop_column("photo", "ocr_claimed_at")
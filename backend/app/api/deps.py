@@ -1,20 +1,25 @@
-from fastapi import Depends, HTTPException, status
+from typing import Optional
+
+from fastapi import Depends, HTTPException, Query, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlmodel import Session, select
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from jose import jwt, JWTError
 from pydantic import ValidationError
 
 from app.core.config import settings
-from app.db.session import get_db
+from app.db.session import get_async_db
 from app.core.security import ALGORITHM, SECRET_KEY, TokenPayload
 from app.models.user import User, UserRole
+from app.services.pagination import InvalidPageCursor, decode_page_cursor
+from app.services.principal_cache import get_principal
 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"{settings.API_V1_STR}/auth/login")
 
 
-# Current user dependency
-def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)) -> User:
+# Current user dependency; returns a detached snapshot, re-load it before modifying
+async def get_current_user(db: AsyncSession = Depends(get_async_db), token: str = Depends(oauth2_scheme)) -> User:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -25,10 +30,11 @@ def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_
         token_data = TokenPayload(**payload)
         if token_data.sub is None:
             raise credentials_exception
-    except (JWTError, ValidationError):
+        user_id = int(token_data.sub)
+    except (JWTError, ValidationError, ValueError):
         raise credentials_exception
     
-    user = db.get(User, token_data.sub)
+    user = await get_principal(user_id, lambda: db.get(User, user_id))
     if user is None:
         raise credentials_exception
     return user
@@ -66,3 +72,19 @@ def get_current_admin(current_user: User = Depends(get_current_active_user)) ->
             detail="The user doesn't have enough privileges",
         )
     return current_user
+
+
+# Keyset pagination parameters of list endpoints
+class PageParams:
+    def __init__(
+        self,
+        cursor: Optional[str] = Query(None, description="X-Next-Cursor of the previous page"),
+        limit: int = Query(100, ge=1, le=settings.MAX_PAGE_SIZE),
+        total: bool = Query(False, description="Return the total count in X-Total-Count"),
+    ) -> None:
+        try:
+            self.after = decode_page_cursor(cursor) if cursor else None
+        except InvalidPageCursor as exc:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc))
+        self.limit = limit
+        self.total = total
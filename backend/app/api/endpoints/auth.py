@@ -1,29 +1,30 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlmodel import Session, or_
+from sqlmodel import or_, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from datetime import timedelta
 
-from app.core.security import create_access_token
-from app.db.session import get_db
+from app.core.security import create_access_token, get_password_hash_async, verify_password_async
+from app.db.session import get_async_db
 from app.models.user import User, UserCreate, UserLogin, Token
 
 router = APIRouter()
 
 @router.post("/login", response_model=Token)
-async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
     """
     OAuth2 compatible token login, get an access token for future requests
     Accepts either email or username for login
     """
     # Try to find user by email OR username
-    user = db.query(User).filter(
+    user = (await db.exec(select(User).where(
         or_(
             User.email == form_data.username,
             User.username == form_data.username
         )
-    ).first()
+    ))).first()
     
-    if not user or not user.verify_password(form_data.password):
+    if not user or not await verify_password_async(form_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username/email or password",
@@ -32,23 +33,23 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session =
     
     access_token_expires = timedelta(minutes=60 * 24 * 7)  # 7 days
     access_token = create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
+        user.id, expires_delta=access_token_expires
     )
     
     return {"access_token": access_token, "token_type": "bearer"}
 
 @router.post("/register", response_model=User)
-async def register(user_in: UserCreate, db: Session = Depends(get_db)):
+async def register(user_in: UserCreate, db: AsyncSession = Depends(get_async_db)):
     """
     Register a new user
     """
     # Check if user already exists
-    existing_user = db.query(User).filter(
+    existing_user = (await db.exec(select(User).where(
         or_(
             User.email == user_in.email,
             User.username == user_in.username
         )
-    ).first()
+    ))).first()
     
     if existing_user:
         raise HTTPException(
@@ -64,12 +65,11 @@ async def register(user_in: UserCreate, db: Session = Depends(get_db)):
         role=user_in.role,
         is_active=user_in.is_active,
         is_superuser=user_in.is_superuser,
-        hashed_password=""  # Will be set in the next line
+        hashed_password=await get_password_hash_async(user_in.password),
     )
-    user.set_password(user_in.password)
     
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
     
     return user
@@ -1,55 +1,60 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlmodel import Session, select
+from fastapi import APIRouter, Depends, HTTPException, Response, status
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from typing import List
 
-from app.api.deps import get_current_user
-from app.db.session import get_db
-from app.models.checklist import Checklist, ChecklistCreate, ChecklistUpdate
+from app.api.deps import PageParams, get_current_user
+from app.db.session import get_async_db
+from app.models.checklist import QCDoc, QCDocCreate, QCDocUpdate, QCDocRead
 from app.models.user import User
+from app.services.pagination import paginate, set_page_headers, total_count
 
 router = APIRouter()
 
-@router.get("", response_model=List[Checklist])
+@router.get("", response_model=List[QCDocRead])
 async def list_checklists(
-    skip: int = 0,
-    limit: int = 100,
+    response: Response,
+    page: PageParams = Depends(),
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
-    Get list of checklists
+    Get list of checklists, newest first
+    Pass the X-Next-Cursor header of a page as cursor to get the next one
     """
-    checklists = db.exec(select(Checklist).offset(skip).limit(limit)).all()
-    return checklists
+    checklists = await paginate(db, select(QCDoc), QCDoc.id, page.after, page.limit, descending=True)
+    total = await total_count(db, select(QCDoc), QCDoc.__tablename__) if page.total else None
+    set_page_headers(response, checklists.next_cursor, total)
+    return checklists.items
 
-@router.post("", response_model=Checklist)
+@router.post("", response_model=QCDocRead)
 async def create_checklist(
-    checklist_in: ChecklistCreate,
+    checklist_in: QCDocCreate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Create new checklist
     """
-    checklist = Checklist.from_orm(checklist_in)
+    checklist = QCDoc.model_validate(checklist_in)
     checklist.created_by_id = current_user.id
     
     db.add(checklist)
-    db.commit()
-    db.refresh(checklist)
+    await db.commit()
+    await db.refresh(checklist)
     
     return checklist
 
-@router.get("/{checklist_id}", response_model=Checklist)
+@router.get("/{checklist_id}", response_model=QCDocRead)
 async def get_checklist(
     checklist_id: int,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Get checklist by ID
     """
-    checklist = db.get(Checklist, checklist_id)
+    checklist = await db.get(QCDoc, checklist_id)
     if not checklist:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -58,17 +63,17 @@ async def get_checklist(
     
     return checklist
 
-@router.put("/{checklist_id}", response_model=Checklist)
+@router.put("/{checklist_id}", response_model=QCDocRead)
 async def update_checklist(
     checklist_id: int,
-    checklist_in: ChecklistUpdate,
+    checklist_in: QCDocUpdate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Update checklist
     """
-    checklist = db.get(Checklist, checklist_id)
+    checklist = await db.get(QCDoc, checklist_id)
     if not checklist:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -87,8 +92,8 @@ async def update_checklist(
     checklist.updated_by_id = current_user.id
     
     db.add(checklist)
-    db.commit()
-    db.refresh(checklist)
+    await db.commit()
+    await db.refresh(checklist)
     
     return checklist
 
@@ -96,12 +101,12 @@ async def update_checklist(
 async def delete_checklist(
     checklist_id: int,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Delete checklist
     """
-    checklist = db.get(Checklist, checklist_id)
+    checklist = await db.get(QCDoc, checklist_id)
     if not checklist:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -114,7 +119,7 @@ async def delete_checklist(
             detail="Not enough permissions"
         )
     
-    db.delete(checklist)
-    db.commit()
+    await db.delete(checklist)
+    await db.commit()
     
     return None
@@ -0,0 +1,44 @@
+import mimetypes
+from pathlib import Path
+
+from fastapi import APIRouter, HTTPException, Request, status
+from fastapi.responses import RedirectResponse
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.services import photo_store
+from app.services.file_serving import serve_file
+
+router = APIRouter()
+
+
+def photo_etag(filename: str, suffix: str = "") -> str:
+    # Stored names are content hashes or, for legacy files, unique names
+    # that were never overwritten; either identifies the bytes
+    return f'"{Path(filename).stem}{suffix}"'
+
+
+@router.api_route("/{filename:path}", methods=["GET", "HEAD"], include_in_schema=False)
+async def get_photo_file(filename: str, request: Request):
+    """
+    Serve an uploaded photo
+    Responses are immutable; conditional and byte-range requests are supported
+    """
+    resolved = None
+    if photo_store.is_stored_name(filename):
+        resolved = await run_in_threadpool(photo_store.resolve, filename)
+    if resolved is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Photo not found"
+        )
+    if resolved != filename:
+        # The upload was replaced by its re-encoded copy, for good
+        return RedirectResponse(
+            f"/photos/{resolved}", status_code=status.HTTP_301_MOVED_PERMANENTLY
+        )
+
+    path = Path(settings.UPLOADS_DIR) / filename
+    media_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    return serve_file(
+        request, path, photo_etag(filename), media_type, accel_name=filename
+    )
@@ -1,119 +1,345 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
+import logging
+
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Request, status
 from fastapi.responses import FileResponse
-from sqlmodel import Session
-import uuid
-import os
-from pathlib import Path
-from typing import List
+from sqlmodel.ext.asyncio.session import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from typing import List, Optional
 
 from app.api.deps import get_current_user
-from app.db.session import get_db
+from app.core.deps import get_current_superuser
+from app.api.endpoints.photo_files import photo_etag
 from app.core.config import settings
+from app.db.session import get_async_db
 from app.models.user import User
-from app.models.photo import Photo, PhotoCreate, PhotoResponse
+from app.models.photo import (
+    Photo, PhotoBatchItem, PhotoCreate, PhotoResponse, SimilarPhoto, UploadSessionCreate, UploadSessionResponse
+)
+from app.services import imaging, ocr, photo_hashes, photo_ingest, photo_store, upload_sessions
+from app.services.file_serving import serve_file
+from app.services.photo_upload import (
+    BATCH_UPLOAD_REQUEST_BODY, CHUNK_REQUEST_BODY, UPLOAD_REQUEST_BODY, ReceivedFile, receive_upload, receive_uploads
+)
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-@router.post("", response_model=PhotoResponse)
+
+def photo_response(photo: Photo) -> PhotoResponse:
+    return PhotoResponse(
+        id=photo.id,
+        filename=photo.filename,
+        url=f"/photos/{photo.filename}",
+        thumbnail_url=imaging.variant_url(photo.filename, "thumbnail"),
+        preview_url=imaging.variant_url(photo.filename, "preview"),
+        original_filename=photo.original_filename,
+        note=photo.note,
+        uploaded_by_id=photo.uploaded_by_id,
+        size=photo.size,
+        original_size=photo.original_size,
+        sha256=photo.sha256,
+        ocr_status=photo.ocr_status,
+        ocr_text=photo.ocr_text,
+        ocr_serials=photo.ocr_serials,
+        created_at=photo.created_at
+    )
+
+
+def upload_session_response(session: upload_sessions.UploadSession) -> UploadSessionResponse:
+    return UploadSessionResponse(
+        id=session.id,
+        filename=session.filename,
+        size=session.size,
+        offset=upload_sessions.offset_of(session),
+        expires_at=upload_sessions.expires_at(session),
+        photo_id=session.photo_id
+    )
+
+
+async def add_photo(
+    db: AsyncSession, received: ReceivedFile, checklist_id: Optional[int], note: Optional[str], uploaded_by_id: int
+) -> Photo:
+    # Identical content is stored once and shared
+    stored = await photo_store.add_reference(db, received)
+    
+    # Create photo record
+    photo_in = PhotoCreate(
+        filename=stored.name,
+        original_filename=received.filename,
+        checklist_id=checklist_id,
+        note=note
+    )
+    
+    photo = Photo.model_validate(photo_in, update={
+        "uploaded_by_id": uploaded_by_id,
+        "size": stored.size,
+        "original_size": received.size,
+        "sha256": received.sha256,
+    })
+    
+    db.add(photo)
+    return photo
+
+
+async def store_photo(
+    db: AsyncSession, received: ReceivedFile, checklist_id: Optional[int], note: Optional[str], uploaded_by_id: int
+) -> Photo:
+    photo = await add_photo(db, received, checklist_id, note, uploaded_by_id)
+    await db.commit()
+    await db.refresh(photo)
+    return photo
+
+
+@router.post("", response_model=PhotoResponse, openapi_extra=UPLOAD_REQUEST_BODY)
 async def upload_photo(
-    file: UploadFile = File(...),
+    request: Request,
+    background_tasks: BackgroundTasks,
     checklist_id: int = None,
     note: str = None,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Upload a photo for a checklist
+    The multipart "file" field is streamed to disk while it is received
     """
-    # Validate file size
-    file.file.seek(0, 2)  # Go to end of file
-    file_size = file.file.tell()  # Get file size
-    file.file.seek(0)  # Go back to start
-    
-    if file_size > settings.MAX_UPLOAD_SIZE:
-        raise HTTPException(
-            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-            detail=f"File size exceeds maximum allowed ({settings.MAX_UPLOAD_SIZE} bytes)"
-        )
+    # Size and extension are validated while streaming
+    received = await receive_upload(request)
+    photo = await store_photo(db, received, checklist_id, note, current_user.id)
     
-    # Validate file extension
-    file_ext = os.path.splitext(file.filename)[1].lower()
-    if file_ext not in settings.ALLOWED_UPLOAD_EXTENSIONS:
-        raise HTTPException(
-            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
-            detail=f"File extension not allowed. Allowed extensions: {', '.join(settings.ALLOWED_UPLOAD_EXTENSIONS)}"
-        )
+    # Re-encode, render thumbnail and preview and OCR once the response is sent
+    background_tasks.add_task(photo_ingest.process_upload, photo.id)
     
-    # Generate unique filename
-    unique_filename = f"{uuid.uuid4()}{file_ext}"
-    file_path = Path(settings.UPLOADS_DIR) / unique_filename
+    return photo_response(photo)
+
+@router.post("/batch", response_model=List[PhotoBatchItem], openapi_extra=BATCH_UPLOAD_REQUEST_BODY)
+async def upload_photos(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    checklist_id: int = None,
+    note: str = None,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Upload several photos for a checklist in one request
+    Each file of the multipart "files" field is streamed to disk; files that
+    are rejected don't fail the others, and all photos are stored in one
+    transaction
+    """
+    results = await receive_uploads(request)
+    received = [result for result in results if isinstance(result, ReceivedFile)]
     
-    # Save file
-    with open(file_path, "wb") as f:
-        content = await file.read()
-        f.write(content)
+    photos = {}
+    try:
+        # Lock blob rows in a fixed order so concurrent batches can't deadlock
+        for item in sorted(received, key=lambda item: item.sha256):
+            photos[item] = await add_photo(db, item, checklist_id, note, current_user.id)
+        await db.commit()
+    except BaseException:
+        for item in received:
+            if item not in photos:
+                item.path.unlink(missing_ok=True)
+        raise
     
-    # Create photo record
-    photo_in = PhotoCreate(
-        filename=unique_filename,
-        original_filename=file.filename,
-        checklist_id=checklist_id,
-        note=note
+    items = []
+    for result in results:
+        if isinstance(result, ReceivedFile):
+            photo = photos[result]
+            background_tasks.add_task(photo_ingest.process_upload, photo.id)
+            items.append(PhotoBatchItem(
+                filename=result.filename, status_code=status.HTTP_201_CREATED, photo=photo_response(photo)
+            ))
+        else:
+            items.append(PhotoBatchItem(
+                filename=result.filename, status_code=result.status_code, detail=result.detail
+            ))
+    return items
+
+@router.post("/uploads", response_model=UploadSessionResponse, status_code=status.HTTP_201_CREATED)
+async def create_upload_session(
+    upload_in: UploadSessionCreate,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Start a resumable upload of a photo of known size
+    Send the file with PUT /uploads/{upload_id}?offset=N in as many chunks as
+    needed, check GET /uploads/{upload_id} for the offset to resume from after
+    a failure, then POST /uploads/{upload_id}/complete
+    """
+    session = await upload_sessions.create_session(
+        current_user.id, upload_in.filename, upload_in.size, upload_in.checklist_id, upload_in.note
     )
+    return upload_session_response(session)
+
+@router.get("/uploads/{upload_id}", response_model=UploadSessionResponse)
+async def get_upload_session(
+    upload_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Get the offset of a resumable upload
+    """
+    session = await upload_sessions.get_session(upload_id, current_user.id)
+    return upload_session_response(session)
+
+@router.put("/uploads/{upload_id}", response_model=UploadSessionResponse, openapi_extra=CHUNK_REQUEST_BODY)
+async def upload_chunk(
+    upload_id: str,
+    offset: int,
+    request: Request,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Append a chunk, sent as the raw request body, to a resumable upload
+    The offset must equal the bytes received so far
+    """
+    session = await upload_sessions.get_session(upload_id, current_user.id)
+    await upload_sessions.append_chunk(session, offset, request)
+    return upload_session_response(session)
+
+@router.post("/uploads/{upload_id}/complete", response_model=PhotoResponse)
+async def complete_upload_session(
+    upload_id: str,
+    background_tasks: BackgroundTasks,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Create the photo of a fully received resumable upload
+    Retrying returns the same photo
+    """
+    session = await upload_sessions.get_session(upload_id, current_user.id)
     
-    photo = Photo.from_orm(photo_in)
-    photo.uploaded_by_id = current_user.id
+    async def store(received: ReceivedFile) -> int:
+        photo = await store_photo(db, received, session.checklist_id, session.note, current_user.id)
+        return photo.id
     
-    db.add(photo)
-    db.commit()
-    db.refresh(photo)
+    photo = await db.get(Photo, await upload_sessions.complete_session(session, store))
+    if not photo:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Photo not found"
+        )
     
-    return PhotoResponse(
-        id=photo.id,
-        filename=photo.filename,
-        url=f"/photos/{photo.filename}",
-        original_filename=photo.original_filename,
-        note=photo.note,
-        uploaded_by_id=photo.uploaded_by_id,
-        created_at=photo.created_at
-    )
+    background_tasks.add_task(photo_ingest.process_upload, photo.id)
+    
+    return photo_response(photo)
+
+@router.delete("/uploads/{upload_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def abort_upload_session(
+    upload_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Abort a resumable upload and discard the bytes received
+    """
+    session = await upload_sessions.get_session(upload_id, current_user.id)
+    await upload_sessions.abort_session(session)
+    return None
+
+@router.api_route("/variants/{variant}/{filename:path}", methods=["GET", "HEAD"], response_class=FileResponse)
+async def get_photo_variant(variant: str, filename: str, request: Request):
+    """
+    Get a downscaled variant ("thumbnail" or "preview") of a photo
+    Served without authentication like the originals under /photos;
+    missing variants are rendered on demand and cached on disk
+    """
+    # Originals replaced by their re-encoded copy resolve to the copy
+    if photo_store.is_stored_name(filename):
+        filename = await run_in_threadpool(photo_store.resolve, filename)
+    else:
+        filename = None
+    if variant not in imaging.VARIANTS or filename is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Photo not found"
+        )
+    
+    path = imaging.variant_path(filename, variant)
+    if not path.exists():
+        try:
+            await imaging.generate_variants(filename, [variant])
+        except Exception:
+            logger.exception("Could not render %s of photo %s", variant, filename)
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail="Photo could not be rendered"
+            )
+    
+    # Variants of immutable photos never change either
+    return serve_file(request, path, photo_etag(filename, f"-{variant}"), "image/jpeg")
+
+@router.get("/ocr/metrics")
+async def get_ocr_metrics(
+    current_user: User = Depends(get_current_superuser)
+):
+    """
+    Get OCR queue depth, job counts and recent job timings (superuser only)
+    """
+    return ocr.metrics()
 
 @router.get("/{photo_id}", response_model=PhotoResponse)
 async def get_photo(
     photo_id: int,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Get photo by ID
     """
-    photo = db.get(Photo, photo_id)
+    photo = await db.get(Photo, photo_id)
     if not photo:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Photo not found"
         )
     
-    return PhotoResponse(
-        id=photo.id,
-        filename=photo.filename,
-        url=f"/photos/{photo.filename}",
-        original_filename=photo.original_filename,
-        note=photo.note,
-        uploaded_by_id=photo.uploaded_by_id,
-        created_at=photo.created_at
-    )
+    return photo_response(photo)
+
+@router.get("/{photo_id}/similar", response_model=List[SimilarPhoto])
+async def get_similar_photos(
+    photo_id: int,
+    max_distance: int = Query(settings.PHASH_DEFAULT_DISTANCE, ge=0, le=settings.PHASH_MAX_DISTANCE),
+    limit: int = Query(settings.DEFAULT_PAGE_SIZE, ge=1, le=settings.MAX_PAGE_SIZE),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Get photos that look like this one (re-used or duplicate evidence)
+    Compares perceptual hashes; max_distance is the number of differing bits
+    """
+    photo = await db.get(Photo, photo_id)
+    if not photo:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Photo not found"
+        )
+    if photo.phash is None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Photo has not been hashed yet"
+        )
+    if not photo_hashes.get_index().loaded:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Photo index is loading"
+        )
+    
+    similar = await photo_hashes.find_similar(db, photo, max_distance, limit)
+    return [SimilarPhoto(distance=distance, photo=photo_response(match)) for match, distance in similar]
 
 @router.delete("/{photo_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_photo(
     photo_id: int,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Delete photo
     """
-    photo = db.get(Photo, photo_id)
+    photo = await db.get(Photo, photo_id)
     if not photo:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -127,13 +353,12 @@ async def delete_photo(
             detail="Not enough permissions"
         )
     
-    # Delete file
-    file_path = Path(settings.UPLOADS_DIR) / photo.filename
-    if file_path.exists():
-        os.remove(file_path)
-    
-    # Delete record
-    db.delete(photo)
-    db.commit()
+    # Delete record; the bytes go with the last photo referencing them
+    await db.delete(photo)
+    unreferenced = await photo_store.release(db, photo)
+    await db.commit()
+    photo_hashes.get_index().table.remove(photo_id)
+    if unreferenced:
+        await photo_store.purge(db, unreferenced)
     
     return None
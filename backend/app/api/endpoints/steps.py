@@ -1,76 +1,112 @@
 from typing import Any, List
+from datetime import datetime
 
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlmodel import Session, select
+from fastapi import APIRouter, Depends, HTTPException, Response, status
+from sqlmodel import func, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from app.api.deps import get_current_active_user, get_current_qc_engineer
-from app.db.session import get_db
+from app.api.deps import PageParams, get_current_active_user, get_current_qc_engineer
+from app.db.session import get_async_db
 from app.models.user import User
 from app.models.step import Step, StepCreate, StepUpdate, StepRead
+from app.models.template import Template
+from app.services import schema_validation, template_cache, template_revisions
+from app.services.pagination import paginate, set_page_headers, total_count
 
 router = APIRouter()
 
 
+async def touch_template(db: AsyncSession, template_id: int) -> None:
+    """
+    Mark the parent template as modified so offline bundles are rebuilt,
+    and record its revision with the changed steps.
+    """
+    template = await db.get(Template, template_id)
+    if template:
+        template.updated_at = datetime.utcnow()
+        db.add(template)
+        await db.run_sync(template_revisions.record_revision, template)
+
+
 @router.post("/", response_model=StepRead)
 async def create_step(
     *,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     step_in: StepCreate,
     current_user: User = Depends(get_current_qc_engineer),
 ) -> Any:
     """
     Create new step.
     """
+    try:
+        schema_validation.validate(schema_validation.STEP, step_in.model_dump(mode="json"))
+    except schema_validation.SchemaValidationError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=exc.detail("body"),
+        )
     db_step = Step.model_validate(step_in)
+    # Added after the existing steps of the template
+    last_position = (await db.exec(
+        select(func.max(Step.position)).where(Step.template_id == db_step.template_id)
+    )).one()
+    db_step.position = 0 if last_position is None else last_position + 1
     db.add(db_step)
-    db.commit()
-    db.refresh(db_step)
+    await touch_template(db, db_step.template_id)
+    await db.commit()
+    await db.refresh(db_step)
+    await template_cache.invalidate_steps([db_step.id], [db_step.template_id])
     return db_step
 
 
 @router.get("/", response_model=List[StepRead])
 async def list_steps(
     *,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_active_user),
-    skip: int = 0,
-    limit: int = 100,
+    response: Response,
+    page: PageParams = Depends(),
     template_id: int = None,
 ) -> Any:
     """
-    Retrieve steps.
+    Retrieve steps in creation order.
+    Pass the X-Next-Cursor header of a page as cursor to get the next one.
     """
     query = select(Step)
     if template_id:
         query = query.where(Step.template_id == template_id)
     
-    steps = db.exec(query.offset(skip).limit(limit)).all()
-    return steps
+    steps = await paginate(db, query, Step.id, page.after, page.limit)
+    total = None
+    if page.total:
+        total = await total_count(db, query, None if template_id else Step.__tablename__)
+    set_page_headers(response, steps.next_cursor, total)
+    return steps.items
 
 
 @router.get("/{step_id}", response_model=StepRead)
 async def get_step(
     *,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     step_id: int,
     current_user: User = Depends(get_current_active_user),
 ) -> Any:
     """
     Get step by ID.
     """
-    step = db.get(Step, step_id)
-    if not step:
+    content = await template_cache.get_step(db, step_id)
+    if content is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Step not found",
         )
-    return step
+    return Response(content=content, media_type="application/json")
 
 
 @router.put("/{step_id}", response_model=StepRead)
 async def update_step(
     *,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     step_id: int,
     step_in: StepUpdate,
     current_user: User = Depends(get_current_qc_engineer),
@@ -78,7 +114,7 @@ async def update_step(
     """
     Update a step.
     """
-    step = db.get(Step, step_id)
+    step = await db.get(Step, step_id)
     if not step:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -90,9 +126,20 @@ async def update_step(
     for key, value in step_data.items():
         setattr(step, key, value)
     
+    # Validate the step as it will be stored, not just the changed fields
+    try:
+        schema_validation.validate(schema_validation.STEP, step.model_dump(mode="json"))
+    except schema_validation.SchemaValidationError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=exc.detail("body"),
+        )
+    
     db.add(step)
-    db.commit()
-    db.refresh(step)
+    await touch_template(db, step.template_id)
+    await db.commit()
+    await db.refresh(step)
+    await template_cache.invalidate_steps([step_id], [step.template_id])
     
     return step
 
@@ -100,19 +147,21 @@ async def update_step(
 @router.delete("/{step_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_step(
     *,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     step_id: int,
     current_user: User = Depends(get_current_qc_engineer),
 ) -> None:
     """
     Delete a step.
     """
-    step = db.get(Step, step_id)
+    step = await db.get(Step, step_id)
     if not step:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Step not found",
         )
     
-    db.delete(step)
-    db.commit()
+    await db.delete(step)
+    await touch_template(db, step.template_id)
+    await db.commit()
+    await template_cache.invalidate_steps([step_id], [step.template_id])
@@ -1,171 +1,196 @@
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 from datetime import datetime
 import json
 
-from fastapi import APIRouter, Depends, HTTPException, status, Body, Query
-from sqlmodel import Session, select
+from fastapi import APIRouter, Depends, HTTPException, status, Body, Query, Request, Response
+from fastapi.responses import FileResponse
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app.api.deps import get_current_active_user
-from app.db.session import get_db
+from app.db.session import get_async_db
 from app.models.user import User
-from app.models.template import Template, TemplateStatus
+from app.models.template import Template
 from app.models.checklist import QCDoc, QCResult
-from app.models.step import Step
+from app.services import change_log
+from app.services.sync_ingest import ingest_checklists
+from app.services.sync_stream import ndjson_response, stream_checklists, stream_templates, wants_ndjson
+from app.services.template_bundle import ACTIVE_TEMPLATES, assemble, bundle_query, get_fragments, get_full_bundle
 
 router = APIRouter()
 
 
+def parse_cursor(cursor: Optional[str]) -> Optional[int]:
+    """
+    Decode the client cursor, None meaning a full sync; expired cursors get
+    410 Gone, asking for a full sync.
+    """
+    if not cursor:
+        return None
+    try:
+        return change_log.decode_cursor(cursor)
+    except change_log.ExpiredCursor as exc:
+        # The client syncs in full again
+        raise HTTPException(status_code=status.HTTP_410_GONE, detail=str(exc))
+    except change_log.InvalidCursor as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc))
+
+
 @router.post("/templates")
 async def sync_templates(
     *,
-    db: Session = Depends(get_db),
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_active_user),
-    last_sync: datetime = Query(None),  # If None, will sync all templates
-) -> Dict[str, Any]:
+    cursor: str = Query(None),  # If None, will sync all templates
+) -> Response:
     """
     Sync templates and steps for offline use.
-    Returns all active templates modified since last_sync datetime.
+    Returns active templates changed since the cursor, plus deleted ids.
+    Full syncs are served from a prebuilt, pre-compressed bundle.
+    Send "Accept: application/x-ndjson" to receive the templates as a stream.
     """
-    # Get templates modified since last_sync
-    query = select(Template).where(Template.status != TemplateStatus.ARCHIVED)
-    
-    if last_sync:
-        query = query.where(Template.updated_at > last_sync)
-    
-    templates = db.exec(query).all()
-    
-    # Prepare response with templates and their steps
-    result = {
-        "sync_time": datetime.utcnow(),
-        "templates": [],
+    since = parse_cursor(cursor)
+    streaming = wants_ndjson(request)
+
+    if since is None and streaming:
+        until = await change_log.current_sequence(db)
+        return ndjson_response(stream_templates(change_log.encode_cursor(until), None, {}))
+
+    if since is None:
+        bundle = await get_full_bundle(db)
+        if request.headers.get("if-none-match") == bundle.etag:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": bundle.etag})
+
+        headers = {"ETag": bundle.etag, "Vary": "Accept-Encoding"}
+        if "gzip" in request.headers.get("accept-encoding", ""):
+            headers["Content-Encoding"] = "gzip"
+            return FileResponse(bundle.gzip_path, media_type="application/json", headers=headers)
+        return FileResponse(bundle.path, media_type="application/json", headers=headers)
+
+    # Get templates changed since the cursor; a step change re-sends its template
+    until = await change_log.current_sequence(db)
+    changes = await change_log.read_changes(db, since, until, [change_log.TEMPLATE, change_log.STEP])
+    changed_ids = changes.upserted.get(change_log.TEMPLATE, set()) | changes.parents.get(change_log.STEP, set())
+    deleted_ids = changes.deleted.get(change_log.TEMPLATE, set())
+    changed_ids -= deleted_ids
+
+    active_ids = set()
+    if changed_ids:
+        active_ids = set(await db.exec(select(Template.id).where(ACTIVE_TEMPLATES, Template.id.in_(changed_ids))))
+
+    # Templates that were archived since the cursor disappear from devices too
+    deleted_ids |= changed_ids - active_ids
+    deleted = {
+        "templates": sorted(deleted_ids),
+        "steps": sorted(changes.deleted.get(change_log.STEP, set())),
     }
-    
-    for template in templates:
-        # Get steps for template
-        steps = db.exec(select(Step).where(Step.template_id == template.id)).all()
-        
-        # Convert to dict for serialization
-        template_dict = template.model_dump()
-        template_dict["steps"] = [step.model_dump() for step in steps]
-        
-        result["templates"].append(template_dict)
-    
-    return result
+
+    if streaming:
+        return ndjson_response(stream_templates(change_log.encode_cursor(until), active_ids, deleted))
+
+    templates = []
+    if active_ids:
+        templates = (await db.exec(bundle_query().where(Template.id.in_(active_ids)).order_by(Template.id))).all()
+
+    return Response(
+        content=assemble(change_log.encode_cursor(until), await get_fragments(db, templates), deleted),
+        media_type="application/json",
+    )
 
 
 @router.post("/checklists")
 async def sync_checklists(
     *,
-    db: Session = Depends(get_db),
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_active_user),
-    last_sync: datetime = Query(None),  # If None, will sync all user's checklists
+    cursor: str = Query(None),  # If None, will sync all user's checklists
     offline_checklists: List[Dict[str, Any]] = Body([]),  # Checklists created/updated offline
 ) -> Dict[str, Any]:
     """
     Bidirectional sync of checklists and results.
-    Receives checklists created/updated offline and returns new server changes.
+    Receives checklists created/updated offline and returns server changes
+    since the cursor, including deleted checklists and results.
+    Send "Accept: application/x-ndjson" to receive the changes as a stream.
     """
-    # Step 1: Process offline checklists (upload to server)
-    for offline_checklist in offline_checklists:
-        # Check if checklist exists by ID if provided
-        existing_checklist = None
-        if "id" in offline_checklist and offline_checklist["id"] is not None:
-            existing_checklist = db.get(QCDoc, offline_checklist["id"])
-        
-        if existing_checklist:
-            # Update existing checklist
-            for key, value in offline_checklist.items():
-                if key not in ["id", "results", "created_at", "updated_at"]:
-                    setattr(existing_checklist, key, value)
-            
-            existing_checklist.updated_at = datetime.utcnow()
-            db.add(existing_checklist)
-            db.commit()
-            db.refresh(existing_checklist)
-            
-            # Process results
-            if "results" in offline_checklist:
-                for offline_result in offline_checklist["results"]:
-                    # Check if result exists
-                    existing_result = None
-                    if "id" in offline_result and offline_result["id"] is not None:
-                        existing_result = db.get(QCResult, offline_result["id"])
-                    elif "step_id" in offline_result:
-                        # Look for result by step_id and checklist_id
-                        existing_result = db.exec(
-                            select(QCResult).where(
-                                QCResult.qc_doc_id == existing_checklist.id,
-                                QCResult.step_id == offline_result["step_id"]
-                            )
-                        ).first()
-                    
-                    if existing_result:
-                        # Update existing result
-                        for key, value in offline_result.items():
-                            if key not in ["id", "qc_doc_id", "created_at"]:
-                                setattr(existing_result, key, value)
-                        
-                        db.add(existing_result)
-                    else:
-                        # Create new result
-                        new_result = QCResult(
-                            **{k: v for k, v in offline_result.items() if k not in ["id", "created_at"]},
-                            qc_doc_id=existing_checklist.id,
-                            created_at=datetime.utcnow(),
-                        )
-                        db.add(new_result)
-        else:
-            # Create new checklist
-            new_checklist = QCDoc(
-                **{k: v for k, v in offline_checklist.items() if k not in ["id", "results", "created_at", "updated_at"]},
-                created_by_id=current_user.id,  # Always use current user for new checklists
-                created_at=datetime.utcnow(),
-                updated_at=datetime.utcnow(),
-            )
-            db.add(new_checklist)
-            db.commit()
-            db.refresh(new_checklist)
-            
-            # Process results
-            if "results" in offline_checklist:
-                for offline_result in offline_checklist["results"]:
-                    new_result = QCResult(
-                        **{k: v for k, v in offline_result.items() if k not in ["id", "qc_doc_id", "created_at"]},
-                        qc_doc_id=new_checklist.id,
-                        created_at=datetime.utcnow(),
-                    )
-                    db.add(new_result)
-    
-    db.commit()
-    
-    # Step 2: Get checklists modified since last_sync (download to client)
-    query = select(QCDoc)
-    
+    since = parse_cursor(cursor)
+
+    # Step 1: Process offline checklists (upload to server) as one batch
+    outcomes = await db.run_sync(ingest_checklists, offline_checklists, current_user)
+
+    # Step 2: Get checklists changed since the cursor (download to client)
+    until = await change_log.current_sequence(db)
+
     # Only sync checklists created by or assigned to current user
-    query = query.where(
-        (QCDoc.created_by_id == current_user.id) | 
-        (QCDoc.signed_off_by_id == current_user.id)
-    )
-    
-    if last_sync:
-        query = query.where(QCDoc.updated_at > last_sync)
-    
-    checklists = db.exec(query).all()
-    
+    visible = (QCDoc.created_by_id == current_user.id) | (QCDoc.signed_off_by_id == current_user.id)
+    query = select(QCDoc).where(visible)
+
+    changed_ids = None
+    deleted = {"checklists": [], "results": []}
+    if since is not None:
+        changes = await change_log.read_changes(db, since, until, [change_log.CHECKLIST, change_log.RESULT])
+        changed_ids = changes.upserted.get(change_log.CHECKLIST, set()) | changes.parents.get(change_log.RESULT, set())
+        changed_ids -= changes.deleted.get(change_log.CHECKLIST, set())
+
+        # Deletions of other users' checklists and results are not sent; a
+        # deleted checklist is only known by the author recorded with it
+        deleted_checklists = {
+            checklist_id
+            for checklist_id, author_id in changes.deleted_parents.get(change_log.CHECKLIST, {}).items()
+            if author_id == current_user.id
+        }
+        deleted_results = changes.deleted_parents.get(change_log.RESULT, {})
+        result_parents = set(deleted_results.values()) - deleted_checklists
+        visible_parents = deleted_checklists
+        if result_parents:
+            visible_parents = visible_parents | set(
+                await db.exec(select(QCDoc.id).where(visible, QCDoc.id.in_(result_parents)))
+            )
+        deleted = {
+            "checklists": sorted(deleted_checklists),
+            "results": sorted(
+                result_id for result_id, checklist_id in deleted_results.items() if checklist_id in visible_parents
+            ),
+        }
+
+    if wants_ndjson(request):
+        return ndjson_response(stream_checklists(
+            query,
+            change_log.encode_cursor(until),
+            changed_ids,
+            deleted,
+            [outcome.model_dump() for outcome in outcomes],
+        ))
+
+    if changed_ids is not None:
+        query = query.where(QCDoc.id.in_(changed_ids))
+    checklists = (await db.exec(query.order_by(QCDoc.id))).all()
+
+    # Get results for all returned checklists at once
+    results_by_checklist: Dict[int, List[Dict[str, Any]]] = {checklist.id: [] for checklist in checklists}
+    if checklists:
+        results = await db.exec(
+            select(QCResult)
+            .where(QCResult.qc_doc_id.in_(results_by_checklist.keys()))
+            .order_by(QCResult.qc_doc_id, QCResult.id)
+        )
+        for qc_result in results:
+            results_by_checklist[qc_result.qc_doc_id].append(qc_result.model_dump())
+
     # Prepare response with checklists and their results
     result = {
-        "sync_time": datetime.utcnow(),
+        "cursor": change_log.encode_cursor(until),
+        "uploaded": [outcome.model_dump() for outcome in outcomes],
         "checklists": [],
+        "deleted": deleted,
     }
-    
+
     for checklist in checklists:
-        # Get results for checklist
-        results = db.exec(select(QCResult).where(QCResult.qc_doc_id == checklist.id)).all()
-        
         # Convert to dict for serialization
         checklist_dict = checklist.model_dump()
-        checklist_dict["results"] = [result.model_dump() for result in results]
-        
+        checklist_dict["results"] = results_by_checklist[checklist.id]
+
         result["checklists"].append(checklist_dict)
-    
+
     return result
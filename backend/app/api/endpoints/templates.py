@@ -1,74 +1,134 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlmodel import Session, select
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from typing import List
+from datetime import datetime
 
-from app.api.deps import get_current_user
-from app.db.session import get_db
-from app.models.template import Template, TemplateCreate, TemplateUpdate
+from app.api.deps import PageParams, get_current_qc_engineer, get_current_user
+from app.db.session import get_async_db
+from app.models.step import StepBase
+from app.models.template import (
+    Template,
+    TemplateCreate,
+    TemplateUpdate,
+    TemplateReadWithStats,
+    TemplateReadWithSteps,
+)
+from app.models.template_revision import TemplateDiff
 from app.models.user import User
+from app.services import schema_validation, template_cache, template_revisions, template_stats, template_steps
+from app.services.pagination import set_page_headers, total_count
 
 router = APIRouter()
 
 @router.get("", response_model=List[Template])
 async def list_templates(
-    skip: int = 0,
-    limit: int = 100,
+    page: PageParams = Depends(),
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
-    Get list of templates
+    Get list of templates, oldest first
+    Pass the X-Next-Cursor header of a page as cursor to get the next one
     """
-    templates = db.exec(select(Template).offset(skip).limit(limit)).all()
-    return templates
+    content, next_cursor = await template_cache.list_templates(db, page.after, page.limit)
+    response = Response(content=content, media_type="application/json")
+    total = await total_count(db, select(Template), Template.__tablename__) if page.total else None
+    set_page_headers(response, next_cursor, total)
+    return response
 
-@router.post("", response_model=Template)
+@router.post("", response_model=TemplateReadWithSteps)
 async def create_template(
     template_in: TemplateCreate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
-    Create new template
+    Create new template, together with its steps
     """
-    template = Template.from_orm(template_in)
-    template.created_by_id = current_user.id
-    
-    db.add(template)
-    db.commit()
-    db.refresh(template)
+    try:
+        schema_validation.validate(schema_validation.TEMPLATE, template_in.model_dump(mode="json"))
+    except schema_validation.SchemaValidationError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=exc.detail("body")
+        )
+    try:
+        template = await db.run_sync(template_steps.create_template, template_in, current_user)
+    except template_steps.DuplicateStepCodes as exc:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=str(exc)
+        )
+    await template_cache.invalidate_templates([template.id])
     
     return template
 
+@router.get("/stats", response_model=List[TemplateReadWithStats])
+async def list_template_stats(
+    response: Response,
+    page: PageParams = Depends(),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Get list of templates with step and checklist counts, first-pass yield
+    and average execution time, read from the materialized statistics
+    """
+    templates = await template_stats.list_template_stats(db, page.after, page.limit)
+    total = await total_count(db, select(Template), Template.__tablename__) if page.total else None
+    set_page_headers(response, templates.next_cursor, total)
+    return templates.items
+
 @router.get("/{template_id}", response_model=Template)
 async def get_template(
     template_id: int,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Get template by ID
     """
-    template = db.get(Template, template_id)
-    if not template:
+    content = await template_cache.get_template(db, template_id)
+    if content is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Template not found"
         )
     
-    return template
+    return Response(content=content, media_type="application/json")
+
+@router.get("/{template_id}/diff", response_model=TemplateDiff)
+async def get_template_diff(
+    template_id: int,
+    from_revision: str = Query(..., alias="from"),
+    to_revision: str = Query(..., alias="to"),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Compare two revisions of a template, matching steps by code
+    """
+    content = await template_revisions.get_diff(db, template_id, from_revision, to_revision)
+    if content is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Revision not found"
+        )
+    
+    return Response(content=content, media_type="application/json")
 
 @router.put("/{template_id}", response_model=Template)
 async def update_template(
     template_id: int,
     template_in: TemplateUpdate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Update template
     """
-    template = db.get(Template, template_id)
+    template = await db.get(Template, template_id)
     if not template:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -84,24 +144,80 @@ async def update_template(
     for field, value in template_in.dict(exclude_unset=True).items():
         setattr(template, field, value)
     
+    # Validate the template as it will be stored, not just the changed fields
+    try:
+        schema_validation.validate(schema_validation.TEMPLATE, template.model_dump(mode="json"))
+    except schema_validation.SchemaValidationError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=exc.detail("body")
+        )
+    
+    template.updated_at = datetime.utcnow()
     template.updated_by_id = current_user.id
     
     db.add(template)
-    db.commit()
-    db.refresh(template)
+    await db.run_sync(template_revisions.record_revision, template)
+    await db.commit()
+    await db.refresh(template)
+    await template_cache.invalidate_templates([template_id])
     
     return template
 
+@router.put("/{template_id}/steps", response_model=TemplateReadWithSteps)
+async def replace_template_steps(
+    template_id: int,
+    steps_in: List[StepBase],
+    current_user: User = Depends(get_current_qc_engineer),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Replace all steps of a template, matching existing steps by code
+    Steps are stored in the order given
+    """
+    template = await db.get(Template, template_id)
+    if not template:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Template not found"
+        )
+    
+    try:
+        schema_validation.validate_all(
+            schema_validation.STEP, [step_in.model_dump(mode="json") for step_in in steps_in]
+        )
+    except schema_validation.SchemaValidationError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=exc.detail("body")
+        )
+    
+    try:
+        template_read, changed_step_ids = await db.run_sync(template_steps.replace_steps, template, steps_in)
+    except template_steps.DuplicateStepCodes as exc:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=str(exc)
+        )
+    except template_steps.StepsInUse as exc:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(exc)
+        )
+    await template_cache.invalidate_steps(changed_step_ids, [template_id])
+    
+    return template_read
+
 @router.delete("/{template_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_template(
     template_id: int,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Delete template
     """
-    template = db.get(Template, template_id)
+    template = await db.get(Template, template_id)
     if not template:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -114,7 +230,8 @@ async def delete_template(
             detail="Not enough permissions"
         )
     
-    db.delete(template)
-    db.commit()
+    await db.delete(template)
+    await db.commit()
+    await template_cache.invalidate_templates([template_id])
     
     return None
@@ -1,10 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlmodel import Session, select
+from fastapi import APIRouter, Depends, HTTPException, Response, status
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from typing import List
 
-from app.api.deps import get_current_user
-from app.db.session import get_db
+from app.api.deps import PageParams, get_current_user
+from app.core.security import get_password_hash_async
+from app.db.session import get_async_db
 from app.models.user import User, UserUpdate
+from app.services.pagination import paginate, set_page_headers, total_count
 
 router = APIRouter()
 
@@ -19,32 +22,35 @@ async def get_current_user_info(current_user: User = Depends(get_current_user)):
 async def update_user(
     user_in: UserUpdate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Update current user information
     """
+    # current_user is a cached snapshot; edit the row itself
+    user = await db.get(User, current_user.id)
     for field, value in user_in.dict(exclude_unset=True).items():
         if field == "password" and value:
-            current_user.set_password(value)
+            user.hashed_password = await get_password_hash_async(value)
         else:
-            setattr(current_user, field, value)
+            setattr(user, field, value)
     
-    db.add(current_user)
-    db.commit()
-    db.refresh(current_user)
+    db.add(user)
+    await db.commit()  # Evicts the cached principal
+    await db.refresh(user)
     
-    return current_user
+    return user
 
 @router.get("", response_model=List[User])
 async def get_users(
-    skip: int = 0,
-    limit: int = 100,
+    response: Response,
+    page: PageParams = Depends(),
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Get list of users (admin only)
+    Pass the X-Next-Cursor header of a page as cursor to get the next one
     """
     if not current_user.is_admin:
         raise HTTPException(
@@ -52,14 +58,16 @@ async def get_users(
             detail="Not enough permissions"
         )
     
-    users = db.exec(select(User).offset(skip).limit(limit)).all()
-    return users
+    users = await paginate(db, select(User), User.id, page.after, page.limit)
+    total = await total_count(db, select(User), User.__tablename__) if page.total else None
+    set_page_headers(response, users.next_cursor, total)
+    return users.items
 
 @router.get("/{user_id}", response_model=User)
 async def get_user(
     user_id: int,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Get user by ID (admin only)
@@ -70,7 +78,7 @@ async def get_user(
             detail="Not enough permissions"
         )
     
-    user = db.get(User, user_id)
+    user = await db.get(User, user_id)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -1,57 +1,8 @@
-from typing import Optional
-from fastapi import Depends, HTTPException, status
-from fastapi.security import OAuth2PasswordBearer
-from jose import JWTError, jwt
-from pydantic import ValidationError
-from sqlmodel import Session, select
-from datetime import datetime
+from fastapi import Depends, HTTPException
 
-from app.core.config import settings
-from app.core.security import ALGORITHM
-from app.db.session import get_db
-from app.models.user import User, TokenData
-
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"{settings.API_V1_STR}/auth/login")
-
-
-async def get_current_user(
-    db: Session = Depends(get_db), 
-    token: str = Depends(oauth2_scheme)
-) -> User:
-    """
-    Get the current authenticated user from JWT token
-    """
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-        token_data = TokenData(username=email)
-    except (JWTError, ValidationError):
-        raise credentials_exception
-    
-    user = db.query(User).filter(User.email == token_data.username).first()
-    if user is None:
-        raise credentials_exception
-    
-    return user
-
-
-async def get_current_active_user(
-    current_user: User = Depends(get_current_user)
-) -> User:
-    """
-    Get current active user
-    """
-    if not current_user.is_active:
-        raise HTTPException(status_code=400, detail="Inactive user")
-    return current_user
+# Token decoding and the cached user lookup live in app.api.deps
+from app.api.deps import get_current_active_user, get_current_user, oauth2_scheme
+from app.models.user import User
 
 
 async def get_current_superuser(
@@ -1,3 +1,5 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Any, Dict, Optional, Union
 
@@ -19,6 +21,13 @@ ACCESS_TOKEN_EXPIRE_MINUTES = settings.ACCESS_TOKEN_EXPIRE_MINUTES
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"{settings.API_V1_STR}/auth/login")
 
+# bcrypt takes hundreds of milliseconds per call and releases the GIL. Calls
+# from request handlers run on this dedicated pool so they neither block the
+# event loop nor starve the threadpool shared with the other endpoints.
+_password_pool = ThreadPoolExecutor(
+    max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash"
+)
+
 
 class TokenPayload(BaseModel):
     sub: Optional[str] = None
@@ -45,6 +54,18 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """Verify a password on the password hashing pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_password_pool, verify_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    """Hash a password on the password hashing pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_password_pool, get_password_hash, password)
+
+
 # This will be imported by deps.py after model definitions are available
 # def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)) -> User:
 #     credentials_exception = HTTPException(
@@ -0,0 +1,84 @@
+"""
+Compute the perceptual hashes of photos uploaded before they were hashed.
+
+New uploads are hashed by the post-upload pipeline; this fills in the rest,
+``--workers`` images at a time. Safe to re-run; hashed photos are skipped.
+Running workers pick the hashes up within PHASH_INDEX_REFRESH_SECONDS.
+
+Usage: python -m app.db.backfill_photo_hashes [--batch-size N] [--workers N]
+"""
+
+import argparse
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import update
+from sqlmodel import Session, select
+
+from app.db.session import engine
+from app.models.photo import Photo
+from app.services import imaging, photo_store
+from app.services.photo_hashes import to_signed
+
+logger = logging.getLogger(__name__)
+
+
+def _hash(name: str) -> Optional[int]:
+    try:
+        return imaging.dhash(str(photo_store.blob_path(name)))
+    except Exception as exc:
+        logger.warning("Could not hash %s: %s", name, exc)
+        return None
+
+
+def backfill_photo_hashes(batch_size: int = 500, workers: int = 4) -> None:
+    """Hash every photo without a hash, ``batch_size`` photos per transaction."""
+    hashed = failed = 0
+    last_id = 0
+    with Session(engine) as session, ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+    ) as pool:
+        while True:
+            rows = session.exec(
+                select(Photo.id, Photo.filename)
+                .where(Photo.id > last_id, Photo.phash.is_(None))
+                .order_by(Photo.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+
+            now = datetime.utcnow()
+            for (photo_id, _), value in zip(
+                rows, pool.map(_hash, [filename for _, filename in rows])
+            ):
+                if value is None:
+                    failed += 1
+                    continue
+                session.execute(
+                    update(Photo)
+                    .where(Photo.id == photo_id)
+                    .values(phash=to_signed(value), phash_at=now)
+                )
+                hashed += 1
+            session.commit()
+            logger.info("Hashed photos up to id %d", last_id)
+
+    logger.info("Hashed %d photos, %d could not be read", hashed, failed)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--batch-size", type=int, default=500, help="Photos hashed per transaction"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=4, help="Processes decoding images"
+    )
+    args = parser.parse_args()
+    backfill_photo_hashes(batch_size=args.batch_size, workers=args.workers)
@@ -0,0 +1,71 @@
+"""
+Record the current revision of templates created before revisions were kept.
+
+Writes record revisions as they happen; this records the state of every
+template once, so later revisions can be compared with it. Safe to re-run:
+recorded revisions are left alone unless they are drafts that changed.
+
+Usage: python -m app.db.backfill_template_revisions [--batch-size N]
+"""
+
+import argparse
+import logging
+from typing import Dict, List
+
+from sqlmodel import Session, select
+
+from app.db.session import engine
+from app.models.step import Step
+from app.models.template import Template
+from app.services import template_revisions
+
+logger = logging.getLogger(__name__)
+
+
+def backfill_template_revisions(batch_size: int = 200) -> None:
+    """Record the revision of every template, ``batch_size`` templates per transaction."""
+    recorded = 0
+    last_id = 0
+    with Session(engine) as session:
+        while True:
+            templates = session.exec(
+                select(Template)
+                .where(Template.id > last_id)
+                .order_by(Template.id)
+                .limit(batch_size)
+            ).all()
+            if not templates:
+                break
+            last_id = templates[-1].id
+
+            steps: Dict[int, List[Step]] = {template.id: [] for template in templates}
+            for step in session.exec(
+                select(Step)
+                .where(Step.template_id.in_(list(steps)))
+                .order_by(Step.template_id, Step.position, Step.id)
+            ):
+                steps[step.template_id].append(step)
+            template_revisions.record_revisions(
+                session,
+                [
+                    template_revisions.snapshot(template, steps[template.id])
+                    for template in templates
+                ],
+            )
+            session.commit()
+            # The templates of a batch are not needed again
+            session.expunge_all()
+            recorded += len(templates)
+            logger.info("Recorded revisions of templates up to id %d", last_id)
+
+    logger.info("Recorded the revisions of %d templates", recorded)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--batch-size", type=int, default=200, help="Templates recorded per transaction"
+    )
+    args = parser.parse_args()
+    backfill_template_revisions(batch_size=args.batch_size)
@@ -5,6 +5,10 @@ from app.models.step import Step
 from app.models.checklist import QCDoc, QCResult
 from app.models.stage import Stage
 from app.models.product_model import ProductModel
+from app.models.change_log import ChangeLog
+from app.models.template_stats import TemplateStats
+from app.models.template_revision import StepRevision, TemplateRevision
+from app.models.photo import Photo, PhotoBlob
 
 # Define relationships here to avoid circular imports
 from sqlmodel import Relationship
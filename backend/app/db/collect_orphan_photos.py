@@ -0,0 +1,343 @@
+"""
+Report or delete photos and stored files that nothing refers to.
+
+Orphans are:
+
+- photos of deleted checklists, and photos uploaded without a checklist
+  that no QC result points at;
+- blobs left unreferenced when the deletion of their last photo was
+  interrupted before the bytes were purged;
+- files under UPLOADS_DIR owned by no photo, left by failed requests,
+  crashes or restores, including originals already replaced by their
+  re-encoded copy;
+- variants under PHOTO_VARIANTS_DIR whose photo file is gone or that are
+  not at the sharded path of their photo, and stale temporary files of
+  uploads and variant renders.
+
+Anything younger than the grace period is kept, since in-flight uploads
+look just the same. The photo table is read in id batches and directories
+are walked with os.scandir, checking the names of each batch against the
+database, so memory stays bounded with millions of files. Orphans are only
+reported unless --delete is given.
+
+Usage: python -m app.db.collect_orphan_photos [--delete] [--grace-hours N] [--batch-size N]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import re
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterator, List, Set
+
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.config import settings
+from app.db.session import AsyncSessionLocal
+from app.models.checklist import QCDoc, QCResult
+from app.models.photo import Photo, PhotoBlob
+from app.services import imaging, photo_store
+
+logger = logging.getLogger(__name__)
+
+# Stem of a variant rendered from a content-addressed file
+STORED_STEM = re.compile(r"^([0-9a-f]{64})(\.min)?$")
+
+
+def _walk(directory: Path, skip: Set[str]) -> Iterator[os.DirEntry]:
+    # Depth first, so only one listing per level is open at a time
+    try:
+        entries = os.scandir(directory)
+    except FileNotFoundError:
+        return
+    with entries:
+        for entry in entries:
+            if entry.name.startswith(".") and entry.is_dir(follow_symlinks=False):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                if os.path.realpath(entry.path) not in skip:
+                    yield from _walk(Path(entry.path), skip)
+            elif entry.is_file(follow_symlinks=False):
+                yield entry
+
+
+def _batches(entries: Iterator[os.DirEntry], size: int) -> Iterator[List[os.DirEntry]]:
+    batch: List[os.DirEntry] = []
+    for entry in entries:
+        batch.append(entry)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _settled(entry: os.DirEntry, cutoff: float) -> bool:
+    try:
+        return entry.stat(follow_symlinks=False).st_mtime < cutoff
+    except FileNotFoundError:
+        return False
+
+
+def _unlink(path: str) -> None:
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+async def collect_photos(
+    db: AsyncSession, cutoff: datetime, batch_size: int, delete: bool
+) -> int:
+    """Photos without a checklist that no QC result points at."""
+    orphans = 0
+    last_id = 0
+    while True:
+        rows = (
+            await db.exec(
+                select(Photo, PhotoBlob.extension)
+                .outerjoin(QCDoc, QCDoc.id == Photo.checklist_id)
+                .outerjoin(PhotoBlob, PhotoBlob.sha256 == Photo.sha256)
+                .where(
+                    Photo.id > last_id, Photo.created_at < cutoff, QCDoc.id.is_(None)
+                )
+                .order_by(Photo.id)
+                .limit(batch_size)
+            )
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1][0].id
+
+        # QC results hold the name returned on upload, which is the original
+        # until it is re-encoded, as a bare name or as the public /photos URL
+        names: Dict[int, Set[str]] = {}
+        for photo, extension in rows:
+            photo_names = {photo.filename}
+            if extension is not None and photo.sha256 is not None:
+                photo_names.add(photo_store.blob_name(photo.sha256, extension))
+            names[photo.id] = photo_names | {f"/photos/{name}" for name in photo_names}
+        referenced = set(
+            (
+                await db.exec(
+                    select(QCResult.photo_path).where(
+                        QCResult.photo_path.in_(set().union(*names.values()))
+                    )
+                )
+            ).all()
+        )
+
+        unreferenced = []
+        for photo, _ in rows:
+            if names[photo.id] & referenced:
+                continue
+            orphans += 1
+            logger.info("Orphaned photo %d: %s", photo.id, photo.filename)
+            if delete:
+                await db.delete(photo)
+                unreferenced.append(await photo_store.release(db, photo))
+        await db.commit()
+        for name in unreferenced:
+            if name:
+                await photo_store.purge(db, name)
+    return orphans
+
+
+async def collect_released_blobs(
+    db: AsyncSession, batch_size: int, delete: bool
+) -> int:
+    """Blobs whose last photo was deleted without purging the bytes, e.g. by a crash."""
+    orphans = 0
+    last_sha256 = ""
+    while True:
+        blobs = (
+            await db.exec(
+                select(PhotoBlob.sha256, PhotoBlob.extension, PhotoBlob.encoded_name)
+                .where(PhotoBlob.sha256 > last_sha256, PhotoBlob.ref_count <= 0)
+                .order_by(PhotoBlob.sha256)
+                .limit(batch_size)
+            )
+        ).all()
+        await db.rollback()
+        if not blobs:
+            break
+        last_sha256 = blobs[-1][0]
+        for sha256, extension, encoded in blobs:
+            orphans += 1
+            name = encoded or photo_store.blob_name(sha256, extension)
+            logger.info("Released blob: %s", name)
+            if delete:
+                await photo_store.purge(db, name)
+    return orphans
+
+
+async def _referenced_files(db: AsyncSession, names: List[str]) -> Set[str]:
+    referenced = set(
+        (await db.exec(select(Photo.filename).where(Photo.filename.in_(names)))).all()
+    )
+    hashes = {
+        Path(name).name[:64] for name in names if photo_store.STORED_NAME.match(name)
+    }
+    if hashes:
+        blobs = (
+            await db.exec(
+                select(
+                    PhotoBlob.sha256, PhotoBlob.extension, PhotoBlob.encoded_name
+                ).where(PhotoBlob.sha256.in_(hashes))
+            )
+        ).all()
+        for sha256, extension, encoded in blobs:
+            if encoded is not None:
+                # The original is deleted once no photo points at it any more
+                referenced.add(encoded)
+            else:
+                referenced.add(photo_store.blob_name(sha256, extension))
+    return referenced
+
+
+async def collect_files(
+    db: AsyncSession, cutoff: float, batch_size: int, delete: bool
+) -> Dict[str, int]:
+    """Files under UPLOADS_DIR that no photo or blob owns."""
+    counts = {"files": 0, "unknown": 0}
+    root = Path(settings.UPLOADS_DIR)
+    skip = {
+        os.path.realpath(path)
+        for path in (
+            settings.UPLOADS_TMP_DIR,
+            settings.UPLOAD_SESSIONS_DIR,
+            settings.PHOTO_VARIANTS_DIR,
+        )
+    }
+    entries = (entry for entry in _walk(root, skip) if not entry.name.startswith("."))
+    for batch in _batches(entries, batch_size):
+        named = {
+            Path(os.path.relpath(entry.path, root)).as_posix(): entry for entry in batch
+        }
+        referenced = await _referenced_files(db, list(named))
+        for name, entry in named.items():
+            if name in referenced or not _settled(entry, cutoff):
+                continue
+            if not photo_store.is_stored_name(name):
+                # Not a name this application writes; leave it to an admin
+                counts["unknown"] += 1
+                logger.warning("Unknown file in uploads: %s", name)
+                continue
+            counts["files"] += 1
+            logger.info("Orphaned file: %s", name)
+            if delete:
+                _unlink(entry.path)
+                imaging.delete_variants(name)
+        # Don't keep a snapshot open while walking the next directories
+        await db.rollback()
+    return counts
+
+
+def _variant_sources(stem: str) -> List[str]:
+    match = STORED_STEM.match(stem)
+    if match is None:
+        # Legacy flat file
+        return [stem + extension for extension in settings.ALLOWED_UPLOAD_EXTENSIONS]
+    sha256, encoded = match.groups()
+    if encoded:
+        return [
+            photo_store.encoded_name(sha256, extension)
+            for extension in photo_store.ENCODED_EXTENSIONS.values()
+        ]
+    return [
+        photo_store.blob_name(sha256, extension)
+        for extension in settings.ALLOWED_UPLOAD_EXTENSIONS
+    ]
+
+
+def _has_source(entry: os.DirEntry, variant: str) -> bool:
+    # Variants outside the sharded layout, e.g. written before it, are orphans too
+    path = Path(entry.path)
+    return any(
+        photo_store.blob_path(name).is_file()
+        and imaging.variant_path(name, variant) == path
+        for name in _variant_sources(path.stem)
+    )
+
+
+def collect_variants(cutoff: float, delete: bool) -> int:
+    """Variants of files that are gone or not where lookups expect them, and stale renders."""
+    orphans = 0
+    for variant in imaging.VARIANTS:
+        for entry in _walk(Path(settings.PHOTO_VARIANTS_DIR) / variant, set()):
+            if not _settled(entry, cutoff):
+                continue
+            # Temporary files of renders interrupted by a crash start with a dot
+            if not entry.name.startswith(".") and _has_source(entry, variant):
+                continue
+            orphans += 1
+            logger.info("Orphaned %s: %s", variant, entry.name)
+            if delete:
+                _unlink(entry.path)
+    return orphans
+
+
+def collect_temporary_uploads(cutoff: float, delete: bool) -> int:
+    """Partial files of uploads aborted by a crash."""
+    orphans = 0
+    for entry in _walk(Path(settings.UPLOADS_TMP_DIR), set()):
+        if entry.name.endswith(".part") and _settled(entry, cutoff):
+            orphans += 1
+            if delete:
+                _unlink(entry.path)
+    return orphans
+
+
+async def collect_orphan_photos(
+    delete: bool = False, grace_hours: float = 168, batch_size: int = 1000
+) -> None:
+    """Report, or delete, orphans older than ``grace_hours``."""
+    grace = timedelta(hours=grace_hours)
+    cutoff = time.time() - grace.total_seconds()
+    async with AsyncSessionLocal() as db:
+        photos = await collect_photos(db, datetime.utcnow() - grace, batch_size, delete)
+        blobs = await collect_released_blobs(db, batch_size, delete)
+        files = await collect_files(db, cutoff, batch_size, delete)
+    variants = collect_variants(cutoff, delete)
+    temporary = collect_temporary_uploads(cutoff, delete)
+
+    logger.info(
+        "%s %d photos, %d released blobs, %d files, %d variants and %d temporary uploads; "
+        "%d unknown files left alone",
+        "Deleted" if delete else "Found orphaned",
+        photos,
+        blobs,
+        files["files"],
+        variants,
+        temporary,
+        files["unknown"],
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--delete",
+        action="store_true",
+        help="Delete the orphans instead of reporting them",
+    )
+    parser.add_argument(
+        "--grace-hours",
+        type=float,
+        default=168,
+        help="Age below which nothing is collected",
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=1000, help="Photos or files checked per query"
+    )
+    args = parser.parse_args()
+    asyncio.run(
+        collect_orphan_photos(
+            delete=args.delete, grace_hours=args.grace_hours, batch_size=args.batch_size
+        )
+    )
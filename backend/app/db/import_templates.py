@@ -0,0 +1,136 @@
+"""
+Import template files in bulk.
+
+Reads the ``*.json`` files of a directory tree or of a .zip or .tar(.gz)
+archive, in the format of ``templates/example-template.json``. Files are
+parsed and validated in a process pool while the previous batch is written,
+and each batch is loaded in one transaction. Safe to re-run: templates
+already at the revision of their file are skipped.
+
+Usage: python -m app.db.import_templates PATH [--batch-size N] [--workers N]
+"""
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import tarfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Iterable, Iterator, List, Tuple
+
+from sqlmodel import Session
+
+from app.db.session import engine
+from app.services import template_cache
+from app.services.cache import get_cache
+from app.services.template_import import ImportStats, TemplateImporter, parse_template
+
+logger = logging.getLogger(__name__)
+
+
+def iter_files(path: str) -> Iterator[Tuple[str, bytes]]:
+    """Yield the name and content of every JSON file under ``path``."""
+    if os.path.isdir(path):
+        for directory, subdirectories, filenames in os.walk(path):
+            subdirectories.sort()
+            for filename in sorted(filenames):
+                if filename.endswith(".json"):
+                    full_path = os.path.join(directory, filename)
+                    with open(full_path, "rb") as file:
+                        yield os.path.relpath(full_path, path), file.read()
+    elif zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and info.filename.endswith(".json"):
+                    yield info.filename, archive.read(info)
+    elif tarfile.is_tarfile(path):
+        with tarfile.open(path) as archive:
+            for member in archive:
+                if member.isfile() and member.name.endswith(".json"):
+                    yield member.name, archive.extractfile(member).read()
+    elif path.endswith(".json"):
+        with open(path, "rb") as file:
+            yield os.path.basename(path), file.read()
+    else:
+        raise ValueError(f"Not a directory, archive or JSON file: {path}")
+
+
+def _chunks(
+    files: Iterator[Tuple[str, bytes]], size: int
+) -> Iterator[List[Tuple[str, bytes]]]:
+    while chunk := list(islice(files, size)):
+        yield chunk
+
+
+async def _invalidate_caches(stats: ImportStats) -> None:
+    try:
+        await template_cache.invalidate_steps(stats.step_ids, stats.template_ids)
+    finally:
+        await get_cache().backend.close()
+
+
+def import_templates(path: str, batch_size: int = 500, workers: int = 4) -> ImportStats:
+    """Import every template file under ``path``, ``batch_size`` files per transaction."""
+    started = time.monotonic()
+    files = 0
+    with Session(engine) as session, ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+    ) as pool:
+        importer = TemplateImporter(session)
+        parsing: Iterable = ()
+        for chunk in _chunks(iter_files(path), batch_size):
+            # The pool parses this chunk while the previous one is written
+            next_parsing = pool.map(
+                parse_template,
+                [name for name, _ in chunk],
+                [content for _, content in chunk],
+                chunksize=max(1, len(chunk) // (workers * 4)),
+            )
+            importer.load(parsing)
+            parsing = next_parsing
+            files += len(chunk)
+            elapsed = time.monotonic() - started
+            logger.info("Read %d files (%.0f files/s)", files, files / elapsed)
+        importer.load(parsing)
+
+    stats = importer.stats
+    if stats.template_ids:
+        asyncio.run(_invalidate_caches(stats))
+
+    elapsed = time.monotonic() - started
+    counts = stats.counts
+    logger.info(
+        "Imported %d files in %.1fs (%.0f files/s, %.0f steps/s): %d created, %d updated, "
+        "%d unchanged, %d failed; %d models and %d stages created",
+        files,
+        elapsed,
+        files / elapsed if elapsed else 0,
+        counts["steps"] / elapsed if elapsed else 0,
+        counts["created"],
+        counts["updated"],
+        counts["skipped"],
+        counts["failed"],
+        counts["models created"],
+        counts["stages created"],
+    )
+    return stats
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "path", help="Directory, .zip or .tar(.gz) archive of template files"
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=500, help="Templates loaded per transaction"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=4, help="Processes parsing files"
+    )
+    args = parser.parse_args()
+    import_templates(args.path, batch_size=args.batch_size, workers=args.workers)
@@ -0,0 +1,153 @@
+"""
+Move photos stored as flat files into content-addressed storage.
+
+Hashes every legacy file under UPLOADS_DIR, links it to its
+``ab/cd/<sha256><ext>`` name, counts the reference in ``photoblob`` and
+rewrites the photo and the QC results pointing at it. Duplicates collapse
+into one file. Safe to re-run; photos already migrated are skipped.
+
+Usage: python -m app.db.migrate_photo_store [--dry-run] [--batch-size N]
+"""
+
+import argparse
+import logging
+import os
+from typing import Dict, List
+
+from sqlalchemy import case, update
+from sqlmodel import Session, select
+
+from app.db.session import engine
+from app.models.checklist import QCResult
+from app.models.photo import Photo
+from app.services import imaging
+from app.services.change_log import RESULT, ChangeOp, record_changes
+from app.services.photo_store import STORED_NAME, blob_name, blob_path, upsert_blob
+from app.services.photo_upload import hash_file
+
+logger = logging.getLogger(__name__)
+
+
+def _link(source: str, name: str) -> None:
+    target = blob_path(name)
+    if target.exists():
+        return
+    target.parent.mkdir(parents=True, exist_ok=True)
+    os.link(source, target)
+
+
+def _rewrite_results(session: Session, renamed: Dict[str, str]) -> int:
+    # QC results may hold the bare file name or the public /photos URL
+    mapping = {}
+    for old, new in renamed.items():
+        mapping[old] = new
+        mapping[f"/photos/{old}"] = f"/photos/{new}"
+    rows = session.execute(
+        update(QCResult)
+        .where(QCResult.photo_path.in_(list(mapping)))
+        .values(photo_path=case(mapping, value=QCResult.photo_path))
+        .returning(QCResult.id, QCResult.qc_doc_id)
+    ).all()
+    record_changes(session, RESULT, rows, ChangeOp.UPSERT)
+    return len(rows)
+
+
+def migrate_batch(
+    session: Session, photos: List[Photo], dry_run: bool
+) -> Dict[str, int]:
+    """Migrate one batch of photos in a single transaction."""
+    stats = {"migrated": 0, "missing": 0, "results": 0}
+    renamed: Dict[str, str] = {}
+    for photo in photos:
+        source = str(blob_path(photo.filename))
+        if not os.path.isfile(source):
+            logger.warning("Photo %s: file %s is missing", photo.id, photo.filename)
+            stats["missing"] += 1
+            continue
+
+        sha256, size = hash_file(source)
+        extension = os.path.splitext(photo.filename)[1].lower()
+        name, stored_size = blob_name(sha256, extension), size
+        if not dry_run:
+            stmt = upsert_blob(session.bind.dialect.name, sha256, extension, size)
+            extension, encoded, encoded_size = session.execute(stmt).one()
+            if encoded is not None:
+                # Same content as an upload that was re-encoded already
+                name, stored_size = encoded, encoded_size
+            else:
+                name = blob_name(sha256, extension)
+                _link(source, name)
+            photo.filename, photo.sha256 = name, sha256
+            photo.size, photo.original_size = stored_size, size
+            session.add(photo)
+        renamed[os.path.basename(source)] = name
+        stats["migrated"] += 1
+
+    if dry_run or not renamed:
+        return stats
+
+    stats["results"] = _rewrite_results(session, renamed)
+    session.commit()
+
+    # Only drop the old names once the database points at the new ones
+    for old, new in renamed.items():
+        os.unlink(blob_path(old))
+        for variant in imaging.VARIANTS:
+            old_variant = imaging.variant_path(old, variant)
+            if old_variant.exists() and not imaging.variant_path(new, variant).exists():
+                imaging.variant_path(new, variant).parent.mkdir(
+                    parents=True, exist_ok=True
+                )
+                os.replace(old_variant, imaging.variant_path(new, variant))
+            else:
+                old_variant.unlink(missing_ok=True)
+    return stats
+
+
+def migrate_photo_store(dry_run: bool = False, batch_size: int = 500) -> None:
+    """Migrate all legacy photos, ``batch_size`` photos per transaction."""
+    totals = {"migrated": 0, "missing": 0, "results": 0, "skipped": 0}
+    last_id = 0
+    with Session(engine) as session:
+        while True:
+            photos = session.exec(
+                select(Photo)
+                .where(Photo.id > last_id)
+                .order_by(Photo.id)
+                .limit(batch_size)
+            ).all()
+            if not photos:
+                break
+            last_id = photos[-1].id
+
+            legacy = [
+                photo for photo in photos if not STORED_NAME.match(photo.filename)
+            ]
+            totals["skipped"] += len(photos) - len(legacy)
+            for key, count in migrate_batch(session, legacy, dry_run).items():
+                totals[key] += count
+            session.expunge_all()
+
+    logger.info(
+        "%s %d photos (%d QC results rewritten), %d already migrated, %d files missing",
+        "Would migrate" if dry_run else "Migrated",
+        totals["migrated"],
+        totals["results"],
+        totals["skipped"],
+        totals["missing"],
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Hash and report without changing anything",
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=500, help="Photos migrated per transaction"
+    )
+    args = parser.parse_args()
+    migrate_photo_store(dry_run=args.dry_run, batch_size=args.batch_size)
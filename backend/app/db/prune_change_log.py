@@ -0,0 +1,45 @@
+"""
+Delete delta-sync changes older than the retention period.
+
+Sync cursors are rejected as expired once they are older than
+CHANGE_LOG_RETENTION_DAYS, so nothing reads the changes recorded before then;
+without pruning the change log grows with every write. Run it daily, e.g.
+from cron, from a single host.
+
+Usage: python -m app.db.prune_change_log [--batch-size N]
+"""
+
+import argparse
+import logging
+from datetime import datetime, timedelta
+
+from sqlmodel import Session
+
+from app.core.config import settings
+from app.db.session import engine
+from app.services.change_log import prune_changes
+
+logger = logging.getLogger(__name__)
+
+
+def prune_change_log(batch_size: int = 10_000) -> None:
+    """Delete the changes older than ``CHANGE_LOG_RETENTION_DAYS``, ``batch_size`` rows per transaction."""
+    # A day of margin for cursors issued while the oldest changes were recorded
+    before = datetime.utcnow() - timedelta(days=settings.CHANGE_LOG_RETENTION_DAYS + 1)
+    with Session(engine) as session:
+        pruned = prune_changes(session, before, batch_size)
+    logger.info(
+        "Pruned %d changes recorded before %s",
+        pruned,
+        before.isoformat(timespec="seconds"),
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--batch-size", type=int, default=10_000, help="Changes deleted per transaction"
+    )
+    args = parser.parse_args()
+    prune_change_log(batch_size=args.batch_size)
@@ -1,12 +1,17 @@
 import logging
-from typing import Generator
+from typing import AsyncGenerator, Generator
 
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlmodel import Session, SQLModel, create_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app.core.config import settings
 
 # Import all models before creating tables
 from app.db.base import *  # This imports all models and their relationships
+from app.services.change_log import track_changes
+from app.services.principal_cache import track_principals
+from app.services.template_stats import track_template_stats
 
 engine = create_engine(
     settings.DATABASE_URL,
@@ -14,6 +19,22 @@ engine = create_engine(
     pool_pre_ping=True,
 )
 
+# Async engine used by the API endpoints so queries don't block the event loop
+async_engine = create_async_engine(
+    settings.ASYNC_DATABASE_URL,
+    echo=settings.DEBUG,
+    pool_pre_ping=True,
+)
+# Objects stay usable after commit; lazy refreshes would need to await
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
+
+# Feed the delta-sync change log from every session flush
+track_changes(Session)
+# Evict cached principals once user changes are committed
+track_principals(Session)
+# Maintain the materialized template statistics
+track_template_stats(Session)
+
 
 def init_db() -> None:
     # Create all tables
@@ -29,3 +50,8 @@ def init_db() -> None:
 def get_db() -> Generator[Session, None, None]:
     with Session(engine) as session:
         yield session
+
+
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    async with AsyncSessionLocal() as session:
+        yield session
@@ -1,14 +1,19 @@
+import asyncio
 import logging
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
-from fastapi.staticfiles import StaticFiles
 from pathlib import Path
 from datetime import datetime
 
+from app.api.endpoints import photo_files
 from app.api.router import api_router
 from app.core.config import settings
-from app.db.session import init_db
+from app.db.session import AsyncSessionLocal, init_db
+from app.services import imaging, ocr, photo_hashes
+from app.services.cache import get_cache
+from app.services.template_stats import rollup_periodically
+from app.services.upload_sessions import collect_periodically
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -35,10 +40,11 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Total-Count"],
 )
 
-# Mount photos directory for serving uploaded images
-app.mount("/photos", StaticFiles(directory="photos"), name="photos")
+# Serve uploaded images, cacheable as immutable
+app.include_router(photo_files.router, prefix="/photos")
 
 # Include API router
 app.include_router(api_router, prefix=settings.API_V1_STR)
@@ -72,6 +78,23 @@ async def startup_event():
     except Exception as e:
         logger.error(f"Failed to initialize database: {e}", exc_info=True)
         raise
+    
+    app.state.stats_rollup = asyncio.create_task(
+        rollup_periodically(AsyncSessionLocal, settings.TEMPLATE_STATS_ROLLUP_SECONDS)
+    )
+    app.state.upload_gc = asyncio.create_task(collect_periodically(settings.UPLOAD_SESSION_GC_SECONDS))
+    ocr.start(AsyncSessionLocal)
+    app.state.photo_hashes = asyncio.create_task(photo_hashes.load_index(AsyncSessionLocal))
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    app.state.stats_rollup.cancel()
+    app.state.upload_gc.cancel()
+    app.state.photo_hashes.cancel()
+    await ocr.stop()
+    imaging.shutdown()
+    await get_cache().backend.close()
 
 
 if __name__ == "__main__":
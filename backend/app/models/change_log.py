@@ -0,0 +1,21 @@
+from typing import Optional
+from datetime import datetime
+from sqlmodel import Field, SQLModel, Column, String, BigInteger
+import enum
+
+
+class ChangeOp(str, enum.Enum):
+    UPSERT = "upsert"
+    DELETE = "delete"
+
+
+class ChangeLog(SQLModel, table=True):
+    # The primary key doubles as the monotonically increasing change sequence
+    id: Optional[int] = Field(default=None, primary_key=True)
+    entity: str = Field(sa_column=Column(String(20), nullable=False))
+    entity_id: int
+    parent_id: Optional[int] = Field(default=None)
+    op: ChangeOp
+    # Postgres transaction that wrote the row; readers follow these, not ids
+    txid: Optional[int] = Field(default=None, sa_column=Column(BigInteger, index=True))
+    created_at: datetime = Field(default_factory=datetime.utcnow)
@@ -39,7 +39,7 @@ class QCResultBase(SQLModel):
 
 class QCResult(QCResultBase, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    qc_doc_id: int = Field(foreign_key="qcdoc.id")
+    qc_doc_id: int = Field(foreign_key="qcdoc.id", index=True)
     step_id: int = Field(foreign_key="step.id")
     created_at: datetime = Field(default_factory=datetime.utcnow)
     
@@ -88,3 +88,34 @@ class QCDocRead(QCDocBase):
     updated_at: datetime
     completed_at: Optional[datetime]
     execution_time: Optional[int]
+
+
+class QCResultSync(SQLModel):
+    id: Optional[int] = None
+    step_id: Optional[int] = None
+    ok_flag: Optional[bool] = None
+    comment: Optional[str] = None
+    photo_path: Optional[str] = None
+    execution_time: Optional[int] = None
+    metadata: Optional[Dict[str, Any]] = None
+
+
+class QCDocSync(SQLModel):
+    id: Optional[int] = None
+    serial_no: Optional[str] = None
+    template_id: Optional[int] = None
+    status: Optional[QCDocStatus] = None
+    signed_off_by_id: Optional[int] = None
+    completed_at: Optional[datetime] = None
+    execution_time: Optional[int] = None
+    metadata: Optional[Dict[str, Any]] = None
+    results: Optional[List[QCResultSync]] = None
+
+
+class QCDocSyncOutcome(SQLModel):
+    index: int
+    id: Optional[int] = None
+    status: str  # created, updated or rejected
+    results_created: int = 0
+    results_updated: int = 0
+    errors: List[str] = []
@@ -0,0 +1,104 @@
+import enum
+from typing import List, Optional
+from datetime import datetime
+from sqlmodel import Field, SQLModel, Column, String, JSON, BigInteger
+
+
+class OcrStatus(str, enum.Enum):
+    PENDING = "pending"
+    PROCESSING = "processing"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class PhotoBlob(SQLModel, table=True):
+    # Stored bytes shared by every photo with the same content
+    sha256: str = Field(sa_column=Column(String(64), primary_key=True))
+    extension: str = Field(sa_column=Column(String(10), nullable=False))
+    size: int
+    ref_count: int = Field(default=0)
+    # Bytes kept once ingested: the re-encoded copy, or the upload if
+    # re-encoding did not make it smaller
+    encoded_name: Optional[str] = Field(default=None, sa_column=Column(String(255)))
+    encoded_size: Optional[int] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class PhotoBase(SQLModel):
+    # Path relative to UPLOADS_DIR; photos with identical content share it
+    filename: str = Field(sa_column=Column(String(255), index=True))
+    original_filename: Optional[str] = Field(
+        default=None, sa_column=Column(String(255))
+    )
+    checklist_id: Optional[int] = Field(default=None, foreign_key="qcdoc.id")
+    note: Optional[str] = None
+
+
+class Photo(PhotoBase, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    uploaded_by_id: Optional[int] = Field(default=None, foreign_key="user.id")
+    size: int = Field(default=0)  # bytes stored
+    original_size: int = Field(default=0)  # bytes uploaded
+    sha256: Optional[str] = Field(
+        default=None, sa_column=Column(String(64), index=True)
+    )
+    # Filled in by the background OCR workers
+    ocr_status: OcrStatus = Field(default=OcrStatus.PENDING, index=True)
+    ocr_claimed_at: Optional[datetime] = None  # when a worker took the photo
+    ocr_text: Optional[str] = None
+    ocr_serials: Optional[List[str]] = Field(default=None, sa_column=Column(JSON))
+    # 64-bit perceptual hash (dHash) as a signed bigint, for near-duplicates
+    phash: Optional[int] = Field(default=None, sa_column=Column(BigInteger))
+    phash_at: Optional[datetime] = Field(default=None, index=True)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class PhotoCreate(PhotoBase):
+    pass
+
+
+class PhotoResponse(SQLModel):
+    id: int
+    filename: str
+    url: str
+    thumbnail_url: str
+    preview_url: str
+    original_filename: Optional[str] = None
+    note: Optional[str] = None
+    uploaded_by_id: Optional[int] = None
+    size: int
+    original_size: int
+    sha256: Optional[str] = None
+    ocr_status: OcrStatus
+    ocr_text: Optional[str] = None
+    ocr_serials: Optional[List[str]] = None  # candidate serial numbers, best first
+    created_at: datetime
+
+
+class PhotoBatchItem(SQLModel):
+    # Outcome of one file of a batch upload, in upload order
+    filename: str
+    status_code: int
+    photo: Optional[PhotoResponse] = None
+    detail: Optional[str] = None
+
+
+class SimilarPhoto(SQLModel):
+    distance: int  # differing bits of the perceptual hashes, 0-64
+    photo: PhotoResponse
+
+
+class UploadSessionCreate(SQLModel):
+    filename: str
+    size: int = Field(gt=0)  # bytes of the whole file
+    checklist_id: Optional[int] = None
+    note: Optional[str] = None
+
+
+class UploadSessionResponse(SQLModel):
+    id: str
+    filename: str
+    size: int
+    offset: int  # bytes received so far; the next chunk starts here
+    expires_at: datetime
+    photo_id: Optional[int] = None
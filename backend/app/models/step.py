@@ -1,5 +1,5 @@
 from typing import Optional, Dict, Any
-from sqlmodel import Field, SQLModel, Relationship, Column, String, Enum, JSON
+from sqlmodel import Field, SQLModel, Relationship, Column, String, Enum, JSON, Index
 import enum
 
 
@@ -21,8 +21,11 @@ class StepBase(SQLModel):
 
 
 class Step(StepBase, table=True):
+    __table_args__ = (Index("ix_step_template_id_position", "template_id", "position"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     template_id: int = Field(foreign_key="template.id")
+    position: int = Field(default=0)  # order of the step in its template
     
     # Relationships will be defined in SQLModel after all models are created
 
@@ -44,3 +47,4 @@ class StepUpdate(SQLModel):
 class StepRead(StepBase):
     id: int
     template_id: int
+    position: int = 0
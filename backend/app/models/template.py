@@ -3,6 +3,8 @@ from datetime import datetime
 from sqlmodel import Field, SQLModel, Relationship, Column, String, Enum, JSON
 import enum
 
+from app.models.step import StepBase, StepRead
+
 
 class TemplateStatus(str, enum.Enum):
     DRAFT = "draft"
@@ -32,7 +34,7 @@ class Template(TemplateBase, table=True):
 
 
 class TemplateCreate(TemplateBase):
-    steps: Optional[List[Dict[str, Any]]] = None
+    steps: Optional[List[StepBase]] = None
 
 
 class TemplateUpdate(SQLModel):
@@ -54,6 +56,10 @@ class TemplateRead(TemplateBase):
     published_at: Optional[datetime]
 
 
+class TemplateReadWithSteps(TemplateRead):
+    steps: List[StepRead]  # in creation order
+
+
 class TemplateReadWithStats(TemplateRead):
     step_count: int
     checklist_count: int
@@ -0,0 +1,55 @@
+from typing import Any, Dict, List, Optional
+from datetime import datetime
+from sqlmodel import Field, SQLModel, Column, String, JSON, UniqueConstraint
+
+from app.models.template import TemplateStatus
+
+
+class StepRevision(SQLModel, table=True):
+    # Step content shared by every template revision it appears in unchanged
+    id: Optional[int] = Field(default=None, primary_key=True)
+    digest: str = Field(
+        sa_column=Column(String(64), unique=True, nullable=False)
+    )  # sha256 of content
+    code: str = Field(sa_column=Column(String(20), nullable=False))
+    content: Dict[str, Any] = Field(default={}, sa_column=Column(JSON))
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class TemplateRevision(SQLModel, table=True):
+    __table_args__ = (UniqueConstraint("template_id", "revision"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    # No foreign key: the history outlives the template
+    template_id: int = Field(index=True)
+    revision: str = Field(sa_column=Column(String(10), nullable=False))
+    # Draft revisions follow the template; any other status freezes them
+    status: TemplateStatus
+    header: Dict[str, Any] = Field(default={}, sa_column=Column(JSON))
+    step_revision_ids: List[int] = Field(
+        default=[], sa_column=Column(JSON)
+    )  # in step order
+    # sha256 of the revision, status, header and steps
+    digest: str = Field(sa_column=Column(String(64), nullable=False))
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class FieldChange(SQLModel):
+    old: Any = None
+    new: Any = None
+
+
+class StepChange(SQLModel):
+    type: str  # changes, added or removed
+    code: str
+    old: Optional[Dict[str, Any]] = None
+    new: Optional[Dict[str, Any]] = None
+
+
+class TemplateDiff(SQLModel):
+    template_id: int
+    from_revision: str
+    to_revision: str
+    header_changes: Dict[str, FieldChange]
+    steps_changes: List[StepChange]  # by code
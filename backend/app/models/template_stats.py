@@ -0,0 +1,16 @@
+from datetime import datetime
+from sqlmodel import Field, SQLModel
+
+
+class TemplateStats(SQLModel, table=True):
+    # No foreign key: rows of deleted templates are dropped by the next rollup
+    template_id: int = Field(primary_key=True)
+    step_count: int = Field(default=0)
+    checklist_count: int = Field(default=0)
+    # Checklists that reached COMPLETED or REJECTED
+    finished_count: int = Field(default=0)
+    # Completed checklists without a single failed result
+    first_pass_count: int = Field(default=0)
+    execution_time_total: int = Field(default=0)  # seconds
+    execution_time_count: int = Field(default=0)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
@@ -0,0 +1,286 @@
+"""
+Cache shared by the API workers.
+
+Values are opaque bytes stored under a key prefix in a pluggable backend:
+Redis (``CACHE_BACKEND=redis``, shared by every worker process), an
+in-process LRU (``lru``) or a plain in-memory dict for tests (``memory``).
+
+Invalidation is tag based. Every tag has a version token stored in the
+backend and the versions of an entry's tags are part of its key. Invalidating
+a tag replaces its token, so all entries carrying the tag become unreachable
+at once and expire on their own. A reader that loaded a value before the
+invalidation stores it under the old versions, where nobody looks anymore.
+A tag whose version is missing, never set or evicted, gets a fresh version,
+so entries stored before an eviction are never served again.
+"""
+
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class CacheBackend:
+    """Key/value storage used by :class:`Cache`."""
+
+    async def get_many(self, keys: Sequence[str]) -> List[Optional[bytes]]:
+        raise NotImplementedError
+
+    async def set_many(
+        self, items: Dict[str, bytes], ttl: Optional[int] = None
+    ) -> None:
+        raise NotImplementedError
+
+    async def add_many(self, items: Dict[str, bytes]) -> None:
+        """Store the items whose keys are not set, without expiry."""
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+
+class MemoryBackend(CacheBackend):
+    """Unbounded dict without expiry, for tests."""
+
+    def __init__(self) -> None:
+        self.data: Dict[str, bytes] = {}
+
+    async def get_many(self, keys: Sequence[str]) -> List[Optional[bytes]]:
+        return [self.data.get(key) for key in keys]
+
+    async def set_many(
+        self, items: Dict[str, bytes], ttl: Optional[int] = None
+    ) -> None:
+        self.data.update(items)
+
+    async def add_many(self, items: Dict[str, bytes]) -> None:
+        for key, value in items.items():
+            self.data.setdefault(key, value)
+
+
+class LRUBackend(CacheBackend):
+    """Bounded in-process cache; every worker process holds its own copy."""
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        # key -> (expiry as monotonic time or None, value)
+        self._data: "OrderedDict[str, Tuple[Optional[float], bytes]]" = OrderedDict()
+
+    async def get_many(self, keys: Sequence[str]) -> List[Optional[bytes]]:
+        now = time.monotonic()
+        values = []
+        for key in keys:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] is not None and entry[0] < now:
+                del self._data[key]
+                entry = None
+            if entry is not None:
+                self._data.move_to_end(key)
+            values.append(entry[1] if entry else None)
+        return values
+
+    async def set_many(
+        self, items: Dict[str, bytes], ttl: Optional[int] = None
+    ) -> None:
+        expires_at = time.monotonic() + ttl if ttl else None
+        for key, value in items.items():
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    async def add_many(self, items: Dict[str, bytes]) -> None:
+        current = await self.get_many(list(items))
+        await self.set_many(
+            {
+                key: value
+                for (key, value), old in zip(items.items(), current)
+                if old is None
+            }
+        )
+
+
+class RedisBackend(CacheBackend):
+    """
+    Redis storage shared by all workers.
+
+    Redis being unavailable degrades to cache misses instead of failing
+    requests.
+    """
+
+    def __init__(self, url: str) -> None:
+        import redis.asyncio as redis
+
+        self._errors = (redis.RedisError, OSError)
+        self._client = redis.from_url(url)
+
+    async def get_many(self, keys: Sequence[str]) -> List[Optional[bytes]]:
+        try:
+            return await self._client.mget(keys)
+        except self._errors as exc:
+            logger.warning("Cache read failed: %s", exc)
+            return [None] * len(keys)
+
+    async def set_many(
+        self, items: Dict[str, bytes], ttl: Optional[int] = None
+    ) -> None:
+        try:
+            async with self._client.pipeline(transaction=False) as pipe:
+                for key, value in items.items():
+                    pipe.set(key, value, ex=ttl)
+                await pipe.execute()
+        except self._errors as exc:
+            logger.error("Cache write failed: %s", exc)
+
+    async def add_many(self, items: Dict[str, bytes]) -> None:
+        try:
+            async with self._client.pipeline(transaction=False) as pipe:
+                for key, value in items.items():
+                    pipe.set(key, value, nx=True)
+                await pipe.execute()
+        except self._errors as exc:
+            logger.error("Cache write failed: %s", exc)
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+
+def _new_version() -> bytes:
+    return uuid.uuid4().hex[:12].encode()
+
+
+class Cache:
+    """
+    Tag-invalidated cache on top of a backend.
+
+    Args:
+        backend: Storage for entries and tag versions
+        prefix: Namespace of all keys in the backend
+        ttl: Default lifetime of entries in seconds
+    """
+
+    def __init__(self, backend: CacheBackend, prefix: str, ttl: int) -> None:
+        self.backend = backend
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def _key(self, name: str) -> str:
+        return f"{self.prefix}:{name}"
+
+    async def get_many(self, names: Sequence[str]) -> List[Optional[bytes]]:
+        """Read untagged entries, e.g. content-addressed ones."""
+        if not names:
+            return []
+        return await self.backend.get_many([self._key(name) for name in names])
+
+    async def set_many(
+        self, items: Dict[str, bytes], ttl: Optional[int] = None
+    ) -> None:
+        """Store untagged entries."""
+        if items:
+            await self.backend.set_many(
+                {self._key(name): value for name, value in items.items()},
+                ttl or self.ttl,
+            )
+
+    async def tag_versions(self, tags: Sequence[str]) -> List[bytes]:
+        """
+        Current version tokens of ``tags``.
+
+        For copies kept outside the cache: a copy made under the versions
+        read beforehand is stale once any of them changes.
+        """
+        versions = await self.get_many([f"tag:{tag}" for tag in tags])
+        # A version evicted from the backend could be an invalidated one, so
+        # a missing version gets a fresh one rather than a default that older
+        # entries were stored under. It is only added if still missing, so a
+        # concurrent invalidation is never overwritten.
+        missing = [tag for tag, version in zip(tags, versions) if version is None]
+        if missing:
+            fresh = {f"tag:{tag}": _new_version() for tag in missing}
+            await self.backend.add_many(
+                {self._key(name): version for name, version in fresh.items()}
+            )
+            stored = dict(zip(missing, await self.get_many(list(fresh))))
+            versions = [
+                version or stored[tag] or fresh[f"tag:{tag}"]
+                for tag, version in zip(tags, versions)
+            ]
+        return versions
+
+    async def _tagged_key(self, name: str, tags: Sequence[str]) -> str:
+        versions = await self.tag_versions(tags)
+        return f"{name}@" + ".".join(version.decode() for version in versions)
+
+    async def get_or_load(
+        self,
+        name: str,
+        tags: Sequence[str],
+        loader: Callable[[], Awaitable[Optional[bytes]]],
+        ttl: Optional[int] = None,
+    ) -> Optional[bytes]:
+        """
+        Read-through lookup of a tagged entry.
+
+        Args:
+            name: Entry name, unique for the arguments of the loader
+            tags: Tags whose invalidation drops the entry
+            loader: Builds the value on a miss; None results are not cached
+            ttl: Lifetime in seconds, the cache default if omitted
+
+        Returns:
+            The cached or freshly loaded value
+        """
+        name = await self._tagged_key(name, tags)
+        (value,) = await self.get_many([name])
+        if value is not None:
+            return value
+
+        value = await loader()
+        if value is not None:
+            await self.set_many({name: value}, ttl)
+        return value
+
+    async def invalidate(self, tags: Iterable[str]) -> None:
+        """Drop every entry carrying one of ``tags``."""
+        version = _new_version()
+        # Tag versions must outlive the entries keyed by them
+        await self.backend.set_many(
+            {self._key(f"tag:{tag}"): version for tag in set(tags)}, None
+        )
+
+
+def create_backend(kind: str) -> CacheBackend:
+    if kind == "redis":
+        return RedisBackend(settings.REDIS_URL)
+    if kind == "lru":
+        return LRUBackend(settings.CACHE_LRU_SIZE)
+    if kind == "memory":
+        return MemoryBackend()
+    raise ValueError(f"Unknown cache backend: {kind}")
+
+
+_cache: Optional[Cache] = None
+
+
+def get_cache() -> Cache:
+    """Return the process-wide cache configured by the settings."""
+    global _cache
+    if _cache is None:
+        _cache = Cache(
+            create_backend(settings.CACHE_BACKEND),
+            settings.CACHE_PREFIX,
+            settings.CACHE_TTL_SECONDS,
+        )
+    return _cache
+
+
+def set_cache(cache: Optional[Cache]) -> None:
+    """Replace the process-wide cache, e.g. with a :class:`MemoryBackend` in tests."""
+    global _cache
+    _cache = cache
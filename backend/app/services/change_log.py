@@ -0,0 +1,305 @@
+"""
+Change sequence feeding delta sync.
+
+Every insert, update and delete of templates, steps, checklists and results
+appends a row to the ``changelog`` table. Rows written through the ORM unit of
+work are captured by a session ``after_flush`` hook; bulk statements that
+bypass the unit of work call :func:`record_changes` themselves.
+
+Clients receive an opaque cursor wrapping the position they have seen and
+only fetch the rows changed after it. Writers don't coordinate: on Postgres,
+rows carry the id of the transaction that wrote them, and a position is the
+last transaction id below which every transaction has finished, so a reader
+never moves past a change that is not committed yet. A long transaction
+holds positions back, delaying changes committed after it started, but never
+blocks writers. SQLite runs one writer at a time, so positions are simply
+row ids there.
+
+Rows older than ``CHANGE_LOG_RETENTION_DAYS`` are pruned by
+``app.db.prune_change_log``; cursors issued before then are rejected as
+expired, and their clients sync in full again.
+"""
+
+import base64
+import binascii
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Type
+
+from sqlalchemy import Select, delete, event, func, insert, literal
+from sqlalchemy.orm import Session as SASession
+from sqlmodel import Session, SQLModel, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.config import settings
+from app.models.change_log import ChangeLog, ChangeOp
+from app.models.checklist import QCDoc, QCResult
+from app.models.step import Step
+from app.models.template import Template
+
+TEMPLATE = "template"
+STEP = "step"
+CHECKLIST = "qcdoc"
+RESULT = "qcresult"
+
+# Tracked model -> (entity name, attribute holding the parent id)
+TRACKED_MODELS: Dict[Type[SQLModel], Tuple[str, Optional[str]]] = {
+    Template: (TEMPLATE, None),
+    Step: (STEP, "template_id"),
+    # Checklists have no parent; their author is recorded so deletions
+    # only go to the devices that may hold the checklist
+    QCDoc: (CHECKLIST, "created_by_id"),
+    QCResult: (RESULT, "qc_doc_id"),
+}
+
+CURSOR_VERSION = "v2"
+# Cursors of earlier formats count positions differently
+EXPIRED_CURSOR_VERSIONS = {"v1"}
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class ExpiredCursor(InvalidCursor):
+    pass
+
+
+def encode_cursor(seq: int) -> str:
+    """Wrap a change position into an opaque cursor, stamped with the time it is issued."""
+    payload = f"{CURSOR_VERSION}:{seq}:{int(time.time())}"
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    """
+    Extract the change position from a cursor.
+
+    Raises:
+        ExpiredCursor: If the changes after the cursor may have been pruned
+        InvalidCursor: If the cursor was not produced by :func:`encode_cursor`
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        version, _, rest = (
+            base64.urlsafe_b64decode(padded.encode()).decode().partition(":")
+        )
+        if version not in EXPIRED_CURSOR_VERSIONS:
+            if version != CURSOR_VERSION:
+                raise ValueError(version)
+            seq, issued_at = (int(part) for part in rest.split(":"))
+    except (ValueError, binascii.Error, UnicodeDecodeError) as exc:
+        raise InvalidCursor(f"Invalid sync cursor: {cursor}") from exc
+    if (
+        version in EXPIRED_CURSOR_VERSIONS
+        or issued_at
+        < time.time()
+        - timedelta(days=settings.CHANGE_LOG_RETENTION_DAYS).total_seconds()
+    ):
+        raise ExpiredCursor(f"Sync cursor expired: {cursor}")
+    return seq
+
+
+def _by_transaction(connection) -> bool:
+    return connection.dialect.name == "postgresql"
+
+
+def _insert_changes(connection, rows: List[Dict]) -> None:
+    if not rows:
+        return
+    statement = insert(ChangeLog.__table__)
+    if _by_transaction(connection):
+        statement = statement.values(txid=func.txid_current())
+    connection.execute(statement, rows)
+
+
+def record_changes(
+    db: Session, entity: str, changes: Iterable[Tuple[int, Optional[int]]], op: ChangeOp
+) -> None:
+    """
+    Record changes made by statements that bypass the ORM unit of work.
+
+    Args:
+        db: Database session running the bulk statement
+        entity: Entity name, one of the module level constants
+        changes: Pairs of (entity id, parent id)
+        op: Kind of change
+    """
+    rows = [
+        {"entity": entity, "entity_id": entity_id, "parent_id": parent_id, "op": op}
+        for entity_id, parent_id in changes
+    ]
+    _insert_changes(db.connection(), rows)
+
+
+def record_selected_changes(
+    db: Session, entity: str, rows: Select, op: ChangeOp
+) -> None:
+    """
+    Record changes of many rows with a single ``INSERT ... SELECT``.
+
+    Args:
+        db: Database session running the bulk statement
+        entity: Entity name, one of the module level constants
+        rows: Query selecting the (entity id, parent id) of the changed rows
+        op: Kind of change
+    """
+    selected = rows.subquery()
+    entity_id, parent_id = selected.c
+    table = ChangeLog.__table__
+    columns = ["entity", "entity_id", "parent_id", "op", "created_at"]
+    values = [
+        literal(entity, table.c.entity.type),
+        entity_id,
+        parent_id,
+        literal(op, table.c.op.type),
+        literal(datetime.utcnow(), table.c.created_at.type),
+    ]
+    connection = db.connection()
+    if _by_transaction(connection):
+        columns.append("txid")
+        values.append(func.txid_current())
+    connection.execute(insert(table).from_select(columns, select(*values)))
+
+
+def _collect(
+    objects: Iterable, op: ChangeOp, session: SASession, seen: Set
+) -> List[Dict]:
+    rows = []
+    for obj in objects:
+        tracked = TRACKED_MODELS.get(type(obj))
+        if tracked is None or obj.id is None:
+            continue
+        if (
+            op == ChangeOp.UPSERT
+            and obj in session.dirty
+            and not session.is_modified(obj)
+        ):
+            continue
+        entity, parent_attr = tracked
+        if (entity, obj.id) in seen:
+            continue
+        seen.add((entity, obj.id))
+        rows.append(
+            {
+                "entity": entity,
+                "entity_id": obj.id,
+                "parent_id": getattr(obj, parent_attr) if parent_attr else None,
+                "op": op,
+            }
+        )
+    return rows
+
+
+def _after_flush(session: SASession, flush_context) -> None:
+    seen: Set = set()
+    rows = _collect(session.deleted, ChangeOp.DELETE, session, seen)
+    rows += _collect(
+        list(session.new) + list(session.dirty), ChangeOp.UPSERT, session, seen
+    )
+    _insert_changes(session.connection(), rows)
+
+
+def track_changes(session_class: Type[SASession]) -> None:
+    """Feed the change log from every flush of sessions of ``session_class``."""
+    if not event.contains(session_class, "after_flush", _after_flush):
+        event.listen(session_class, "after_flush", _after_flush)
+
+
+def _position(db: AsyncSession):
+    return ChangeLog.txid if _by_transaction(db.bind) else ChangeLog.id
+
+
+async def current_sequence(db: AsyncSession) -> int:
+    """Return the position up to which every change is committed."""
+    if _by_transaction(db.bind):
+        # Every transaction below the oldest one still running has finished
+        oldest = (
+            await db.exec(select(func.txid_snapshot_xmin(func.txid_current_snapshot())))
+        ).one()
+        return oldest - 1
+    return (await db.exec(select(func.max(ChangeLog.id)))).one() or 0
+
+
+class ChangeSet:
+    """
+    Net changes per entity since a cursor.
+
+    Only the latest operation of each row is kept, so a row that was edited
+    many times is returned once.
+    """
+
+    def __init__(self) -> None:
+        self.upserted: Dict[str, Set[int]] = {}
+        self.deleted: Dict[str, Set[int]] = {}
+        self.parents: Dict[str, Set[int]] = {}
+        # Entity -> deleted id -> parent id
+        self.deleted_parents: Dict[str, Dict[int, Optional[int]]] = {}
+
+    def add(
+        self, entity: str, entity_id: int, parent_id: Optional[int], op: ChangeOp
+    ) -> None:
+        upserted = self.upserted.setdefault(entity, set())
+        deleted = self.deleted.setdefault(entity, set())
+        deleted_parents = self.deleted_parents.setdefault(entity, {})
+        if op == ChangeOp.DELETE:
+            upserted.discard(entity_id)
+            deleted.add(entity_id)
+            deleted_parents[entity_id] = parent_id
+        else:
+            deleted.discard(entity_id)
+            deleted_parents.pop(entity_id, None)
+            upserted.add(entity_id)
+        if parent_id is not None:
+            self.parents.setdefault(entity, set()).add(parent_id)
+
+
+async def read_changes(
+    db: AsyncSession, since: int, until: int, entities: Iterable[str]
+) -> ChangeSet:
+    """
+    Collect changes with a position in ``(since, until]``.
+
+    Args:
+        db: Database session
+        since: Position decoded from the client cursor
+        until: Position the response cursor will point to
+        entities: Entity names the caller is interested in
+
+    Returns:
+        Net changes grouped by entity
+    """
+    changes = ChangeSet()
+    position = _position(db)
+    rows = await db.exec(
+        select(ChangeLog.entity, ChangeLog.entity_id, ChangeLog.parent_id, ChangeLog.op)
+        .where(
+            position > since, position <= until, ChangeLog.entity.in_(list(entities))
+        )
+        .order_by(ChangeLog.id)
+    )
+    for entity, entity_id, parent_id, op in rows:
+        changes.add(entity, entity_id, parent_id, op)
+    return changes
+
+
+def prune_changes(db: Session, before: datetime, batch_size: int = 10_000) -> int:
+    """
+    Delete the changes recorded before ``before``, ``batch_size`` rows per transaction.
+
+    Returns:
+        Number of rows deleted
+    """
+    pruned = 0
+    while True:
+        ids = db.exec(
+            select(ChangeLog.id)
+            .where(ChangeLog.created_at < before)
+            .order_by(ChangeLog.id)
+            .limit(batch_size)
+        ).all()
+        if not ids:
+            return pruned
+        db.execute(delete(ChangeLog).where(ChangeLog.id.in_(ids)))
+        db.commit()
+        pruned += len(ids)
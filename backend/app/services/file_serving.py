@@ -0,0 +1,157 @@
+"""
+HTTP serving of immutable files: photos and their variants.
+
+Stored files never change under their name, so responses carry a strong
+ETag and ``Cache-Control: immutable`` and clients and proxies keep them for
+a year. Revalidations are answered with 304 and single byte ranges with 206
+without touching the file. Multiple ranges are answered with the whole file,
+which HTTP allows.
+
+With ``PHOTOS_ACCEL_REDIRECT_PREFIX`` set, the body is left to nginx through
+``X-Accel-Redirect``: it sends the file with sendfile(2) and handles ranges
+itself, so the worker only answers with headers.
+"""
+
+import os
+from pathlib import Path
+from typing import AsyncIterator, Optional, Tuple
+
+import anyio
+from fastapi import Request, Response, status
+from fastapi.responses import FileResponse, StreamingResponse
+
+from app.core.config import settings
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+CHUNK_SIZE = 64 * 1024
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a ``Range`` header holding a single byte range.
+
+    Args:
+        header: Value of the header
+        size: Size of the file
+
+    Returns:
+        Start and end (exclusive) of the range, or None to send the whole
+        file, for multiple or malformed ranges
+
+    Raises:
+        ValueError: The range starts past the end of the file
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, dash, last = spec.strip().partition("-")
+    if (
+        not dash
+        or not (first or last)
+        or not (first or "0").isdigit()
+        or not (last or "0").isdigit()
+    ):
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError(header)
+        return max(size - length, 0), size
+    start = int(first)
+    end = min(int(last) + 1, size) if last else size
+    if start >= size:
+        raise ValueError(header)
+    if end <= start:
+        return None
+    return start, end
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    # Weak comparison, as required for If-None-Match
+    candidates = [candidate.strip() for candidate in header.split(",")]
+    return "*" in candidates or any(
+        candidate.removeprefix("W/") == etag for candidate in candidates
+    )
+
+
+async def _read_range(path: Path, start: int, end: int) -> AsyncIterator[bytes]:
+    async with await anyio.open_file(path, "rb") as file:
+        await file.seek(start)
+        while start < end:
+            chunk = await file.read(min(CHUNK_SIZE, end - start))
+            if not chunk:
+                break
+            start += len(chunk)
+            yield chunk
+
+
+def serve_file(
+    request: Request,
+    path: Path,
+    etag: str,
+    media_type: str,
+    accel_name: Optional[str] = None,
+) -> Response:
+    """
+    Respond with an immutable file, honouring conditional and range requests.
+
+    Args:
+        request: The GET or HEAD request
+        path: The file; must exist
+        etag: Strong ETag, including the quotes, unique for the content
+        media_type: Content type of the file
+        accel_name: Name of the file under ``PHOTOS_ACCEL_REDIRECT_PREFIX``,
+            to let nginx send it when that setting is enabled
+
+    Returns:
+        A 200, 206, 304 or 416 response
+    """
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE, "Accept-Ranges": "bytes"}
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None and _etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    if accel_name is not None and settings.PHOTOS_ACCEL_REDIRECT_PREFIX:
+        headers["X-Accel-Redirect"] = settings.PHOTOS_ACCEL_REDIRECT_PREFIX + accel_name
+        return Response(media_type=media_type, headers=headers)
+
+    stat_result = os.stat(path)
+    size = stat_result.st_size
+    byte_range = None
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    # A range of another version of the file would be garbage, so If-Range
+    # must name this ETag; dates are never strong enough
+    if range_header is not None and (if_range is None or if_range.strip() == etag):
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(
+                status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                headers=headers,
+            )
+
+    if byte_range is None:
+        return FileResponse(
+            path, media_type=media_type, headers=headers, stat_result=stat_result
+        )
+
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+    headers["Content-Length"] = str(end - start)
+    if request.method == "HEAD":
+        return Response(
+            status_code=status.HTTP_206_PARTIAL_CONTENT,
+            media_type=media_type,
+            headers=headers,
+        )
+    return StreamingResponse(
+        _read_range(path, start, end),
+        status_code=status.HTTP_206_PARTIAL_CONTENT,
+        media_type=media_type,
+        headers=headers,
+    )
@@ -0,0 +1,217 @@
+"""
+Downscaled variants of photo evidence, and the process pool re-encoding
+uploads.
+
+Review screens show a grid of thumbnails and open a preview; neither needs
+the full-resolution original. Variants are rendered with Pillow in a process
+pool, right after upload and on demand for photos that have none yet, and
+cached on disk as ``<variant>/ab/cd/<photo stem>.jpg``. Stored photos keep
+the ``ab/cd/`` directories of their name, so like the photos no variant
+directory grows beyond a few hundred entries; legacy flat names are spread
+the same way by the SHA-256 of their name.
+"""
+
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Variant name -> longest side in pixels
+VARIANTS: Dict[str, int] = {
+    "thumbnail": settings.PHOTO_THUMBNAIL_SIZE,
+    "preview": settings.PHOTO_PREVIEW_SIZE,
+}
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+# Photo file name -> rendering in progress, awaited by concurrent requests
+_in_flight: Dict[str, "asyncio.Future[None]"] = {}
+
+
+def variant_path(filename: str, variant: str) -> Path:
+    name = Path(filename)
+    directory = name.parent
+    if directory == Path("."):
+        digest = hashlib.sha256(name.stem.encode()).hexdigest()
+        directory = Path(digest[:2], digest[2:4])
+    return Path(settings.PHOTO_VARIANTS_DIR) / variant / directory / f"{name.stem}.jpg"
+
+
+def variant_url(filename: str, variant: str) -> str:
+    return f"{settings.API_V1_STR}/photos/variants/{variant}/{filename}"
+
+
+def render_variants(source: str, targets: List[Tuple[str, int]], quality: int) -> None:
+    """
+    Decode ``source`` once and write each target, largest first.
+
+    Runs in a worker process.
+
+    Args:
+        source: Path of the original image
+        targets: Pairs of (output path, longest side in pixels)
+        quality: JPEG quality of the outputs
+    """
+    targets = sorted(targets, key=lambda target: target[1], reverse=True)
+    with Image.open(source) as original:
+        # Let the JPEG decoder skip detail the largest variant doesn't need
+        largest = targets[0][1]
+        original.draft("RGB", (largest, largest))
+        image = ImageOps.exif_transpose(original).convert("RGB")
+
+    for path, size in targets:
+        # Each variant is downscaled from the previous, larger one
+        image.thumbnail((size, size), Image.LANCZOS)
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        image.save(tmp_path, "JPEG", quality=quality, optimize=True, progressive=True)
+        os.replace(tmp_path, path)
+
+
+def reencode(
+    source: str, target: str, max_side: int, quality: int, image_format: str
+) -> Tuple[int, bool]:
+    """
+    Write ``source`` bounded to ``max_side`` pixels as ``image_format``,
+    without EXIF and other metadata.
+
+    Runs in a worker process. The orientation tag is applied to the pixels
+    before it is dropped; the color profile is kept.
+
+    Returns:
+        Size of the written file in bytes, and whether the image was scaled
+        down
+    """
+    with Image.open(source) as original:
+        # Before draft() scales JPEGs down while decoding
+        resized = max(original.size) > max_side
+        original.draft("RGB", (max_side, max_side))
+        icc_profile = original.info.get("icc_profile")
+        image = ImageOps.exif_transpose(original)
+        if image.mode in ("RGBA", "LA", "P"):
+            # Flatten transparency on white, like the review screens show it
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        else:
+            image = image.convert("RGB")
+    image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    options = {"quality": quality}
+    if icc_profile:
+        options["icc_profile"] = icc_profile
+    if image_format == "JPEG":
+        options.update(optimize=True, progressive=True)
+    else:
+        options.update(method=4)
+    path = Path(target)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    image.save(tmp_path, image_format, **options)
+    os.replace(tmp_path, path)
+    return path.stat().st_size, resized
+
+
+def dhash(source: str) -> int:
+    """
+    64-bit difference hash of an image.
+
+    Runs in a worker process. Each bit tells whether a pixel of the 9x8
+    grayscale thumbnail is brighter than its right neighbour, so the hash
+    survives re-encoding, rescaling and small edits.
+    """
+    with Image.open(source) as original:
+        original.draft("L", (64, 64))
+        image = ImageOps.exif_transpose(original).convert("L")
+    pixels = list(image.resize((9, 8), Image.LANCZOS).getdata())
+    value = 0
+    for row in range(8):
+        for column in range(8):
+            left, right = pixels[row * 9 + column], pixels[row * 9 + column + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # Forking a process running an event loop and threads is unsafe
+        _pool = ProcessPoolExecutor(
+            max_workers=settings.IMAGING_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+
+async def run_in_pool(func, *args):
+    """Run a picklable function in the imaging process pool."""
+    return await asyncio.get_running_loop().run_in_executor(_get_pool(), func, *args)
+
+
+async def generate_variants(
+    filename: str, variants: Optional[List[str]] = None
+) -> None:
+    """
+    Render the missing variants of an uploaded photo in the process pool.
+
+    Args:
+        filename: Stored file name of the photo in ``UPLOADS_DIR``
+        variants: Variants to render, all of them if omitted
+    """
+    wanted = variants or list(VARIANTS)
+    while True:
+        missing = [
+            variant
+            for variant in wanted
+            if not variant_path(filename, variant).exists()
+        ]
+        if not missing:
+            return
+        # Wait for a rendering of the same photo in progress, then re-check
+        future = _in_flight.get(filename)
+        if future is None:
+            break
+        await asyncio.shield(future)
+
+    source = str(Path(settings.UPLOADS_DIR) / filename)
+    targets = [
+        (str(variant_path(filename, variant)), VARIANTS[variant]) for variant in missing
+    ]
+    future = asyncio.get_running_loop().run_in_executor(
+        _get_pool(), render_variants, source, targets, settings.PHOTO_VARIANT_QUALITY
+    )
+    _in_flight[filename] = future
+    future.add_done_callback(lambda _: _in_flight.pop(filename, None))
+    await asyncio.shield(future)
+
+
+async def generate_variants_after_upload(filename: str) -> None:
+    """Background task rendering all variants; failures only get logged."""
+    try:
+        await generate_variants(filename)
+    except Exception:
+        logger.exception("Could not render variants of photo %s", filename)
+
+
+def delete_variants(filename: str) -> None:
+    for variant in VARIANTS:
+        variant_path(filename, variant).unlink(missing_ok=True)
+
+
+def shutdown() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
@@ -0,0 +1,328 @@
+"""
+Background OCR of nameplate photos.
+
+Ingested uploads only enqueue the photo id; a fixed set of workers runs
+Tesseract in a thread pool (the work happens in the ``tesseract``
+subprocess) and stores the recognized text and candidate serial numbers on
+the photo, for the checklist screen to offer instead of typing
+``serial_no`` by hand.
+
+The queue is bounded. When it is full, :func:`submit` returns immediately
+without queueing and the photo stays ``pending``; a sweeper re-queues
+pending photos as capacity frees up, so an OCR backlog never slows down
+uploads and never grows memory. Queue wait and recognition time of the
+recent jobs are kept for :func:`metrics`.
+
+Every application process runs its own workers and sweeper. A photo is
+claimed, moved to ``processing`` by a conditional UPDATE, before it is
+recognized, and sweepers claim their rows with ``FOR UPDATE SKIP LOCKED``,
+so each photo is recognized once. Claims older than
+``OCR_CLAIM_TIMEOUT_SECONDS``, left by a process that stopped, are taken
+over by the next sweep.
+"""
+
+import asyncio
+import logging
+import re
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from PIL import Image, ImageOps
+from sqlalchemy import update
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.config import settings
+from app.models.photo import OcrStatus, Photo
+
+logger = logging.getLogger(__name__)
+
+# Label in front of a serial number on a nameplate
+SERIAL_LABEL = re.compile(
+    r"\b(?:S\s*/\s*N|SN|SER(?:IAL)?\.?\s*(?:NO|NUMBER|#)?\.?)\s*[:#.]?\s*([A-Z0-9][A-Z0-9\-/]{3,24})",
+    re.I,
+)
+# Any token that looks like a serial number: letters and digits, with a digit
+SERIAL_TOKEN = re.compile(r"\b(?=[A-Z0-9\-]*\d)[A-Z0-9][A-Z0-9\-]{5,24}\b")
+
+MAX_SERIAL_CANDIDATES = 5
+
+# Timings kept for metrics
+RECENT_JOBS = 1000
+
+
+def extract_serials(text: str) -> List[str]:
+    """
+    Pick likely serial numbers out of recognized text, best first.
+
+    Values after a serial label come first, then other long tokens mixing
+    digits with letters, then purely numeric ones.
+    """
+    candidates: List[str] = [
+        match.group(1).strip("-/").upper() for match in SERIAL_LABEL.finditer(text)
+    ]
+    tokens = [token.upper() for token in SERIAL_TOKEN.findall(text.upper())]
+    candidates += [token for token in tokens if not token.isdigit()]
+    candidates += [token for token in tokens if token.isdigit()]
+    unique = list(dict.fromkeys(candidate for candidate in candidates if candidate))
+    return unique[:MAX_SERIAL_CANDIDATES]
+
+
+def recognize(path: str) -> str:
+    """
+    Recognize the text of an image.
+
+    Runs in a worker thread. The image is converted to grayscale, bounded to
+    ``OCR_MAX_SIDE`` pixels and contrast-stretched, which speeds Tesseract up
+    and helps with dim shop-floor photos.
+    """
+    import pytesseract
+
+    with Image.open(path) as original:
+        original.draft("L", (settings.OCR_MAX_SIDE, settings.OCR_MAX_SIDE))
+        image = ImageOps.exif_transpose(original).convert("L")
+    image.thumbnail((settings.OCR_MAX_SIDE, settings.OCR_MAX_SIDE))
+    image = ImageOps.autocontrast(image)
+    return pytesseract.image_to_string(image, timeout=settings.OCR_TIMEOUT_SECONDS)
+
+
+class OcrQueue:
+    """Bounded queue of photo ids processed by a fixed set of workers."""
+
+    def __init__(
+        self, session_factory: Callable[[], AsyncSession], workers: int, capacity: int
+    ) -> None:
+        self.session_factory = session_factory
+        self.workers = workers
+        # Photo id, time queued and whether the sweeper claimed it already
+        self.queue: "asyncio.Queue[Tuple[int, float, bool]]" = asyncio.Queue(
+            maxsize=capacity
+        )
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="ocr"
+        )
+        self.tasks: List[asyncio.Task] = []
+        # Photo ids queued or being processed, so the sweeper doesn't duplicate them
+        self.active: set = set()
+        self.counts: Dict[str, int] = {"done": 0, "failed": 0, "rejected": 0}
+        self.wait_ms: Deque[float] = deque(maxlen=RECENT_JOBS)
+        self.run_ms: Deque[float] = deque(maxlen=RECENT_JOBS)
+
+    def start(self) -> None:
+        self.tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        self.tasks.append(asyncio.create_task(self._sweep()))
+
+    async def stop(self) -> None:
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, photo_id: int, claimed: bool = False) -> bool:
+        """Queue a photo without waiting; False if the queue is full."""
+        if photo_id in self.active:
+            return True
+        try:
+            self.queue.put_nowait((photo_id, time.monotonic(), claimed))
+        except asyncio.QueueFull:
+            self.counts["rejected"] += 1
+            return False
+        self.active.add(photo_id)
+        return True
+
+    async def _work(self) -> None:
+        while True:
+            photo_id, queued_at, claimed = await self.queue.get()
+            started = time.monotonic()
+            self.wait_ms.append((started - queued_at) * 1000)
+            try:
+                await self._process(photo_id, claimed)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("OCR of photo %s failed", photo_id)
+            finally:
+                self.run_ms.append((time.monotonic() - started) * 1000)
+                self.active.discard(photo_id)
+                self.queue.task_done()
+
+    async def _claim(self, photo_id: int, claimed: bool) -> Optional[str]:
+        # Photos queued on upload are claimed here, unless another process's
+        # sweeper took them first; those queued by the sweeper get a fresh
+        # claim time. Returns the path of the claimed photo.
+        async with self.session_factory() as db:
+            result = await db.execute(
+                update(Photo)
+                .where(
+                    Photo.id == photo_id,
+                    Photo.ocr_status
+                    == (OcrStatus.PROCESSING if claimed else OcrStatus.PENDING),
+                )
+                .values(
+                    ocr_status=OcrStatus.PROCESSING, ocr_claimed_at=datetime.utcnow()
+                )
+                .returning(Photo.filename)
+            )
+            filename = result.scalar_one_or_none()
+            await db.commit()
+        return (
+            str(Path(settings.UPLOADS_DIR) / filename) if filename is not None else None
+        )
+
+    async def _release(self, photo_ids: List[int]) -> None:
+        # Back to pending, for the sweeper to queue again
+        async with self.session_factory() as db:
+            await db.execute(
+                update(Photo)
+                .where(
+                    Photo.id.in_(photo_ids), Photo.ocr_status == OcrStatus.PROCESSING
+                )
+                .values(ocr_status=OcrStatus.PENDING, ocr_claimed_at=None)
+            )
+            await db.commit()
+
+    async def _process(self, photo_id: int, claimed: bool) -> None:
+        path = await self._claim(photo_id, claimed)
+        if path is None:
+            return
+
+        loop = asyncio.get_running_loop()
+        try:
+            text = await loop.run_in_executor(self.executor, recognize, path)
+        except FileNotFoundError:
+            # Replaced by its re-encoded copy meanwhile; the sweeper retries
+            await self._release([photo_id])
+            return
+        except Exception as exc:
+            logger.warning("OCR of photo %s failed: %s", photo_id, exc)
+            status, text, serials = OcrStatus.FAILED, None, None
+            self.counts["failed"] += 1
+        else:
+            status, text, serials = OcrStatus.DONE, text.strip(), extract_serials(text)
+            self.counts["done"] += 1
+
+        async with self.session_factory() as db:
+            photo = await db.get(Photo, photo_id)
+            if photo is None:
+                return
+            photo.ocr_status = status
+            photo.ocr_text = text
+            photo.ocr_serials = serials
+            db.add(photo)
+            await db.commit()
+
+    async def _sweep(self) -> None:
+        # Claim and re-queue photos rejected while the queue was full, oldest
+        # first, photos left pending by a restart and stale claims
+        while True:
+            await asyncio.sleep(settings.OCR_SWEEP_SECONDS)
+            free = self.queue.maxsize - self.queue.qsize()
+            if free <= 0:
+                continue
+            try:
+                now = datetime.utcnow()
+                # Photos uploaded a moment ago are still being queued by their request
+                settled = now - timedelta(seconds=settings.OCR_SWEEP_SECONDS)
+                stale = now - timedelta(seconds=settings.OCR_CLAIM_TIMEOUT_SECONDS)
+                claimable = (
+                    select(Photo.id)
+                    .where(
+                        (Photo.ocr_status == OcrStatus.PENDING)
+                        & (Photo.created_at < settled)
+                        | (Photo.ocr_status == OcrStatus.PROCESSING)
+                        & (Photo.ocr_claimed_at < stale)
+                    )
+                    .order_by(Photo.id)
+                    .limit(free)
+                    # Rows being claimed by the sweeper of another process are skipped
+                    .with_for_update(skip_locked=True)
+                )
+                if self.active:
+                    claimable = claimable.where(Photo.id.not_in(list(self.active)))
+                async with self.session_factory() as db:
+                    photo_ids = (
+                        (
+                            await db.execute(
+                                update(Photo)
+                                .where(Photo.id.in_(claimable))
+                                .values(
+                                    ocr_status=OcrStatus.PROCESSING, ocr_claimed_at=now
+                                )
+                                .returning(Photo.id)
+                            )
+                        )
+                        .scalars()
+                        .all()
+                    )
+                    await db.commit()
+                # Uploads may have filled the queue meanwhile
+                rejected = [
+                    photo_id
+                    for photo_id in sorted(photo_ids)
+                    if not self.submit(photo_id, claimed=True)
+                ]
+                if rejected:
+                    await self._release(rejected)
+            except Exception:
+                logger.exception("OCR sweep failed")
+
+    def metrics(self) -> Dict:
+        return {
+            "workers": self.workers,
+            "queued": self.queue.qsize(),
+            "capacity": self.queue.maxsize,
+            **self.counts,
+            "wait_ms": _summary(self.wait_ms),
+            "run_ms": _summary(self.run_ms),
+        }
+
+
+def _summary(samples: Deque[float]) -> Dict[str, Optional[float]]:
+    ordered = sorted(samples)
+    if not ordered:
+        return {"p50": None, "p95": None, "max": None}
+    return {
+        "p50": round(ordered[len(ordered) // 2], 1),
+        "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 1),
+        "max": round(ordered[-1], 1),
+    }
+
+
+_queue: Optional[OcrQueue] = None
+
+
+def start(session_factory: Callable[[], AsyncSession]) -> None:
+    """Start the workers; called on application startup."""
+    global _queue
+    if settings.OCR_WORKERS > 0:
+        _queue = OcrQueue(
+            session_factory, settings.OCR_WORKERS, settings.OCR_QUEUE_SIZE
+        )
+        _queue.start()
+
+
+async def stop() -> None:
+    global _queue
+    if _queue is not None:
+        await _queue.stop()
+        _queue = None
+
+
+def submit(photo_id: int) -> bool:
+    """
+    Queue a photo for OCR without waiting.
+
+    Returns:
+        Whether the photo was queued now; otherwise the sweeper picks it up
+        later
+    """
+    return _queue is not None and _queue.submit(photo_id)
+
+
+def metrics() -> Dict:
+    """Queue depth, job counts and timings of the recent jobs."""
+    return _queue.metrics() if _queue is not None else {"workers": 0}
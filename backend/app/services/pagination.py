@@ -0,0 +1,136 @@
+"""
+Keyset pagination of list endpoints.
+
+Pages are ordered by primary key and continue after the last key of the
+previous page, which the client gets back as an opaque cursor. Fetching a
+page is an index range scan whatever its depth, and rows inserted meanwhile
+never shift later pages.
+"""
+
+import base64
+import binascii
+from typing import Any, Callable, List, NamedTuple, Optional
+
+from fastapi import Response
+from sqlalchemy import func, select, text
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+CURSOR_VERSION = "p1"
+
+
+class InvalidPageCursor(ValueError):
+    pass
+
+
+class Page(NamedTuple):
+    items: List[Any]
+    next_cursor: Optional[str]
+
+
+def encode_page_cursor(key: int) -> str:
+    """Wrap the last key of a page into an opaque cursor."""
+    return (
+        base64.urlsafe_b64encode(f"{CURSOR_VERSION}:{key}".encode())
+        .decode()
+        .rstrip("=")
+    )
+
+
+def decode_page_cursor(cursor: str) -> int:
+    """
+    Extract the key a page continues after.
+
+    Raises:
+        InvalidPageCursor: If the cursor was not produced by :func:`encode_page_cursor`
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        version, key = base64.urlsafe_b64decode(padded.encode()).decode().split(":", 1)
+        if version != CURSOR_VERSION:
+            raise ValueError(version)
+        return int(key)
+    except (ValueError, binascii.Error, UnicodeDecodeError) as exc:
+        raise InvalidPageCursor(f"Invalid page cursor: {cursor}") from exc
+
+
+def keyset(query, column, after: Optional[int], limit: int, descending: bool = False):
+    """
+    Restrict ``query`` to the page after ``after``, plus one row telling
+    whether another page follows.
+    """
+    if after is not None:
+        query = query.where(column < after if descending else column > after)
+    return query.order_by(column.desc() if descending else column).limit(limit + 1)
+
+
+def page_of(rows: List[Any], limit: int, key: Callable[[Any], int]) -> Page:
+    """Split rows fetched by :func:`keyset` into the page and the next cursor."""
+    if len(rows) <= limit:
+        return Page(list(rows), None)
+    return Page(list(rows[:limit]), encode_page_cursor(key(rows[limit - 1])))
+
+
+async def paginate(
+    db: AsyncSession,
+    query,
+    column,
+    after: Optional[int],
+    limit: int,
+    descending: bool = False,
+) -> Page:
+    """
+    Fetch one page of model instances.
+
+    Args:
+        db: Database session
+        query: Select of a single model, possibly filtered
+        column: Unique, indexed key column of the model, usually its id
+        after: Key decoded from the client cursor, None for the first page
+        limit: Page size
+        descending: Walk the keys from newest to oldest
+
+    Returns:
+        Items of the page and the cursor of the next page, if any
+    """
+    rows = (await db.exec(keyset(query, column, after, limit, descending))).all()
+    return page_of(rows, limit, lambda row: getattr(row, column.key))
+
+
+async def total_count(db: AsyncSession, query, table: Optional[str] = None) -> int:
+    """
+    Count the rows matched by ``query``.
+
+    Args:
+        db: Database session
+        query: The unpaginated select
+        table: Table name when ``query`` is unfiltered; on Postgres the
+            planner's row estimate is returned then instead of a full count
+
+    Returns:
+        Number of rows, approximate for whole Postgres tables
+    """
+    if table is not None and db.bind.dialect.name == "postgresql":
+        estimate = (
+            await db.execute(
+                text("SELECT reltuples::bigint FROM pg_class WHERE relname = :table"),
+                {"table": table},
+            )
+        ).scalar()
+        # -1 until the table was first vacuumed or analyzed
+        if estimate is not None and estimate >= 0:
+            return estimate
+    return (
+        await db.execute(
+            select(func.count()).select_from(query.order_by(None).subquery())
+        )
+    ).scalar_one()
+
+
+def set_page_headers(
+    response: Response, next_cursor: Optional[str], total: Optional[int] = None
+) -> None:
+    """Expose the next cursor and the optional total count as response headers."""
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    if total is not None:
+        response.headers["X-Total-Count"] = str(total)
@@ -0,0 +1,149 @@
+"""
+Post-upload processing of photos.
+
+Runs after the upload response is sent: the uploaded bytes are re-encoded
+(bounded resolution, configurable quality and format, no EXIF), then the
+thumbnail, preview and perceptual hash are computed from the result and
+the photo is queued for OCR. Tablet photos of several megabytes shrink several-fold, which cuts
+storage growth and review bandwidth.
+
+The re-encoded copy replaces the upload for every photo sharing the blob.
+It is rendered outside any transaction; the switch then happens with the
+blob row locked, and the original file is deleted once committed, so a
+concurrent upload of the same content either is switched along or finds the
+copy.
+"""
+
+import logging
+from typing import Optional
+
+from sqlalchemy import update
+from sqlmodel.ext.asyncio.session import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.db.session import AsyncSessionLocal
+from app.models.photo import Photo, PhotoBlob
+from app.services import imaging, ocr, photo_hashes, photo_store
+
+logger = logging.getLogger(__name__)
+
+
+def _delete_original(name: str) -> None:
+    photo_store.blob_path(name).unlink(missing_ok=True)
+    imaging.delete_variants(name)
+
+
+async def reencode_blob(db: AsyncSession, sha256: str) -> Optional[str]:
+    """
+    Replace the stored bytes of a blob by a re-encoded copy.
+
+    Uploads that need no scaling down and don't shrink when re-encoded are
+    kept as they are, and the copy is discarded.
+
+    Args:
+        db: Database session, committed here
+        sha256: Hash of the uploaded content
+
+    Returns:
+        Name of the stored bytes, the re-encoded copy or the kept upload, or
+        None if the blob is gone
+    """
+    blob = await db.get(PhotoBlob, sha256)
+    if blob is None:
+        return None
+    if blob.encoded_name is not None:
+        return blob.encoded_name
+    original, original_size = photo_store.blob_name(sha256, blob.extension), blob.size
+    image_format = settings.PHOTO_INGEST_FORMAT.upper()
+    encoded = photo_store.encoded_name(
+        sha256, photo_store.ENCODED_EXTENSIONS[image_format]
+    )
+    # Release the connection while the pool works
+    await db.rollback()
+
+    encoded_size, resized = await imaging.run_in_pool(
+        imaging.reencode,
+        str(photo_store.blob_path(original)),
+        str(photo_store.blob_path(encoded)),
+        settings.PHOTO_INGEST_MAX_SIDE,
+        settings.PHOTO_INGEST_QUALITY,
+        image_format,
+    )
+    # Already compact uploads stay as they are, recorded as ingested
+    kept = not resized and encoded_size >= original_size
+    stored, stored_size = (original, original_size) if kept else (encoded, encoded_size)
+
+    switched = (
+        await db.execute(
+            update(PhotoBlob)
+            .where(PhotoBlob.sha256 == sha256, PhotoBlob.encoded_name.is_(None))
+            .values(encoded_name=stored, encoded_size=stored_size)
+            .returning(PhotoBlob.sha256)
+        )
+    ).first()
+    if switched is None:
+        # Deleted meanwhile, or re-encoded by a concurrent run
+        await db.rollback()
+        current = await db.get(PhotoBlob, sha256)
+        if current is None or current.encoded_name != encoded:
+            await run_in_threadpool(photo_store.blob_path(encoded).unlink, True)
+        return current.encoded_name if current is not None else None
+
+    if kept:
+        await db.commit()
+        await run_in_threadpool(photo_store.blob_path(encoded).unlink, True)
+        logger.info(
+            "Kept photo %s as uploaded: %d bytes, re-encoded %d",
+            sha256,
+            original_size,
+            encoded_size,
+        )
+        return original
+
+    await db.execute(
+        update(Photo)
+        .where(Photo.sha256 == sha256, Photo.filename == original)
+        .values(filename=encoded, size=encoded_size)
+    )
+    await db.commit()
+    await run_in_threadpool(_delete_original, original)
+    logger.info(
+        "Re-encoded photo %s: %d -> %d bytes", sha256, original_size, encoded_size
+    )
+    return encoded
+
+
+async def process_upload(photo_id: int) -> None:
+    """
+    Background task run after each upload: re-encode, render variants,
+    compute the perceptual hash, OCR.
+
+    Failures are logged; a photo that could not be re-encoded keeps its
+    uploaded bytes and is still processed further.
+    """
+    async with AsyncSessionLocal() as db:
+        photo = await db.get(Photo, photo_id)
+        if photo is None:
+            return
+        sha256, filename = photo.sha256, photo.filename
+        if (
+            settings.PHOTO_INGEST_ENABLED
+            and sha256 is not None
+            and photo_store.STORED_NAME.match(filename)
+        ):
+            try:
+                filename = await reencode_blob(db, sha256) or filename
+            except Exception:
+                logger.exception("Could not re-encode photo %s", photo_id)
+
+    await imaging.generate_variants_after_upload(filename)
+    try:
+        value = await imaging.run_in_pool(
+            imaging.dhash, str(photo_store.blob_path(filename))
+        )
+        async with AsyncSessionLocal() as db:
+            await photo_hashes.record_hash(db, photo_id, value)
+    except Exception:
+        logger.exception("Could not hash photo %s", photo_id)
+    ocr.submit(photo_id)
@@ -0,0 +1,208 @@
+"""
+Content-addressed storage of photo bytes.
+
+Uploaded content is stored once per SHA-256 under ``UPLOADS_DIR`` as
+``ab/cd/<sha256><ext>``, so identical uploads (client retries, one picture
+attached to several steps) share one file and no directory grows beyond a
+few hundred entries. ``PhotoBlob`` rows count the photos referencing each
+file; the bytes are deleted with the last reference.
+
+Once ingested, the bytes are replaced by a re-encoded copy named
+``ab/cd/<sha256>.min<ext>`` (see ``photo_ingest``); the blob keeps the hash
+of the upload, so later uploads of the same original still deduplicate.
+
+Adding a reference updates the blob row first and places the file while
+that row is locked by the open transaction. Releasing the last reference
+leaves the row at a count of zero; once that is committed, ``purge`` deletes
+the row, if still unreferenced, and then the file while the deleted row holds
+off uploads of the same content. An upload therefore either revives the row
+first and keeps its file, or waits and stores the file again.
+"""
+
+import os
+import re
+from datetime import datetime
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+from sqlalchemy import delete, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel.ext.asyncio.session import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.models.photo import Photo, PhotoBlob
+from app.services import imaging
+from app.services.photo_upload import ReceivedFile
+
+STORED_NAME = re.compile(r"^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.min)?\.[a-z0-9]+$")
+
+# Extensions of re-encoded copies, by Pillow format
+ENCODED_EXTENSIONS = {"JPEG": ".jpg", "WEBP": ".webp"}
+
+
+class StoredFile(NamedTuple):
+    name: str
+    size: int
+
+
+def blob_name(sha256: str, extension: str) -> str:
+    return f"{sha256[:2]}/{sha256[2:4]}/{sha256}{extension}"
+
+
+def encoded_name(sha256: str, extension: str) -> str:
+    return blob_name(sha256, f".min{extension}")
+
+
+def resolve(name: str) -> Optional[str]:
+    """
+    Current name of a stored file, following an original to its re-encoded copy.
+
+    Returns:
+        ``name`` if it exists, the name of the re-encoded copy replacing it, or
+        None
+    """
+    if blob_path(name).is_file():
+        return name
+    match = STORED_NAME.match(name)
+    if match and not match.group(1):
+        sha256 = Path(name).stem
+        for extension in ENCODED_EXTENSIONS.values():
+            if blob_path(encoded_name(sha256, extension)).is_file():
+                return encoded_name(sha256, extension)
+    return None
+
+
+def is_stored_name(name: str) -> bool:
+    """Whether ``name`` is a content-addressed name or a legacy flat file name."""
+    if STORED_NAME.match(name):
+        return True
+    return name == os.path.basename(name) and not name.startswith(".")
+
+
+def blob_path(name: str) -> Path:
+    return Path(settings.UPLOADS_DIR) / name
+
+
+def upsert_blob(dialect_name: str, sha256: str, extension: str, size: int):
+    """
+    Statement adding a reference to a blob, returning the blob's extension
+    and the name and size of its re-encoded copy, if any.
+
+    The extension of the first upload wins, so ``.jpeg`` and ``.jpg``
+    uploads of the same bytes share a file.
+    """
+    dialect = postgresql if dialect_name == "postgresql" else sqlite
+    table = PhotoBlob.__table__
+    stmt = dialect.insert(table).values(
+        sha256=sha256,
+        extension=extension,
+        size=size,
+        ref_count=1,
+        created_at=datetime.utcnow(),
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c.sha256], set_={"ref_count": table.c.ref_count + 1}
+    ).returning(table.c.extension, table.c.encoded_name, table.c.encoded_size)
+
+
+def _place(source: Path, target: Path) -> None:
+    target.parent.mkdir(parents=True, exist_ok=True)
+    # Replacing an existing blob is harmless: the content is identical
+    os.replace(source, target)
+
+
+async def add_reference(db: AsyncSession, received: ReceivedFile) -> StoredFile:
+    """
+    Store a received upload and count one reference to its content.
+
+    Args:
+        db: Database session; the caller commits
+        received: Upload streamed to a temporary file
+
+    Returns:
+        Stored name of the content, relative to ``UPLOADS_DIR``, and its size
+    """
+    try:
+        stmt = upsert_blob(
+            db.bind.dialect.name, received.sha256, received.extension, received.size
+        )
+        extension, encoded, encoded_size = (await db.execute(stmt)).one()
+        if encoded is not None:
+            # Ingested before; the re-encoded copy replaces the upload
+            received.path.unlink(missing_ok=True)
+            return StoredFile(encoded, encoded_size)
+        name = blob_name(received.sha256, extension)
+        await run_in_threadpool(_place, received.path, blob_path(name))
+    except BaseException:
+        received.path.unlink(missing_ok=True)
+        raise
+    return StoredFile(name, received.size)
+
+
+async def release(db: AsyncSession, photo: Photo) -> Optional[str]:
+    """
+    Drop the reference of a photo being deleted.
+
+    Args:
+        db: Database session; the caller commits
+        photo: The photo
+
+    Returns:
+        Stored name whose bytes are no longer referenced, to ``purge`` once
+        committed, or None
+    """
+    if photo.sha256 is None or not STORED_NAME.match(photo.filename):
+        # Legacy flat file, owned by this photo alone
+        return photo.filename
+
+    remaining = (
+        await db.execute(
+            update(PhotoBlob)
+            .where(PhotoBlob.sha256 == photo.sha256)
+            .values(ref_count=PhotoBlob.ref_count - 1)
+            .returning(PhotoBlob.ref_count)
+        )
+    ).scalar_one_or_none()
+    if remaining is not None and remaining > 0:
+        return None
+    return photo.filename
+
+
+def delete_stored(*names: str) -> None:
+    """Delete stored bytes and their rendered variants."""
+    for name in names:
+        blob_path(name).unlink(missing_ok=True)
+        imaging.delete_variants(name)
+
+
+async def purge(db: AsyncSession, name: str) -> None:
+    """
+    Delete the bytes of a name ``release`` returned, after its commit.
+
+    Nothing is deleted if an upload of the same content referenced the blob
+    again in the meantime.
+
+    Args:
+        db: Database session, committed here
+        name: Stored name returned by ``release``
+    """
+    if not STORED_NAME.match(name):
+        # Legacy flat file, owned by the deleted photo alone
+        await run_in_threadpool(delete_stored, name)
+        return
+
+    sha256 = Path(name).name[:64]
+    blob = (
+        await db.execute(
+            delete(PhotoBlob)
+            .where(PhotoBlob.sha256 == sha256, PhotoBlob.ref_count <= 0)
+            .returning(PhotoBlob.extension, PhotoBlob.encoded_name)
+        )
+    ).first()
+    if blob is not None:
+        extension, encoded = blob
+        names = {name, blob_name(sha256, extension)} | ({encoded} if encoded else set())
+        # Before committing, while the deleted row holds off new uploads
+        await run_in_threadpool(delete_stored, *names)
+    await db.commit()
@@ -0,0 +1,364 @@
+"""
+Streaming receiver of photo uploads.
+
+The multipart body is parsed while it arrives instead of being spooled and
+read whole. File data is hashed and written to a temporary file in
+fixed-size chunks on the threadpool, and the upload is aborted as soon as it
+exceeds the size limit, so memory per upload stays at about one chunk.
+Batch uploads stream each of their files the same way.
+"""
+
+import hashlib
+import os
+import uuid
+from pathlib import Path
+from typing import BinaryIO, Dict, List, NamedTuple, Optional, Tuple, Union
+
+from fastapi import HTTPException, Request, status
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ModuleNotFoundError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+# Room for the multipart boundaries and part headers around the file
+MULTIPART_OVERHEAD = 16 * 1024
+
+# OpenAPI description of the body parsed by receive_upload
+UPLOAD_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file"],
+                    "properties": {"file": {"type": "string", "format": "binary"}},
+                }
+            }
+        },
+    }
+}
+
+# OpenAPI description of the body parsed by receive_uploads
+BATCH_UPLOAD_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["files"],
+                    "properties": {
+                        "files": {
+                            "type": "array",
+                            "items": {"type": "string", "format": "binary"},
+                        }
+                    },
+                }
+            }
+        },
+    }
+}
+
+# OpenAPI description of a raw chunk of a resumable upload
+CHUNK_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "application/octet-stream": {
+                "schema": {"type": "string", "format": "binary"}
+            }
+        },
+    }
+}
+
+
+class ReceivedFile(NamedTuple):
+    path: Path
+    filename: str
+    extension: str
+    size: int
+    sha256: str
+
+
+class RejectedFile(NamedTuple):
+    filename: str
+    status_code: int
+    detail: str
+
+
+def _too_large() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"File size exceeds maximum allowed ({settings.MAX_UPLOAD_SIZE} bytes)",
+    )
+
+
+def _not_allowed() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+        detail=f"File extension not allowed. Allowed extensions: {', '.join(settings.ALLOWED_UPLOAD_EXTENSIONS)}",
+    )
+
+
+def _open_temp() -> BinaryIO:
+    tmp_dir = Path(settings.UPLOADS_TMP_DIR)
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+    return open(tmp_dir / f"{uuid.uuid4()}.part", "xb")
+
+
+def _write_chunk(target: BinaryIO, digest, chunk: bytes) -> None:
+    digest.update(chunk)
+    target.write(chunk)
+
+
+def hash_file(path: str) -> Tuple[str, int]:
+    """Return the SHA-256 and size of a file, read in upload-sized chunks."""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as source:
+        while chunk := source.read(settings.UPLOAD_CHUNK_SIZE):
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def _discard(target: BinaryIO) -> None:
+    target.close()
+    Path(target.name).unlink(missing_ok=True)
+
+
+class _Upload:
+    """One file of the body: its pending data, temporary file and outcome."""
+
+    def __init__(self, filename: str) -> None:
+        self.filename = filename
+        self.extension = os.path.splitext(filename)[1].lower()
+        self.buffer = bytearray()
+        self.size = 0
+        self.digest = hashlib.sha256()
+        self.target: Optional[BinaryIO] = None
+        self.complete = False
+        self.error: Optional[HTTPException] = None
+        if self.extension not in settings.ALLOWED_UPLOAD_EXTENSIONS:
+            self.error = _not_allowed()
+
+    def add(self, data: bytes) -> None:
+        if self.error is not None:
+            return
+        self.size += len(data)
+        if self.size > settings.MAX_UPLOAD_SIZE:
+            self.error = _too_large()
+            self.buffer.clear()
+            return
+        self.buffer += data
+
+    async def flush(self, chunk_size: int) -> None:
+        """Write whole chunks of the pending data, and the rest once complete."""
+        if self.error is not None:
+            if self.target is not None:
+                _discard(self.target)
+                self.target = None
+            return
+        while len(self.buffer) >= chunk_size or (self.complete and self.buffer):
+            if self.target is None:
+                self.target = await run_in_threadpool(_open_temp)
+            chunk = bytes(self.buffer[:chunk_size])
+            del self.buffer[:chunk_size]
+            await run_in_threadpool(_write_chunk, self.target, self.digest, chunk)
+
+    async def result(self) -> Union[ReceivedFile, RejectedFile]:
+        if self.error is not None:
+            return RejectedFile(
+                self.filename, self.error.status_code, self.error.detail
+            )
+        if self.target is None:
+            # Empty file
+            self.target = await run_in_threadpool(_open_temp)
+        await run_in_threadpool(self.target.close)
+        return ReceivedFile(
+            path=Path(self.target.name),
+            filename=self.filename,
+            extension=self.extension,
+            size=self.size,
+            sha256=self.digest.hexdigest(),
+        )
+
+
+class _FileParts:
+    """Multipart callbacks collecting the files of one field."""
+
+    def __init__(self, field: str, max_files: int) -> None:
+        self.field = field
+        self.max_files = max_files
+        self.header_field = b""
+        self.header_value = b""
+        self.headers: Dict[bytes, bytes] = {}
+        self.uploads: List[_Upload] = []
+        self.current: Optional[_Upload] = None
+        self.skipped = 0
+
+    def on_part_begin(self) -> None:
+        self.headers = {}
+
+    def on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self.header_field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self.header_value += data[start:end]
+
+    def on_header_end(self) -> None:
+        self.headers[self.header_field.lower()] = self.header_value
+        self.header_field = self.header_value = b""
+
+    def on_headers_finished(self) -> None:
+        _, options = parse_options_header(self.headers.get(b"content-disposition", b""))
+        name = options.get(b"name", b"").decode("latin-1")
+        filename = options.get(b"filename")
+        self.current = None
+        if name != self.field or filename is None:
+            return
+        if len(self.uploads) >= self.max_files:
+            # Files past the limit are counted, not kept
+            self.skipped += 1
+            return
+        self.current = _Upload(os.path.basename(filename.decode("utf-8", "replace")))
+        self.uploads.append(self.current)
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self.current is not None:
+            self.current.add(data[start:end])
+
+    def on_part_end(self) -> None:
+        if self.current is not None:
+            self.current.complete = True
+        self.current = None
+
+    def callbacks(self) -> dict:
+        return {
+            name: getattr(self, name)
+            for name in (
+                "on_part_begin",
+                "on_header_field",
+                "on_header_value",
+                "on_header_end",
+                "on_headers_finished",
+                "on_part_data",
+                "on_part_end",
+            )
+        }
+
+
+async def _receive(
+    request: Request, field: str, max_files: int, fail_fast: bool
+) -> _FileParts:
+    content_type, options = parse_options_header(
+        request.headers.get("content-type", "")
+    )
+    if content_type != b"multipart/form-data" or b"boundary" not in options:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Expected a multipart/form-data body",
+        )
+
+    # Refuse announced oversized bodies before reading them
+    content_length = request.headers.get("content-length", "")
+    max_body = (settings.MAX_UPLOAD_SIZE + MULTIPART_OVERHEAD) * max_files
+    if content_length.isdigit() and int(content_length) > max_body:
+        raise _too_large()
+
+    chunk_size = settings.UPLOAD_CHUNK_SIZE
+    parts = _FileParts(field, max_files)
+    parser = MultipartParser(options[b"boundary"], parts.callbacks())
+    try:
+        async for body_chunk in request.stream():
+            parser.write(body_chunk)
+            for upload in parts.uploads:
+                if fail_fast and upload.error is not None:
+                    raise upload.error
+                await upload.flush(chunk_size)
+
+        parser.finalize()
+        for upload in parts.uploads:
+            upload.complete = True
+            await upload.flush(chunk_size)
+    except BaseException:
+        # Also runs on client disconnects and cancellation, so don't await
+        for upload in parts.uploads:
+            if upload.target is not None:
+                _discard(upload.target)
+        raise
+    return parts
+
+
+async def receive_upload(request: Request, field: str = "file") -> ReceivedFile:
+    """
+    Stream the file of a multipart upload into a temporary file.
+
+    Args:
+        request: Request with a ``multipart/form-data`` body
+        field: Form field holding the file
+
+    Returns:
+        The temporary file, to be moved to its final place by the caller,
+        with the client file name, size and SHA-256 of the content
+
+    Raises:
+        HTTPException: 413 if the file exceeds ``MAX_UPLOAD_SIZE``, 415 for a
+            disallowed extension, 422 if the body holds no file
+    """
+    parts = await _receive(request, field, max_files=1, fail_fast=True)
+    if not parts.uploads:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"{field}: Field required",
+        )
+    upload = parts.uploads[0]
+    if upload.error is not None:
+        raise upload.error
+    return await upload.result()
+
+
+async def receive_uploads(
+    request: Request, field: str = "files", max_files: Optional[int] = None
+) -> List[Union[ReceivedFile, RejectedFile]]:
+    """
+    Stream every file of a multipart upload into its own temporary file.
+
+    A file that is too large or has a disallowed extension is rejected
+    without failing the others.
+
+    Args:
+        request: Request with a ``multipart/form-data`` body
+        field: Form field holding the files
+        max_files: Most files accepted, ``MAX_BATCH_UPLOAD_FILES`` by default
+
+    Returns:
+        In body order, each file as returned by :func:`receive_upload`, or
+        the error that rejected it with the client file name
+
+    Raises:
+        HTTPException: 413 if the body holds more than ``max_files`` files,
+            422 if it holds none
+    """
+    max_files = max_files or settings.MAX_BATCH_UPLOAD_FILES
+    parts = await _receive(request, field, max_files=max_files, fail_fast=False)
+    results = [await upload.result() for upload in parts.uploads]
+    if parts.skipped:
+        for result in results:
+            if isinstance(result, ReceivedFile):
+                result.path.unlink(missing_ok=True)
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {max_files} files can be uploaded at once",
+        )
+    if not results:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"{field}: Field required",
+        )
+    return results
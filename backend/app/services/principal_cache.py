@@ -0,0 +1,145 @@
+"""
+Cache of authenticated principals.
+
+``get_current_user`` runs on every authenticated request, including the polls
+of the checklist execution screen. Users are cached by id for a short TTL in
+a bounded LRU, so most requests resolve the user and its role without
+touching the database.
+
+Cached entries are plain snapshots: every lookup returns a new, detached
+``User`` that endpoints may read but must re-load before modifying. Each
+entry remembers the version of the user's ``user:{id}`` tag in the shared
+cache when it was loaded, and a lookup only uses it while the version is
+unchanged. Commits that change or delete a user evict the entry here and
+bump the tag, so role and ``is_active`` changes take effect on the next
+request of every worker process, for one cache round trip per request.
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Set, Tuple, Type
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session as SASession
+
+from app.core.config import settings
+from app.models.user import User
+from app.services.cache import get_cache
+
+logger = logging.getLogger(__name__)
+
+# user id -> (expiry as monotonic time, tag version, user fields)
+_principals: "OrderedDict[int, Tuple[float, bytes, Dict[str, Any]]]" = OrderedDict()
+
+_SESSION_INFO_KEY = "principal_cache.evict"
+
+# Invalidations being published, referenced until done
+_publishing: Set[asyncio.Task] = set()
+
+
+def principal_tag(user_id: int) -> str:
+    return f"user:{user_id}"
+
+
+async def get_principal(
+    user_id: int, load: Callable[[], Awaitable[Optional[User]]]
+) -> Optional[User]:
+    """
+    Return a snapshot of a user, calling ``load`` unless a fresh one is cached.
+
+    Args:
+        user_id: Id of the user, the token subject
+        load: Reads the user from the database
+
+    Returns:
+        The user, or None if ``load`` found none
+    """
+    # Read before loading, so an invalidation during the load is not missed
+    (version,) = await get_cache().tag_versions([principal_tag(user_id)])
+    entry = _principals.get(user_id)
+    if entry is not None:
+        expires_at, cached_version, fields = entry
+        if expires_at >= time.monotonic() and cached_version == version:
+            _principals.move_to_end(user_id)
+            return User(**fields)
+        _principals.pop(user_id, None)
+
+    user = await load()
+    if user is not None:
+        cache_principal(user, version)
+    return user
+
+
+def cache_principal(user: User, version: bytes) -> None:
+    """Store a snapshot of ``user`` loaded under the given tag version."""
+    if settings.PRINCIPAL_CACHE_SIZE <= 0:
+        return
+    _principals[user.id] = (
+        time.monotonic() + settings.PRINCIPAL_CACHE_TTL_SECONDS,
+        version,
+        user.model_dump(),
+    )
+    _principals.move_to_end(user.id)
+    while len(_principals) > settings.PRINCIPAL_CACHE_SIZE:
+        _principals.popitem(last=False)
+
+
+async def invalidate_principals(user_ids: Iterable[int]) -> None:
+    """Make every worker read the current rows of the users on their next request."""
+    user_ids = set(user_ids)
+    for user_id in user_ids:
+        _principals.pop(user_id, None)
+    await get_cache().invalidate([principal_tag(user_id) for user_id in user_ids])
+
+
+def _publish(user_ids: Set[int]) -> None:
+    for user_id in user_ids:
+        _principals.pop(user_id, None)
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        # Sync session outside the event loop, e.g. a maintenance script
+        asyncio.run(invalidate_principals(user_ids))
+        return
+    task = loop.create_task(invalidate_principals(user_ids))
+    _publishing.add(task)
+    task.add_done_callback(_published)
+
+
+def _published(task: asyncio.Task) -> None:
+    _publishing.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Could not invalidate principals: %s", task.exception())
+
+
+def _after_flush(session: SASession, flush_context) -> None:
+    changed = {
+        obj.id
+        for obj in list(session.dirty) + list(session.deleted)
+        if isinstance(obj, User) and obj.id is not None
+    }
+    if changed:
+        session.info.setdefault(_SESSION_INFO_KEY, set()).update(changed)
+
+
+def _after_commit(session: SASession) -> None:
+    user_ids = session.info.pop(_SESSION_INFO_KEY, None)
+    if user_ids:
+        _publish(user_ids)
+
+
+def _after_rollback(session: SASession) -> None:
+    session.info.pop(_SESSION_INFO_KEY, None)
+
+
+def track_principals(session_class: Type[SASession]) -> None:
+    """Evict cached principals when sessions of ``session_class`` commit user changes."""
+    for name, listener in (
+        ("after_flush", _after_flush),
+        ("after_commit", _after_commit),
+        ("after_rollback", _after_rollback),
+    ):
+        if not event.contains(session_class, name, listener):
+            event.listen(session_class, name, listener)
@@ -0,0 +1,365 @@
+"""
+JSON-schema validation of templates, steps and results.
+
+The typed fields are already checked by the request models; the schemas add
+the structural rules they can't express, chiefly for the free-form
+``metadata`` objects: bounded size, key names and nesting, and sane lengths
+and ranges elsewhere.
+
+Schemas are versioned, and each version is compiled once per process, on
+first use. ``jsonschema`` walks a schema keyword by keyword for every value,
+which costs several milliseconds for a template of a few dozen steps, so the
+schema is also compiled into plain Python checks. Those accept valid
+documents, the common case, in a fraction of that time; only documents they
+reject go through ``jsonschema``, which collects every error, so a client
+fixes all of them in one round trip.
+"""
+
+import re
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from jsonschema import Draft202012Validator
+
+from app.models.step import StepCategory
+from app.models.template import TemplateStatus
+
+TEMPLATE = "template"
+STEP = "step"
+RESULT = "result"
+
+# Free-form values: scalars, or flat lists and objects of scalars. Keywords
+# only apply to their own JSON type, which avoids a slower anyOf.
+_METADATA_SCALAR = {
+    "type": ["string", "number", "boolean", "null"],
+    "maxLength": 2000,
+}
+_METADATA_VALUE = {
+    "type": ["string", "number", "boolean", "null", "array", "object"],
+    "maxLength": 2000,
+    "maxItems": 100,
+    "items": _METADATA_SCALAR,
+    "maxProperties": 50,
+    "additionalProperties": _METADATA_SCALAR,
+}
+_METADATA = {
+    "type": "object",
+    "maxProperties": 50,
+    "propertyNames": {"pattern": r"^[A-Za-z_][A-Za-z0-9_.\-]{0,63}$"},
+    "additionalProperties": _METADATA_VALUE,
+}
+
+# No leading or trailing whitespace
+_TRIMMED = r"^\S(.*\S)?$"
+
+_STEP_V1 = {
+    "type": "object",
+    "required": ["code", "description", "requirement"],
+    "properties": {
+        "code": {"type": "string", "maxLength": 20, "pattern": _TRIMMED},
+        "description": {"type": "string", "minLength": 1, "maxLength": 2000},
+        "requirement": {"type": "string", "minLength": 1, "maxLength": 2000},
+        "category": {"enum": [category.value for category in StepCategory]},
+        "photo_required": {"type": "boolean"},
+        "std_time": {"type": "integer", "minimum": 0, "maximum": 24 * 60 * 60},
+        "metadata": _METADATA,
+    },
+}
+
+_TEMPLATE_V1 = {
+    "type": "object",
+    "required": ["name", "template_id", "revision"],
+    "properties": {
+        "name": {"type": "string", "minLength": 1, "maxLength": 100},
+        "template_id": {"type": "string", "maxLength": 20, "pattern": _TRIMMED},
+        "revision": {"type": "string", "maxLength": 10, "pattern": _TRIMMED},
+        "status": {"enum": [status.value for status in TemplateStatus]},
+        "model_id": {"type": ["integer", "null"]},
+        "stage_id": {"type": ["integer", "null"]},
+        "metadata": _METADATA,
+        "steps": {"type": ["array", "null"], "maxItems": 1000, "items": _STEP_V1},
+    },
+}
+
+# Results arrive partially on sync updates, so nothing is required
+_RESULT_V1 = {
+    "type": "object",
+    "properties": {
+        "step_id": {"type": "integer", "minimum": 1},
+        "ok_flag": {"type": "boolean"},
+        "comment": {"type": ["string", "null"], "maxLength": 5000},
+        "photo_path": {"type": ["string", "null"], "maxLength": 255},
+        "execution_time": {
+            "type": ["integer", "null"],
+            "minimum": 0,
+            "maximum": 24 * 60 * 60,
+        },
+        # Offline clients send unset fields as null
+        "metadata": {**_METADATA, "type": ["object", "null"]},
+    },
+}
+
+# Kind -> version -> schema
+SCHEMAS: Dict[str, Dict[int, Dict[str, Any]]] = {
+    TEMPLATE: {1: _TEMPLATE_V1},
+    STEP: {1: _STEP_V1},
+    RESULT: {1: _RESULT_V1},
+}
+
+CURRENT_VERSIONS: Dict[str, int] = {
+    kind: max(versions) for kind, versions in SCHEMAS.items()
+}
+
+
+class SchemaError(NamedTuple):
+    loc: Tuple[Any, ...]  # path of the offending value in the document
+    msg: str
+
+
+class SchemaValidationError(ValueError):
+    def __init__(self, errors: List[SchemaError]) -> None:
+        super().__init__("; ".join(messages(errors)))
+        self.errors = errors
+
+    def detail(self, *prefix: Any) -> List[Dict[str, Any]]:
+        """The errors in the layout of FastAPI's 422 responses."""
+        return [
+            {
+                "loc": [*prefix, *error.loc],
+                "msg": error.msg,
+                "type": "value_error.schema",
+            }
+            for error in self.errors
+        ]
+
+
+Check = Callable[[Any], bool]
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+_PYTHON_TYPES = {
+    "string": (str,),
+    "integer": (int,),
+    "number": (int, float),
+    "boolean": (bool,),
+    "null": (type(None),),
+    "array": (list,),
+    "object": (dict,),
+}
+
+
+def _type_check(names: List[str]) -> Check:
+    # JSON types as jsonschema tells them apart: booleans are not numbers,
+    # and floats without a fractional part are integers
+    types = tuple(
+        {python_type for name in names for python_type in _PYTHON_TYPES[name]}
+    )
+    if "boolean" in names:
+        return lambda value: isinstance(value, types)
+    if "integer" in names and "number" not in names:
+        return lambda value: (
+            isinstance(value, types)
+            and not isinstance(value, bool)
+            or isinstance(value, float)
+            and value.is_integer()
+        )
+    return lambda value: isinstance(value, types) and not isinstance(value, bool)
+
+
+_COMPILED_KEYWORDS = {
+    "type",
+    "enum",
+    "minLength",
+    "maxLength",
+    "pattern",
+    "minimum",
+    "maximum",
+    "maxItems",
+    "items",
+    "required",
+    "properties",
+    "additionalProperties",
+    "propertyNames",
+    "maxProperties",
+}
+
+
+def _compile(schema: Any) -> Check:
+    """
+    Compile a schema into a check accepting exactly the documents it allows.
+
+    Only the keywords of :data:`SCHEMAS` are supported; a schema using others
+    fails here, when it is first used, rather than being checked loosely.
+    """
+    if isinstance(schema, bool):
+        return lambda value: schema
+    unsupported = set(schema) - _COMPILED_KEYWORDS
+    if unsupported:
+        raise ValueError(
+            f"Schema keywords not supported by the compiled checks: {', '.join(sorted(unsupported))}"
+        )
+
+    checks: List[Check] = []
+    if "type" in schema:
+        names = [schema["type"]] if isinstance(schema["type"], str) else schema["type"]
+        checks.append(_type_check(names))
+    if "enum" in schema:
+        if not all(isinstance(item, str) for item in schema["enum"]):
+            raise ValueError(
+                "Only enums of strings are supported by the compiled checks"
+            )
+        allowed = frozenset(schema["enum"])
+        checks.append(lambda value: isinstance(value, str) and value in allowed)
+
+    min_length, max_length = schema.get("minLength", 0), schema.get("maxLength")
+    if min_length or max_length is not None:
+        longest = max_length if max_length is not None else float("inf")
+        checks.append(
+            lambda value: not isinstance(value, str)
+            or min_length <= len(value) <= longest
+        )
+    if "pattern" in schema:
+        pattern = re.compile(schema["pattern"])
+        checks.append(
+            lambda value: not isinstance(value, str)
+            or pattern.search(value) is not None
+        )
+
+    if "minimum" in schema or "maximum" in schema:
+        low, high = schema.get("minimum", float("-inf")), schema.get(
+            "maximum", float("inf")
+        )
+        checks.append(lambda value: not _is_number(value) or low <= value <= high)
+
+    if "maxItems" in schema or "items" in schema:
+        max_items = schema.get("maxItems", float("inf"))
+        item = _compile(schema.get("items", True))
+        checks.append(
+            lambda value: not isinstance(value, list)
+            or (len(value) <= max_items and all(map(item, value)))
+        )
+
+    object_keywords = {
+        "required",
+        "properties",
+        "additionalProperties",
+        "propertyNames",
+        "maxProperties",
+    }
+    if object_keywords & set(schema):
+        required = schema.get("required", [])
+        properties = {
+            name: _compile(subschema)
+            for name, subschema in schema.get("properties", {}).items()
+        }
+        additional = _compile(schema.get("additionalProperties", True))
+        property_name = _compile(schema.get("propertyNames", True))
+        max_properties = schema.get("maxProperties", float("inf"))
+
+        def check_object(value: Any) -> bool:
+            if not isinstance(value, dict):
+                return True
+            if len(value) > max_properties or any(
+                name not in value for name in required
+            ):
+                return False
+            for name, item in value.items():
+                if not property_name(name) or not properties.get(name, additional)(
+                    item
+                ):
+                    return False
+            return True
+
+        checks.append(check_object)
+
+    if not checks:
+        return lambda value: True
+    if len(checks) == 1:
+        return checks[0]
+
+    def check_all(value: Any) -> bool:
+        for check in checks:
+            if not check(value):
+                return False
+        return True
+
+    return check_all
+
+
+class CompiledSchema:
+    def __init__(self, schema: Dict[str, Any]) -> None:
+        Draft202012Validator.check_schema(schema)
+        self.validator = Draft202012Validator(schema)
+        self.is_valid = _compile(schema)
+
+
+@lru_cache(maxsize=None)
+def get_schema(kind: str, version: int) -> CompiledSchema:
+    """The compiled schema of a kind and version, built on first use."""
+    return CompiledSchema(SCHEMAS[kind][version])
+
+
+def errors(
+    kind: str, document: Any, version: Optional[int] = None
+) -> List[SchemaError]:
+    """
+    Validate a document and collect every error.
+
+    Args:
+        kind: ``TEMPLATE``, ``STEP`` or ``RESULT``
+        document: The JSON-compatible document
+        version: Schema version, the current one by default
+
+    Returns:
+        The errors, in document order; empty if the document is valid
+    """
+    schema = get_schema(kind, version or CURRENT_VERSIONS[kind])
+    if schema.is_valid(document):
+        return []
+    return [
+        SchemaError(tuple(error.absolute_path), error.message)
+        for error in schema.validator.iter_errors(document)
+    ]
+
+
+def validate(kind: str, document: Any, version: Optional[int] = None) -> None:
+    """
+    Validate a document.
+
+    Raises:
+        SchemaValidationError: With every error of the document
+    """
+    found = errors(kind, document, version)
+    if found:
+        raise SchemaValidationError(found)
+
+
+def validate_all(
+    kind: str, documents: List[Any], version: Optional[int] = None
+) -> None:
+    """
+    Validate a list of documents, each error located by the document's position.
+
+    Raises:
+        SchemaValidationError: With every error of every document
+    """
+    found = [
+        error._replace(loc=(position, *error.loc))
+        for position, document in enumerate(documents)
+        for error in errors(kind, document, version)
+    ]
+    if found:
+        raise SchemaValidationError(found)
+
+
+def messages(found: List[SchemaError], prefix: str = "") -> List[str]:
+    """Errors as ``path: message`` strings, as in sync and import reports."""
+    located = []
+    for error in found:
+        path = [prefix] if prefix else []
+        path += [str(part) for part in error.loc]
+        located.append(f"{'.'.join(path) or '__root__'}: {error.msg}")
+    return located
@@ -0,0 +1,230 @@
+"""
+Batched ingestion of checklists uploaded by offline clients.
+
+All existing checklists, results, templates and steps referenced by an upload
+are resolved with a handful of ``IN (...)`` queries, new results are written
+with a single bulk INSERT, changed results with a single bulk UPDATE, and the
+whole upload is committed in one transaction.
+"""
+
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Set, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy import insert, update
+from sqlmodel import Session, select
+
+from app.models.checklist import (
+    QCDoc,
+    QCDocSync,
+    QCDocSyncOutcome,
+    QCResult,
+)
+from app.models.step import Step
+from app.models.template import Template
+from app.models.change_log import ChangeOp
+from app.models.user import User
+from app.services import schema_validation
+from app.services.change_log import RESULT, record_changes
+
+logger = logging.getLogger(__name__)
+
+# Keys of the client payload that never overwrite server-side values
+CHECKLIST_READONLY_FIELDS = {"id", "results"}
+RESULT_READONLY_FIELDS = {"id"}
+
+
+def _validation_messages(exc: ValidationError) -> List[str]:
+    return [
+        f"{'.'.join(str(loc) for loc in error['loc'])}: {error['msg']}"
+        for error in exc.errors()
+    ]
+
+
+def ingest_checklists(
+    db: Session, offline_checklists: List[Dict[str, Any]], current_user: User
+) -> List[QCDocSyncOutcome]:
+    """
+    Apply checklists created or updated offline in a single transaction.
+
+    Args:
+        db: Database session
+        offline_checklists: Raw checklist payloads sent by the client
+        current_user: User performing the sync, owner of new checklists
+
+    Returns:
+        One outcome per uploaded checklist, in upload order
+    """
+    now = datetime.utcnow()
+    outcomes: List[QCDocSyncOutcome] = []
+    items: List[Tuple[QCDocSyncOutcome, QCDocSync]] = []
+
+    # Parse payloads; malformed items are rejected without touching the DB
+    for index, raw in enumerate(offline_checklists):
+        outcome = QCDocSyncOutcome(index=index, status="rejected")
+        outcomes.append(outcome)
+        try:
+            items.append((outcome, QCDocSync.model_validate(raw)))
+        except ValidationError as exc:
+            outcome.errors = _validation_messages(exc)
+
+    if not items:
+        return outcomes
+
+    # Resolve everything the upload refers to with one query per table
+    doc_ids = {item.id for _, item in items if item.id is not None}
+    existing_docs: Dict[int, QCDoc] = {}
+    if doc_ids:
+        existing_docs = {
+            doc.id: doc for doc in db.exec(select(QCDoc).where(QCDoc.id.in_(doc_ids)))
+        }
+
+    existing_results: Dict[int, Dict[int, int]] = {}
+    if existing_docs:
+        rows = db.exec(
+            select(QCResult.id, QCResult.qc_doc_id, QCResult.step_id).where(
+                QCResult.qc_doc_id.in_(existing_docs.keys())
+            )
+        )
+        for result_id, qc_doc_id, step_id in rows:
+            existing_results.setdefault(qc_doc_id, {})[result_id] = step_id
+
+    template_ids = {
+        item.template_id for _, item in items if item.template_id is not None
+    }
+    template_ids |= {doc.template_id for doc in existing_docs.values()}
+    known_templates: Set[int] = set()
+    if template_ids:
+        known_templates = set(
+            db.exec(select(Template.id).where(Template.id.in_(template_ids)))
+        )
+
+    step_ids = {
+        result.step_id
+        for _, item in items
+        for result in item.results or []
+        if result.step_id is not None
+    }
+    step_templates: Dict[int, int] = {}
+    if step_ids:
+        step_templates = dict(
+            db.exec(
+                select(Step.id, Step.template_id).where(Step.id.in_(step_ids))
+            ).all()
+        )
+
+    # Plan all writes in memory
+    new_docs: List[Tuple[QCDocSyncOutcome, QCDoc]] = []
+    result_inserts: List[Tuple[QCDoc, Dict[str, Any]]] = []
+    result_updates: List[Dict[str, Any]] = []
+    result_parents: List[Tuple[int, int]] = []
+
+    for outcome, item in items:
+        doc = existing_docs.get(item.id) if item.id is not None else None
+        fields = item.model_dump(exclude_unset=True, exclude=CHECKLIST_READONLY_FIELDS)
+        template_id = fields.get("template_id", doc.template_id if doc else None)
+
+        errors = []
+        if doc is None:
+            for required in ("serial_no", "template_id"):
+                if fields.get(required) is None:
+                    errors.append(f"{required}: Field required")
+        if template_id is not None and template_id not in known_templates:
+            errors.append(f"template_id: Template {template_id} not found")
+
+        doc_results = existing_results.get(doc.id, {}) if doc else {}
+        results_by_step = {
+            step_id: result_id for result_id, step_id in doc_results.items()
+        }
+        planned_inserts, planned_updates = [], []
+        for position, result in enumerate(item.results or []):
+            values = result.model_dump(
+                exclude_unset=True, exclude=RESULT_READONLY_FIELDS
+            )
+            invalid = schema_validation.errors(schema_validation.RESULT, values)
+            if invalid:
+                errors += schema_validation.messages(invalid, f"results.{position}")
+                continue
+            if (
+                result.step_id is not None
+                and step_templates.get(result.step_id) != template_id
+            ):
+                errors.append(
+                    f"results.{position}.step_id: Step {result.step_id} not in template"
+                )
+                continue
+
+            result_id = None
+            if result.id is not None and result.id in doc_results:
+                result_id = result.id
+            elif result.step_id is not None:
+                result_id = results_by_step.get(result.step_id)
+
+            if result_id is not None:
+                if values:
+                    planned_updates.append({"id": result_id, **values})
+            elif result.step_id is None or result.ok_flag is None:
+                errors.append(f"results.{position}: step_id and ok_flag are required")
+            else:
+                # Bulk inserts skip model defaults, so apply them here
+                planned_inserts.append({"metadata": {}, **values})
+
+        if errors:
+            outcome.errors = errors
+            continue
+
+        outcome.results_created = len(planned_inserts)
+        outcome.results_updated = len(planned_updates)
+        result_updates.extend(planned_updates)
+
+        if doc is not None:
+            for key, value in fields.items():
+                setattr(doc, key, value)
+            doc.updated_at = now
+            db.add(doc)
+            outcome.status = "updated"
+            outcome.id = doc.id
+            result_parents.extend((values["id"], doc.id) for values in planned_updates)
+            result_inserts.extend((doc, values) for values in planned_inserts)
+        else:
+            new_doc = QCDoc(
+                **fields,
+                created_by_id=current_user.id,  # Always use current user for new checklists
+                created_at=now,
+                updated_at=now,
+            )
+            db.add(new_doc)
+            new_docs.append((outcome, new_doc))
+            outcome.status = "created"
+            result_inserts.extend((new_doc, values) for values in planned_inserts)
+
+    # New checklists need their primary keys before results can reference them
+    db.flush()
+    for outcome, doc in new_docs:
+        outcome.id = doc.id
+
+    # Bulk statements bypass the unit of work, so they feed the change log here
+    if result_inserts:
+        inserted = db.execute(
+            insert(QCResult).returning(QCResult.id, QCResult.qc_doc_id),
+            [
+                {**values, "qc_doc_id": doc.id, "created_at": now}
+                for doc, values in result_inserts
+            ],
+        ).all()
+        record_changes(db, RESULT, inserted, ChangeOp.UPSERT)
+    if result_updates:
+        db.execute(update(QCResult), result_updates)
+        record_changes(db, RESULT, result_parents, ChangeOp.UPSERT)
+
+    db.commit()
+
+    logger.info(
+        "Ingested %d checklists (%d results created, %d updated, %d rejected)",
+        sum(1 for outcome in outcomes if outcome.status != "rejected"),
+        len(result_inserts),
+        len(result_updates),
+        sum(1 for outcome in outcomes if outcome.status == "rejected"),
+    )
+    return outcomes
@@ -0,0 +1,129 @@
+"""
+Streaming NDJSON variant of the sync downloads.
+
+Every line is a JSON object ``{"type": ..., "data": ...}`` where type is one
+of ``uploaded``, ``template``, ``checklist``, ``result``, ``deleted`` and,
+last, ``cursor``. Rows are read in fixed-size batches from a server-side
+cursor, so memory per request stays flat regardless of history size. Clients
+can apply lines as they arrive but should only store the cursor once the
+final line has been received.
+"""
+
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Set
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.config import settings
+from app.db.session import AsyncSessionLocal
+from app.models.checklist import QCDoc, QCResult
+from app.models.template import Template
+from app.services.template_bundle import bundle_query, dumps, get_fragments
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def wants_ndjson(request: Request) -> bool:
+    """Whether the client asked for the streaming response mode."""
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def ndjson_response(lines: AsyncIterator[bytes]) -> StreamingResponse:
+    # Keep nginx from buffering the whole stream before relaying it
+    return StreamingResponse(
+        lines, media_type=NDJSON_MEDIA_TYPE, headers={"X-Accel-Buffering": "no"}
+    )
+
+
+def _line(kind: str, data: Any) -> bytes:
+    return dumps({"type": kind, "data": data}) + b"\n"
+
+
+async def _batches(
+    db: AsyncSession, query, id_column, ids: Optional[Set[int]]
+) -> AsyncIterator[List]:
+    batch_size = settings.SYNC_STREAM_BATCH_SIZE
+    if ids is None:
+        result = await db.stream_scalars(query.execution_options(yield_per=batch_size))
+        async for partition in result.partitions():
+            yield partition
+        return
+
+    ordered = sorted(ids)
+    for start in range(0, len(ordered), batch_size):
+        yield (
+            await db.exec(
+                query.where(id_column.in_(ordered[start : start + batch_size]))
+            )
+        ).all()
+
+
+def _deleted_lines(deleted: Dict[str, List[int]]) -> Iterable[bytes]:
+    for entity, ids in deleted.items():
+        if ids:
+            yield _line("deleted", {"entity": entity, "ids": ids})
+
+
+async def stream_templates(
+    cursor: str, template_ids: Optional[Set[int]], deleted: Dict[str, List[int]]
+) -> AsyncIterator[bytes]:
+    """
+    Yield templates with their steps as NDJSON lines.
+
+    Args:
+        cursor: Cursor to hand back to the client on the last line
+        template_ids: Templates to send, or None for all active templates
+        deleted: Deleted ids per entity
+    """
+    # The request-scoped session is closed before the body is streamed
+    async with AsyncSessionLocal() as db:
+        query = bundle_query().order_by(Template.id)
+        async for batch in _batches(db, query, Template.id, template_ids):
+            for fragment in await get_fragments(db, batch):
+                yield b'{"type":"template","data":' + fragment + b"}\n"
+            db.expunge_all()
+
+    for line in _deleted_lines(deleted):
+        yield line
+    yield _line("cursor", cursor)
+
+
+async def stream_checklists(
+    query,
+    cursor: str,
+    checklist_ids: Optional[Set[int]],
+    deleted: Dict[str, List[int]],
+    uploaded: List[Dict[str, Any]],
+) -> AsyncIterator[bytes]:
+    """
+    Yield checklists followed by their results as NDJSON lines.
+
+    Args:
+        query: Checklists visible to the user
+        cursor: Cursor to hand back to the client on the last line
+        checklist_ids: Checklists to send, or None for all matching ``query``
+        deleted: Deleted ids per entity
+        uploaded: Outcomes of the checklists uploaded with the request
+    """
+    yield _line("uploaded", uploaded)
+
+    async with AsyncSessionLocal() as db:
+        async for batch in _batches(
+            db, query.order_by(QCDoc.id), QCDoc.id, checklist_ids
+        ):
+            results = await db.exec(
+                select(QCResult)
+                .where(QCResult.qc_doc_id.in_([checklist.id for checklist in batch]))
+                .order_by(QCResult.qc_doc_id, QCResult.id)
+            )
+            for checklist in batch:
+                yield _line("checklist", checklist.model_dump())
+            for qc_result in results:
+                yield _line("result", qc_result.model_dump())
+            db.expunge_all()
+
+    for line in _deleted_lines(deleted):
+        yield line
+    yield _line("cursor", cursor)
@@ -0,0 +1,213 @@
+"""
+Prebuilt offline bundles of templates and their steps.
+
+Every template is serialized together with its steps once per revision and
+kept as a JSON fragment in the shared cache. The full bundle served to new devices is written to
+disk next to a gzip-compressed copy, keyed by a fingerprint of the templates
+it contains, so a full sync is a plain file read.
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence
+
+from fastapi.encoders import jsonable_encoder
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.models.step import Step
+from app.models.template import Template, TemplateStatus
+from app.services.cache import get_cache
+from app.services.change_log import current_sequence, encode_cursor
+
+logger = logging.getLogger(__name__)
+
+
+class TemplateBundle(NamedTuple):
+    etag: str
+    path: Path
+    gzip_path: Path
+
+
+def _fragment_key(template_id: int, revision: str, updated_at: datetime) -> str:
+    return f"{template_id}:{revision}:{updated_at.isoformat()}"
+
+
+def _fragment_cache_name(key: str) -> str:
+    # Content addressed: a changed template gets a new key, no invalidation needed
+    return f"template-fragment:{key}"
+
+
+def dumps(value) -> bytes:
+    return json.dumps(
+        jsonable_encoder(value), separators=(",", ":"), ensure_ascii=False
+    ).encode()
+
+
+# Templates delivered to offline devices
+ACTIVE_TEMPLATES = Template.status != TemplateStatus.ARCHIVED
+
+
+def bundle_query():
+    """Select the templates delivered to offline devices."""
+    return select(Template).where(ACTIVE_TEMPLATES)
+
+
+async def get_fragments(db: AsyncSession, templates: Sequence[Template]) -> List[bytes]:
+    """
+    Return the serialized form of each template, building missing fragments.
+
+    Steps of all templates without an up-to-date fragment are loaded with a
+    single query.
+
+    Args:
+        db: Database session
+        templates: Templates to serialize
+
+    Returns:
+        JSON fragments in the order of ``templates``
+    """
+    keys = [_fragment_key(t.id, t.revision, t.updated_at) for t in templates]
+    cache = get_cache()
+    fragments = await cache.get_many([_fragment_cache_name(key) for key in keys])
+    cached = {t.id: fragment for t, fragment in zip(templates, fragments)}
+    missing = [t for t in templates if cached[t.id] is None]
+
+    if missing:
+        steps_by_template: Dict[int, List[Step]] = {t.id: [] for t in missing}
+        steps = await db.exec(
+            select(Step)
+            .where(Step.template_id.in_(steps_by_template.keys()))
+            .order_by(Step.template_id, Step.position, Step.id)
+        )
+        for step in steps:
+            steps_by_template[step.template_id].append(step)
+
+        built = {}
+        for template, key in zip(templates, keys):
+            if template.id not in steps_by_template:
+                continue
+            template_dict = template.model_dump()
+            template_dict["steps"] = [
+                step.model_dump() for step in steps_by_template[template.id]
+            ]
+            built[key] = cached[template.id] = dumps(template_dict)
+
+        await cache.set_many(
+            {_fragment_cache_name(key): fragment for key, fragment in built.items()}
+        )
+
+    return [cached[t.id] for t in templates]
+
+
+def assemble(
+    cursor: str,
+    fragments: Iterable[bytes],
+    deleted: Optional[Dict[str, List[int]]] = None,
+) -> bytes:
+    """Build a sync response body around already serialized templates."""
+    return b"".join(
+        [
+            b'{"cursor":',
+            dumps(cursor),
+            b',"templates":[',
+            b",".join(fragments),
+            b'],"deleted":',
+            dumps(deleted or {"templates": [], "steps": []}),
+            b"}",
+        ]
+    )
+
+
+def _write_atomic(path: Path, content: bytes) -> None:
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_bytes(content)
+    os.replace(tmp_path, path)
+
+
+def _prune_bundles(bundle_dir: Path, keep: Path) -> None:
+    bundles = sorted(
+        (p for p in bundle_dir.glob("templates-*.json") if p != keep),
+        key=lambda p: p.stat().st_mtime,
+        reverse=True,
+    )
+    for old in bundles[max(settings.SYNC_BUNDLES_KEPT - 1, 0) :]:
+        for path in (old, old.with_name(old.name + ".gz")):
+            path.unlink(missing_ok=True)
+
+
+def _write_bundle(bundle: TemplateBundle, content: bytes) -> None:
+    bundle.path.parent.mkdir(parents=True, exist_ok=True)
+    _write_atomic(bundle.gzip_path, gzip.compress(content, compresslevel=9))
+    _write_atomic(bundle.path, content)
+    _prune_bundles(bundle.path.parent, keep=bundle.path)
+
+
+def _is_fresh(bundle: TemplateBundle) -> bool:
+    # Rebuilt now and then, so the cursor it carries never expires
+    try:
+        built_at = bundle.path.stat().st_mtime
+    except FileNotFoundError:
+        return False
+    return (
+        bundle.gzip_path.exists()
+        and built_at > time.time() - settings.SYNC_BUNDLE_MAX_AGE_SECONDS
+    )
+
+
+async def get_full_bundle(db: AsyncSession) -> TemplateBundle:
+    """
+    Return the on-disk bundle of all templates, rebuilding it if stale.
+
+    Only ids, revisions and modification times are read to check the
+    fingerprint; templates and steps are loaded only when a rebuild is needed.
+
+    Args:
+        db: Database session
+
+    Returns:
+        Paths of the plain and gzip-compressed bundle and its ETag
+    """
+    rows = (
+        await db.exec(
+            select(Template.id, Template.revision, Template.updated_at)
+            .where(ACTIVE_TEMPLATES)
+            .order_by(Template.id)
+        )
+    ).all()
+    fingerprint = hashlib.sha256(
+        "\n".join(_fragment_key(*row) for row in rows).encode()
+    ).hexdigest()[:32]
+
+    bundle_dir = Path(settings.SYNC_BUNDLE_DIR)
+    path = bundle_dir / f"templates-{fingerprint}.json"
+    bundle = TemplateBundle(
+        etag=f'"{fingerprint}"', path=path, gzip_path=path.with_name(path.name + ".gz")
+    )
+    if _is_fresh(bundle):
+        return bundle
+
+    # Read the sequence first: the bundle then contains every change up to
+    # it, and later changes to other entities do not invalidate the bundle
+    seq = await current_sequence(db)
+    templates = (await db.exec(bundle_query().order_by(Template.id))).all()
+    content = assemble(encode_cursor(seq), await get_fragments(db, templates))
+
+    # Compression and disk writes stay off the event loop
+    await run_in_threadpool(_write_bundle, bundle, content)
+
+    logger.info(
+        "Built template bundle %s (%d templates, %d bytes)",
+        fingerprint,
+        len(templates),
+        len(content),
+    )
+    return bundle
@@ -0,0 +1,87 @@
+"""
+Read-through caching of template and step reads.
+
+Responses are cached as serialized JSON and tagged by the rows they contain;
+the write endpoints invalidate the tags after committing.
+"""
+
+import json
+from typing import Iterable, List, Optional, Tuple
+
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.models.step import Step, StepRead
+from app.models.template import Template
+from app.services.cache import get_cache
+from app.services.pagination import paginate
+from app.services.template_bundle import dumps
+
+# Any template list, invalidated by every template change
+TEMPLATE_LIST_TAG = "templates"
+
+
+def template_tag(template_id: int) -> str:
+    return f"template:{template_id}"
+
+
+def step_tag(step_id: int) -> str:
+    return f"step:{step_id}"
+
+
+async def get_template(db: AsyncSession, template_id: int) -> Optional[bytes]:
+    """Return the JSON of a template, or None if it does not exist."""
+
+    async def load() -> Optional[bytes]:
+        template = await db.get(Template, template_id)
+        return dumps(template) if template else None
+
+    return await get_cache().get_or_load(
+        f"template:{template_id}", [template_tag(template_id)], load
+    )
+
+
+async def list_templates(
+    db: AsyncSession, after: Optional[int], limit: int
+) -> Tuple[bytes, Optional[str]]:
+    """Return the JSON list of a page of templates and the cursor of the next page."""
+
+    async def load() -> bytes:
+        page = await paginate(db, select(Template), Template.id, after, limit)
+        # Entry layout: next cursor as JSON, a newline, then the page body
+        return dumps(page.next_cursor) + b"\n" + dumps(page.items)
+
+    entry = await get_cache().get_or_load(
+        f"templates:{after}:{limit}", [TEMPLATE_LIST_TAG], load
+    )
+    next_cursor, body = entry.split(b"\n", 1)
+    return body, json.loads(next_cursor)
+
+
+async def get_step(db: AsyncSession, step_id: int) -> Optional[bytes]:
+    """Return the JSON of a step, or None if it does not exist."""
+
+    async def load() -> Optional[bytes]:
+        step = await db.get(Step, step_id)
+        return dumps(StepRead.model_validate(step)) if step else None
+
+    return await get_cache().get_or_load(f"step:{step_id}", [step_tag(step_id)], load)
+
+
+async def invalidate_templates(template_ids: Iterable[int]) -> None:
+    """Drop cached reads of the given templates and all template lists."""
+    await get_cache().invalidate(
+        [TEMPLATE_LIST_TAG] + [template_tag(i) for i in template_ids]
+    )
+
+
+async def invalidate_steps(
+    step_ids: Iterable[int], template_ids: Iterable[int]
+) -> None:
+    """
+    Drop cached reads of the given steps and of their parent templates,
+    whose ``updated_at`` changes with every step change.
+    """
+    tags: List[str] = [step_tag(i) for i in step_ids]
+    tags += [TEMPLATE_LIST_TAG] + [template_tag(i) for i in template_ids]
+    await get_cache().invalidate(tags)
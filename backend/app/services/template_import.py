@@ -0,0 +1,322 @@
+"""
+Bulk import of templates from JSON files.
+
+Files use the format of ``templates/example-template.json``: the template
+fields, ``model_id`` and ``stage_id`` by name, authors by username, and the
+steps in order. :func:`parse_template` validates one file and is meant to
+run in a process pool; :class:`TemplateImporter` loads the parsed templates
+a batch at a time, resolving names through in-memory lookups and writing
+each batch with one INSERT per table; steps, by far the most rows, go
+through a plain executemany and are added to the change log by a single
+``INSERT ... SELECT``. The revisions of a batch are recorded in bulk too.
+
+Imports are idempotent by ``(template_id, revision)``: a template already at
+that revision is skipped, and one at another revision is updated in place,
+its steps matched by code as in :func:`template_steps.replace_steps`.
+Updates are written in the transaction of their batch, each in a savepoint,
+so a template whose removed steps have results is rejected alone.
+"""
+
+import json
+import logging
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from pydantic import BaseModel, Field, ValidationError
+from sqlalchemy import insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel import Session, select
+
+from app.models.change_log import ChangeOp
+from app.models.product_model import ProductModel
+from app.models.stage import Stage
+from app.models.step import Step, StepBase
+from app.models.template import Template, TemplateStatus
+from app.models.user import User
+from app.services import schema_validation, template_revisions, template_steps
+from app.services.change_log import (
+    STEP,
+    TEMPLATE,
+    record_changes,
+    record_selected_changes,
+)
+from app.services.template_stats import count_bulk_steps
+
+logger = logging.getLogger(__name__)
+
+# Statuses of template files -> status of the template
+STATUSES = {
+    "draft": TemplateStatus.DRAFT,
+    "published": TemplateStatus.PUBLISHED,
+    "released": TemplateStatus.PUBLISHED,
+    "archived": TemplateStatus.ARCHIVED,
+}
+
+
+class TemplateFile(BaseModel):
+    id: str = Field(min_length=1, max_length=20)
+    name: str = Field(max_length=100)
+    revision: str = Field(min_length=1, max_length=10)
+    status: str = "draft"
+    model_id: Optional[str] = None
+    stage_id: Optional[str] = None
+    created_by: Optional[str] = None
+    approved_by: Optional[str] = None
+    created_at: Optional[datetime] = None
+    published_at: Optional[datetime] = None
+    metadata: Dict[str, Any] = {}
+    steps: List[StepBase] = []
+
+
+class ParsedTemplate(NamedTuple):
+    name: str  # of the file
+    template: Optional[Dict[str, Any]]
+    errors: List[str]
+
+
+def _utc(value: Optional[datetime]) -> Optional[datetime]:
+    # Timestamps are stored as naive UTC
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def parse_template(name: str, content: bytes) -> ParsedTemplate:
+    """
+    Parse and validate one template file.
+
+    Runs in a worker process, so it returns plain data.
+
+    Returns:
+        The template fields and steps, or the reasons the file is rejected
+    """
+    try:
+        parsed = TemplateFile.model_validate(json.loads(content))
+    except ValueError as exc:
+        if isinstance(exc, ValidationError):
+            errors = [
+                f"{'.'.join(str(loc) for loc in error['loc'])}: {error['msg']}"
+                for error in exc.errors()
+            ]
+        else:
+            errors = [f"Invalid JSON: {exc}"]
+        return ParsedTemplate(name, None, errors)
+
+    errors = []
+    status = STATUSES.get(parsed.status.lower())
+    if status is None:
+        errors.append(f"status: Unknown status {parsed.status!r}")
+    # The schema of the API; models and stages are still names here
+    document = {
+        "template_id": parsed.id,
+        "name": parsed.name,
+        "revision": parsed.revision,
+        "metadata": parsed.metadata,
+        "steps": [step.model_dump(mode="json") for step in parsed.steps],
+    }
+    for error in schema_validation.errors(schema_validation.TEMPLATE, document):
+        if error.loc[:1] == ("template_id",):
+            error = error._replace(loc=("id", *error.loc[1:]))
+        errors += schema_validation.messages([error])
+    try:
+        template_steps.check_step_codes(parsed.steps)
+    except template_steps.DuplicateStepCodes as exc:
+        errors.append(f"steps: {exc}")
+    if errors:
+        return ParsedTemplate(name, None, errors)
+
+    template = parsed.model_dump(exclude={"steps"})
+    template["status"] = status
+    template["created_at"] = _utc(parsed.created_at)
+    template["published_at"] = _utc(parsed.published_at)
+    template["steps"] = [step.model_dump() for step in parsed.steps]
+    return ParsedTemplate(name, template, [])
+
+
+class ImportStats:
+    def __init__(self) -> None:
+        self.counts: Counter = Counter()
+        self.template_ids: Set[int] = set()
+        self.step_ids: Set[int] = set()
+
+    def reject(self, name: str, errors: Iterable[str]) -> None:
+        self.counts["failed"] += 1
+        logger.warning("%s: %s", name, "; ".join(errors))
+
+
+class TemplateImporter:
+    """Loads parsed templates into the database, one transaction per batch."""
+
+    def __init__(self, db: Session) -> None:
+        self.db = db
+        self.stats = ImportStats()
+        # Names -> ids, loaded once and extended as rows are created
+        self.models: Dict[str, int] = {
+            name: id for id, name in db.exec(select(ProductModel.id, ProductModel.name))
+        }
+        self.stages: Dict[str, int] = {
+            name: id for id, name in db.exec(select(Stage.id, Stage.name))
+        }
+        self.users: Dict[str, int] = {
+            name: id for id, name in db.exec(select(User.id, User.username))
+        }
+
+    def _resolve(
+        self, model, lookup: Dict[str, int], names: Set[Optional[str]], label: str
+    ) -> None:
+        # Create the missing names in bulk, then read back their ids
+        missing = sorted(name for name in names if name and name not in lookup)
+        if not missing:
+            return
+        dialect = postgresql if self.db.bind.dialect.name == "postgresql" else sqlite
+        self.db.execute(
+            dialect.insert(model).on_conflict_do_nothing(),
+            [{"name": name} for name in missing],
+        )
+        created = self.db.exec(
+            select(model.id, model.name).where(model.name.in_(missing))
+        )
+        lookup.update({name: id for id, name in created})
+        self.stats.counts[label] += len(missing)
+
+    def _row(self, template: Dict[str, Any], now: datetime) -> Dict[str, Any]:
+        # Bulk inserts skip model defaults, so every column is set here
+        return {
+            "template_id": template["id"],
+            "name": template["name"],
+            "revision": template["revision"],
+            "status": template["status"],
+            "model_id": self.models.get(template["model_id"]),
+            "stage_id": self.stages.get(template["stage_id"]),
+            "metadata": template["metadata"],
+            "created_by_id": self.users.get(template["created_by"]),
+            "approved_by_id": self.users.get(template["approved_by"]),
+            "created_at": template["created_at"] or now,
+            "updated_at": now,
+            "published_at": template["published_at"],
+        }
+
+    def load(self, parsed: Iterable[ParsedTemplate]) -> None:
+        """Import a batch of parsed files."""
+        batch: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+        for name, template, errors in parsed:
+            if template is None:
+                self.stats.reject(name, errors)
+            elif template["id"] in batch:
+                self.stats.reject(
+                    name,
+                    [
+                        f"Template {template['id']} is also in {batch[template['id']][0]}"
+                    ],
+                )
+            else:
+                batch[template["id"]] = (name, template)
+        if not batch:
+            return
+
+        existing = {
+            template.template_id: template
+            for template in self.db.exec(
+                select(Template).where(Template.template_id.in_(list(batch)))
+            )
+        }
+        new = [template for key, (_, template) in batch.items() if key not in existing]
+        self._insert(new)
+        for key, (name, template) in batch.items():
+            if key in existing:
+                self._update(name, existing[key], template)
+        self.db.commit()
+
+    def _insert(self, templates: List[Dict[str, Any]]) -> None:
+        if not templates:
+            return
+        db = self.db
+        self._resolve(
+            ProductModel,
+            self.models,
+            {template["model_id"] for template in templates},
+            "models created",
+        )
+        self._resolve(
+            Stage,
+            self.stages,
+            {template["stage_id"] for template in templates},
+            "stages created",
+        )
+
+        now = datetime.utcnow()
+        rows = [self._row(template, now) for template in templates]
+        inserted = db.execute(
+            insert(Template).returning(Template.id, Template.template_id), rows
+        ).all()
+        ids = {key: id for id, key in inserted}
+        record_changes(
+            db, TEMPLATE, [(id, None) for id in ids.values()], ChangeOp.UPSERT
+        )
+
+        step_rows = [
+            {**step, "template_id": ids[template["id"]], "position": position}
+            for template in templates
+            for position, step in enumerate(template["steps"])
+        ]
+        if step_rows:
+            # Without RETURNING, the rows go through the driver's executemany
+            db.connection().execute(insert(Step.__table__), step_rows)
+            new_steps = select(Step.id, Step.template_id).where(
+                Step.template_id.in_(list(ids.values()))
+            )
+            record_selected_changes(db, STEP, new_steps, ChangeOp.UPSERT)
+            for template_id, count in Counter(
+                row["template_id"] for row in step_rows
+            ).items():
+                count_bulk_steps(db, template_id, count)
+        template_revisions.record_revisions(
+            db,
+            [
+                template_revisions.Snapshot(
+                    ids[row["template_id"]],
+                    row["revision"],
+                    row["status"],
+                    {field: row[field] for field in template_revisions.HEADER_FIELDS},
+                    [
+                        template_revisions.step_content(step)
+                        for step in template["steps"]
+                    ],
+                )
+                for template, row in zip(templates, rows)
+            ],
+        )
+
+        self.stats.counts["created"] += len(ids)
+        self.stats.counts["steps"] += len(step_rows)
+        self.stats.template_ids.update(ids.values())
+
+    def _update(self, name: str, template: Template, values: Dict[str, Any]) -> None:
+        if template.revision == values["revision"]:
+            self.stats.counts["skipped"] += 1
+            return
+        self._resolve(ProductModel, self.models, {values["model_id"]}, "models created")
+        self._resolve(Stage, self.stages, {values["stage_id"]}, "stages created")
+
+        row = self._row(values, datetime.utcnow())
+        # Keep the original authorship and creation time
+        for field in ("template_id", "created_by_id", "created_at"):
+            row.pop(field)
+        try:
+            with self.db.begin_nested():
+                for field, value in row.items():
+                    setattr(template, field, value)
+                _, changed = template_steps.replace_steps(
+                    self.db,
+                    template,
+                    [StepBase.model_validate(step) for step in values["steps"]],
+                    commit=False,
+                )
+        except template_steps.StepsInUse as exc:
+            self.stats.reject(name, [str(exc)])
+            return
+        self.stats.counts["updated"] += 1
+        self.stats.counts["steps"] += len(values["steps"])
+        self.stats.template_ids.add(template.id)
+        self.stats.step_ids.update(changed)
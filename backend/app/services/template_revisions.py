@@ -0,0 +1,281 @@
+"""
+History of template revisions.
+
+Every write to a template or its steps records the template's current
+revision: its status, header fields and steps. Step contents are stored once
+per distinct content, keyed by their digest, and a revision lists the ids of
+its steps in order, so a step left unchanged by a revision costs an id.
+
+A revision follows the template while it is a draft and is frozen as soon as
+it is recorded with any other status: published revisions never change.
+Diffs between two revisions are cached under the digests of both, so they
+are computed once and never need invalidating.
+"""
+
+import hashlib
+import json
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Mapping, NamedTuple, Optional, Sequence
+
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.models.step import Step, StepBase, StepCategory
+from app.models.template import Template, TemplateBase, TemplateStatus
+from app.models.template_revision import (
+    FieldChange,
+    StepChange,
+    StepRevision,
+    TemplateDiff,
+    TemplateRevision,
+)
+from app.services.cache import get_cache
+from app.services.template_bundle import dumps
+
+STEP_FIELDS = list(StepBase.model_fields)
+HEADER_FIELDS = [
+    field
+    for field in TemplateBase.model_fields
+    if field not in ("template_id", "revision", "status")
+]
+
+# Digests per IN (...) lookup
+LOOKUP_CHUNK = 1000
+
+
+class Snapshot(NamedTuple):
+    template_id: int
+    revision: str
+    status: TemplateStatus
+    header: Dict[str, Any]
+    steps: List[Dict[str, Any]]  # content of each step, in order
+
+
+def _digest(value: Any) -> str:
+    return hashlib.sha256(
+        json.dumps(value, sort_keys=True, separators=(",", ":")).encode()
+    ).hexdigest()
+
+
+def _insert(db: Session):
+    return (postgresql if db.bind.dialect.name == "postgresql" else sqlite).insert
+
+
+def step_content(step: Mapping[str, Any]) -> Dict[str, Any]:
+    """The fields of a step that make up its content in a revision."""
+    content = {field: step[field] for field in STEP_FIELDS}
+    content["category"] = StepCategory(content["category"]).value
+    return content
+
+
+def snapshot(template: Template, steps: Iterable[Step]) -> Snapshot:
+    """The revision of a template with the given steps."""
+    return Snapshot(
+        template.id,
+        template.revision,
+        TemplateStatus(template.status),
+        template.model_dump(mode="json", include=set(HEADER_FIELDS)),
+        [step_content(step.model_dump()) for step in steps],
+    )
+
+
+def _step_revision_ids(
+    db: Session, contents: Dict[str, Dict[str, Any]]
+) -> Dict[str, int]:
+    # Digest -> id, creating the step revisions not stored yet
+    def lookup(digests: List[str]) -> Dict[str, int]:
+        ids: Dict[str, int] = {}
+        for start in range(0, len(digests), LOOKUP_CHUNK):
+            chunk = digests[start : start + LOOKUP_CHUNK]
+            ids.update(
+                db.exec(
+                    select(StepRevision.digest, StepRevision.id).where(
+                        StepRevision.digest.in_(chunk)
+                    )
+                ).all()
+            )
+        return ids
+
+    ids = lookup(list(contents))
+    missing = [digest for digest in contents if digest not in ids]
+    if missing:
+        now = datetime.utcnow()
+        db.execute(
+            _insert(db)(StepRevision).on_conflict_do_nothing(index_elements=["digest"]),
+            [
+                {
+                    "digest": digest,
+                    "code": contents[digest]["code"],
+                    "content": contents[digest],
+                    "created_at": now,
+                }
+                for digest in missing
+            ],
+        )
+        ids.update(lookup(missing))
+    return ids
+
+
+def record_revisions(db: Session, snapshots: Sequence[Snapshot]) -> None:
+    """
+    Record the revisions of templates in the current transaction.
+
+    A revision recorded before is replaced only while it is a draft.
+
+    Args:
+        db: Database session
+        snapshots: The templates as they now are
+    """
+    if not snapshots:
+        return
+    contents: Dict[str, Dict[str, Any]] = {}
+    step_digests = []
+    for revision in snapshots:
+        digests = [_digest(content) for content in revision.steps]
+        contents.update(zip(digests, revision.steps))
+        step_digests.append(digests)
+    ids = _step_revision_ids(db, contents)
+
+    now = datetime.utcnow()
+    rows = {}
+    for revision, digests in zip(snapshots, step_digests):
+        status = TemplateStatus(revision.status)
+        step_revision_ids = [ids[digest] for digest in digests]
+        # A batch may hold a template more than once; the last state wins
+        rows[revision.template_id, revision.revision] = {
+            "template_id": revision.template_id,
+            "revision": revision.revision,
+            "status": status,
+            "header": revision.header,
+            "step_revision_ids": step_revision_ids,
+            "digest": _digest(
+                [revision.revision, status.value, revision.header, step_revision_ids]
+            ),
+            "created_at": now,
+            "updated_at": now,
+        }
+
+    statement = _insert(db)(TemplateRevision)
+    statement = statement.on_conflict_do_update(
+        index_elements=["template_id", "revision"],
+        set_={
+            field: statement.excluded[field]
+            for field in (
+                "status",
+                "header",
+                "step_revision_ids",
+                "digest",
+                "updated_at",
+            )
+        },
+        where=(TemplateRevision.status == TemplateStatus.DRAFT)
+        & (TemplateRevision.digest != statement.excluded.digest),
+    )
+    db.execute(statement, list(rows.values()))
+
+
+def record_revision(db: Session, template: Template) -> None:
+    """Record the current revision of a template, with its steps as stored."""
+    steps = db.exec(
+        select(Step)
+        .where(Step.template_id == template.id)
+        .order_by(Step.position, Step.id)
+        # Bulk statements leave loaded steps stale
+        .execution_options(populate_existing=True)
+    ).all()
+    record_revisions(db, [snapshot(template, steps)])
+
+
+def compare(
+    old: TemplateRevision, new: TemplateRevision, steps: Mapping[int, StepRevision]
+) -> TemplateDiff:
+    """
+    Compare two revisions of a template.
+
+    Steps are matched by code, as in the review diffs of template files.
+
+    Args:
+        old: The earlier revision
+        new: The later revision
+        steps: Step revisions by id, for the steps of both revisions
+    """
+    header_changes = {}
+    old_header = {"status": TemplateStatus(old.status).value, **old.header}
+    new_header = {"status": TemplateStatus(new.status).value, **new.header}
+    for field in dict.fromkeys([*old_header, *new_header]):
+        if old_header.get(field) != new_header.get(field):
+            header_changes[field] = FieldChange(
+                old=old_header.get(field), new=new_header.get(field)
+            )
+
+    # Equal content means the same step revision, so ids are compared
+    old_steps = {steps[step_id].code: step_id for step_id in old.step_revision_ids}
+    new_steps = {steps[step_id].code: step_id for step_id in new.step_revision_ids}
+    steps_changes = []
+    for code in sorted(old_steps.keys() | new_steps.keys()):
+        old_id, new_id = old_steps.get(code), new_steps.get(code)
+        if old_id == new_id:
+            continue
+        steps_changes.append(
+            StepChange(
+                type=(
+                    "changes" if old_id and new_id else "added" if new_id else "removed"
+                ),
+                code=code,
+                old=steps[old_id].content if old_id else None,
+                new=steps[new_id].content if new_id else None,
+            )
+        )
+
+    return TemplateDiff(
+        template_id=new.template_id,
+        from_revision=old.revision,
+        to_revision=new.revision,
+        header_changes=header_changes,
+        steps_changes=steps_changes,
+    )
+
+
+async def get_diff(
+    db: AsyncSession, template_id: int, from_revision: str, to_revision: str
+) -> Optional[bytes]:
+    """
+    Return the JSON diff between two revisions of a template.
+
+    Args:
+        db: Database session
+        template_id: Id of the template
+        from_revision: The earlier revision
+        to_revision: The later revision
+
+    Returns:
+        The diff, or None if either revision was never recorded
+    """
+    revisions = {
+        revision.revision: revision
+        for revision in await db.exec(
+            select(TemplateRevision).where(
+                TemplateRevision.template_id == template_id,
+                TemplateRevision.revision.in_([from_revision, to_revision]),
+            )
+        )
+    }
+    old, new = revisions.get(from_revision), revisions.get(to_revision)
+    if old is None or new is None:
+        return None
+
+    cache = get_cache()
+    name = f"template_diff:{template_id}:{old.digest}:{new.digest}"
+    (content,) = await cache.get_many([name])
+    if content is None:
+        step_ids = set(old.step_revision_ids) | set(new.step_revision_ids)
+        steps = {
+            step.id: step
+            for step in await db.exec(
+                select(StepRevision).where(StepRevision.id.in_(step_ids))
+            )
+        }
+        content = dumps(compare(old, new, steps))
+        await cache.set_many({name: content})
+    return content
@@ -0,0 +1,363 @@
+"""
+Materialized per-template statistics.
+
+Step and checklist counts, first-pass yield and average execution time are
+kept in the ``templatestats`` table so listing templates with their stats is
+a primary-key join instead of a scan of every result.
+
+Counters are maintained incrementally by session hooks: flushes record which
+steps and checklists were added or removed and which checklists reached a
+finished status, and the deltas are applied right before the transaction
+commits, once all of its results are written. A checklist counts as first
+pass if it is completed without a single failed result at that moment.
+
+A periodic rollup recomputes every row from scratch. It fills rows of
+templates created before the table existed and corrects drift from changes
+the hooks do not see (bulk statements, status reverts, deleted checklists).
+Every worker schedules it; on Postgres a worker skips its rollup while
+another one is running, so workers started together roll up once.
+"""
+
+import asyncio
+import logging
+from collections import Counter
+from datetime import datetime
+from typing import Callable, Dict, Optional, Set, Type
+
+from sqlalchemy import (
+    and_,
+    case,
+    delete,
+    event,
+    exists,
+    false,
+    func,
+    inspect,
+    literal,
+    select,
+    text,
+    true,
+)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session as SASession
+from sqlmodel import select as sqlmodel_select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.models.checklist import QCDoc, QCDocStatus, QCResult
+from app.models.step import Step
+from app.models.template import Template, TemplateReadWithStats
+from app.models.template_stats import TemplateStats
+from app.services.pagination import Page, keyset, page_of
+
+logger = logging.getLogger(__name__)
+
+FINISHED_STATUSES = (QCDocStatus.COMPLETED, QCDocStatus.REJECTED)
+
+# Arbitrary keys of the Postgres advisory locks between increments and
+# rollups, and between the rollups of different workers
+STATS_LOCK_KEY = 7_310_002
+ROLLUP_LOCK_KEY = 7_310_003
+
+COUNTERS = (
+    "step_count",
+    "checklist_count",
+    "finished_count",
+    "first_pass_count",
+    "execution_time_total",
+    "execution_time_count",
+)
+
+_SESSION_INFO_KEY = "template_stats.pending"
+
+
+class _PendingStats:
+    """Changes seen by the flushes of one transaction."""
+
+    def __init__(self) -> None:
+        self.steps: Counter = Counter()
+        self.checklists: Counter = Counter()
+        self.finished: Set[int] = set()
+        self.deleted_templates: Set[int] = set()
+
+
+def _pending(session: SASession) -> _PendingStats:
+    if _SESSION_INFO_KEY not in session.info:
+        session.info[_SESSION_INFO_KEY] = _PendingStats()
+    return session.info[_SESSION_INFO_KEY]
+
+
+def _reached_finished(doc: QCDoc) -> bool:
+    history = inspect(doc).attrs.status.history
+    if not history.added or history.added[0] not in FINISHED_STATUSES:
+        return False
+    return not history.deleted or history.deleted[0] not in FINISHED_STATUSES
+
+
+def _after_flush(session: SASession, flush_context) -> None:
+    for obj in session.new:
+        if isinstance(obj, Step):
+            _pending(session).steps[obj.template_id] += 1
+        elif isinstance(obj, QCDoc):
+            pending = _pending(session)
+            pending.checklists[obj.template_id] += 1
+            if obj.status in FINISHED_STATUSES:
+                pending.finished.add(obj.id)
+
+    for obj in session.dirty:
+        if isinstance(obj, QCDoc) and _reached_finished(obj):
+            _pending(session).finished.add(obj.id)
+
+    for obj in session.deleted:
+        if isinstance(obj, Step):
+            _pending(session).steps[obj.template_id] -= 1
+        elif isinstance(obj, QCDoc):
+            pending = _pending(session)
+            pending.checklists[obj.template_id] -= 1
+            pending.finished.discard(obj.id)
+        elif isinstance(obj, Template):
+            _pending(session).deleted_templates.add(obj.id)
+
+
+def count_bulk_steps(session: SASession, template_id: int, count: int) -> None:
+    """
+    Count steps inserted (positive ``count``) or deleted (negative) by bulk
+    statements, which the flush hooks don't see; applied on commit.
+    """
+    _pending(session).steps[template_id] += count
+
+
+def _insert(connection):
+    dialect = postgresql if connection.dialect.name == "postgresql" else sqlite
+    return dialect.insert(TemplateStats.__table__)
+
+
+def _apply(connection, pending: _PendingStats) -> None:
+    deltas: Dict[int, Counter] = {}
+
+    def delta(template_id: int) -> Counter:
+        return deltas.setdefault(template_id, Counter())
+
+    for template_id, count in pending.steps.items():
+        delta(template_id)["step_count"] += count
+    for template_id, count in pending.checklists.items():
+        delta(template_id)["checklist_count"] += count
+
+    if pending.finished:
+        failed = exists().where(
+            QCResult.qc_doc_id == QCDoc.id, QCResult.ok_flag == false()
+        )
+        finished_docs = connection.execute(
+            select(QCDoc.template_id, QCDoc.status, QCDoc.execution_time, failed).where(
+                QCDoc.id.in_(pending.finished)
+            )
+        )
+        for template_id, status, execution_time, has_failed in finished_docs:
+            if status not in FINISHED_STATUSES:
+                continue
+            counters = delta(template_id)
+            counters["finished_count"] += 1
+            if status == QCDocStatus.COMPLETED and not has_failed:
+                counters["first_pass_count"] += 1
+            if execution_time is not None:
+                counters["execution_time_total"] += execution_time
+                counters["execution_time_count"] += 1
+
+    now = datetime.utcnow()
+    rows = [
+        {
+            "template_id": template_id,
+            "updated_at": now,
+            **{name: counters[name] for name in COUNTERS},
+        }
+        for template_id, counters in deltas.items()
+        if template_id not in pending.deleted_templates and any(counters.values())
+    ]
+    if not rows:
+        return
+
+    if connection.dialect.name == "postgresql":
+        connection.execute(
+            text("SELECT pg_advisory_xact_lock_shared(:key)"), {"key": STATS_LOCK_KEY}
+        )
+    stmt = _insert(connection)
+    table = TemplateStats.__table__
+    connection.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[table.c.template_id],
+            set_={
+                "updated_at": stmt.excluded.updated_at,
+                **{name: table.c[name] + stmt.excluded[name] for name in COUNTERS},
+            },
+        ),
+        rows,
+    )
+
+
+def _before_commit(session: SASession) -> None:
+    if _SESSION_INFO_KEY not in session.info:
+        return
+    # Flush first so the transaction's last changes are counted as well
+    session.flush()
+    _apply(session.connection(), session.info.pop(_SESSION_INFO_KEY))
+
+
+def _after_rollback(session: SASession) -> None:
+    session.info.pop(_SESSION_INFO_KEY, None)
+
+
+def track_template_stats(session_class: Type[SASession]) -> None:
+    """Maintain template statistics from every transaction of ``session_class``."""
+    for name, listener in (
+        ("after_flush", _after_flush),
+        ("before_commit", _before_commit),
+        ("after_rollback", _after_rollback),
+    ):
+        if not event.contains(session_class, name, listener):
+            event.listen(session_class, name, listener)
+
+
+def _rollup(session: SASession) -> bool:
+    connection = session.connection()
+    if connection.dialect.name == "postgresql":
+        # Held until commit; the rollup of another worker would do the same work
+        locked = connection.execute(
+            text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": ROLLUP_LOCK_KEY}
+        )
+        if not locked.scalar():
+            return False
+        # Wait for transactions applying increments, so none is overwritten
+        connection.execute(
+            text("SELECT pg_advisory_xact_lock(:key)"), {"key": STATS_LOCK_KEY}
+        )
+
+    steps = (
+        select(Step.template_id, func.count().label("step_count"))
+        .group_by(Step.template_id)
+        .subquery()
+    )
+    finished = QCDoc.status.in_(FINISHED_STATUSES)
+    failed = exists().where(QCResult.qc_doc_id == QCDoc.id, QCResult.ok_flag == false())
+    timed = and_(finished, QCDoc.execution_time.is_not(None))
+    checklists = (
+        select(
+            QCDoc.template_id,
+            func.count().label("checklist_count"),
+            func.sum(case((finished, 1), else_=0)).label("finished_count"),
+            func.sum(
+                case((and_(QCDoc.status == QCDocStatus.COMPLETED, ~failed), 1), else_=0)
+            ).label("first_pass_count"),
+            func.sum(case((timed, QCDoc.execution_time), else_=0)).label(
+                "execution_time_total"
+            ),
+            func.sum(case((timed, 1), else_=0)).label("execution_time_count"),
+        )
+        .group_by(QCDoc.template_id)
+        .subquery()
+    )
+    source = {"step_count": steps, **{name: checklists for name in COUNTERS[1:]}}
+    rows = (
+        select(
+            Template.id,
+            *(func.coalesce(source[name].c[name], 0) for name in COUNTERS),
+            literal(datetime.utcnow()),
+        )
+        .select_from(Template)
+        .outerjoin(steps, steps.c.template_id == Template.id)
+        .outerjoin(checklists, checklists.c.template_id == Template.id)
+        # SQLite needs a WHERE clause to parse INSERT ... SELECT ... ON CONFLICT
+        .where(true())
+    )
+
+    stmt = _insert(connection).from_select(
+        ["template_id", *COUNTERS, "updated_at"], rows
+    )
+    connection.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[TemplateStats.__table__.c.template_id],
+            set_={name: stmt.excluded[name] for name in (*COUNTERS, "updated_at")},
+        )
+    )
+    connection.execute(
+        delete(TemplateStats).where(
+            TemplateStats.template_id.not_in(select(Template.id))
+        )
+    )
+    return True
+
+
+async def rollup_template_stats(db: AsyncSession) -> bool:
+    """
+    Recompute the statistics of all templates in one transaction.
+
+    Returns:
+        False if the rollup was skipped because another one is running
+    """
+    done = await db.run_sync(_rollup)
+    await db.commit()
+    return done
+
+
+async def rollup_periodically(
+    session_factory: Callable[[], AsyncSession], interval: int
+) -> None:
+    """
+    Run :func:`rollup_template_stats` now and then every ``interval`` seconds.
+
+    Args:
+        session_factory: Creates the session of each rollup
+        interval: Seconds between rollups
+    """
+    while True:
+        try:
+            async with session_factory() as db:
+                if not await rollup_template_stats(db):
+                    logger.debug(
+                        "Template statistics rollup skipped, another worker is running one"
+                    )
+        except Exception:
+            logger.exception("Template statistics rollup failed")
+        await asyncio.sleep(interval)
+
+
+async def list_template_stats(
+    db: AsyncSession, after: Optional[int], limit: int
+) -> Page:
+    """
+    Read a page of templates together with their materialized statistics.
+
+    Args:
+        db: Database session
+        after: Template id the page starts after, None for the first page
+        limit: Maximum number of templates
+
+    Returns:
+        Templates with step and checklist counts, first-pass yield in percent
+        and average execution time in seconds
+    """
+    query = sqlmodel_select(Template, TemplateStats).outerjoin(
+        TemplateStats, TemplateStats.template_id == Template.id
+    )
+    rows = (await db.exec(keyset(query, Template.id, after, limit))).all()
+    page = page_of(rows, limit, lambda row: row[0].id)
+
+    templates = []
+    for template, stats in page.items:
+        stats = stats or TemplateStats(template_id=template.id)
+        templates.append(
+            TemplateReadWithStats(
+                **template.model_dump(),
+                step_count=stats.step_count,
+                checklist_count=stats.checklist_count,
+                fpy_percentage=(
+                    round(100 * stats.first_pass_count / stats.finished_count, 2)
+                    if stats.finished_count
+                    else None
+                ),
+                average_execution_time=(
+                    stats.execution_time_total // stats.execution_time_count
+                    if stats.execution_time_count
+                    else None
+                ),
+            )
+        )
+    return Page(templates, page.next_cursor)
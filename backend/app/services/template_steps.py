@@ -0,0 +1,206 @@
+"""
+Bulk writes of the steps of a template.
+
+Creating a template with its steps, and replacing all steps of a template,
+run in one transaction: one INSERT for the new steps, one UPDATE for the
+changed ones and one DELETE for the removed ones, instead of a request and a
+commit per step. Bulk statements bypass the session hooks, so the change log
+and the template statistics are fed here, and the revision of the template
+is recorded in the same transaction.
+
+Steps are matched to the existing ones by ``code``, so re-importing a
+standard keeps the ids of unchanged steps and the results recorded against
+them, and keep the order they are given in through their ``position``,
+rewritten by the same UPDATE. Replacements lock the template row, so concurrent ones cannot both
+insert the same codes.
+"""
+
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Sequence, Tuple
+
+from sqlalchemy import delete, insert, update
+from sqlmodel import Session, select
+
+from app.models.change_log import ChangeOp
+from app.models.checklist import QCResult
+from app.models.step import Step, StepBase, StepRead
+from app.models.template import Template, TemplateCreate, TemplateReadWithSteps
+from app.models.user import User
+from app.services import template_revisions
+from app.services.change_log import STEP, record_changes
+from app.services.template_stats import count_bulk_steps
+
+
+class DuplicateStepCodes(ValueError):
+    pass
+
+
+class StepsInUse(ValueError):
+    pass
+
+
+def check_step_codes(steps: Sequence[StepBase]) -> None:
+    """Raise :class:`DuplicateStepCodes` if two steps share a code."""
+    counts = Counter(step.code for step in steps)
+    duplicates = sorted(code for code, count in counts.items() if count > 1)
+    if duplicates:
+        raise DuplicateStepCodes(f"Duplicate step codes: {', '.join(duplicates)}")
+
+
+def _insert_steps(
+    db: Session, template_id: int, steps: Sequence[Tuple[int, StepBase]]
+) -> None:
+    # Steps with their positions
+    if not steps:
+        return
+    inserted = db.execute(
+        insert(Step).returning(Step.id, Step.template_id),
+        [
+            {**step.model_dump(), "template_id": template_id, "position": position}
+            for position, step in steps
+        ],
+    ).all()
+    record_changes(db, STEP, inserted, ChangeOp.UPSERT)
+    count_bulk_steps(db, template_id, len(inserted))
+
+
+def _with_steps(db: Session, template: Template) -> TemplateReadWithSteps:
+    steps = db.exec(
+        select(Step)
+        .where(Step.template_id == template.id)
+        .order_by(Step.position, Step.id)
+        # Bulk statements leave loaded steps stale
+        .execution_options(populate_existing=True)
+    ).all()
+    return TemplateReadWithSteps(
+        **template.model_dump(), steps=[StepRead.model_validate(step) for step in steps]
+    )
+
+
+def create_template(
+    db: Session, template_in: TemplateCreate, current_user: User
+) -> TemplateReadWithSteps:
+    """
+    Create a template together with its steps in one transaction.
+
+    Args:
+        db: Database session
+        template_in: The template, with its steps in order
+        current_user: Author of the template
+
+    Returns:
+        The template with its steps
+
+    Raises:
+        DuplicateStepCodes: Two steps share a code
+    """
+    steps = template_in.steps or []
+    check_step_codes(steps)
+
+    template = Template.model_validate(template_in.model_dump(exclude={"steps"}))
+    template.created_by_id = current_user.id
+    db.add(template)
+    # The steps need the template's primary key
+    db.flush()
+    _insert_steps(db, template.id, list(enumerate(steps)))
+    template_revisions.record_revision(db, template)
+    db.commit()
+    return _with_steps(db, template)
+
+
+def replace_steps(
+    db: Session, template: Template, steps_in: Sequence[StepBase], commit: bool = True
+) -> Tuple[TemplateReadWithSteps, List[int]]:
+    """
+    Make the steps of a template match ``steps_in`` in one transaction.
+
+    Steps are matched by code: matching steps are updated where they differ,
+    in content or position, steps with new codes are inserted, and steps
+    whose code is missing are deleted. The steps take the order of
+    ``steps_in``.
+
+    Args:
+        db: Database session
+        template: The template
+        steps_in: The complete list of steps
+        commit: Commit the transaction; False leaves it to the caller, e.g.
+            to write several templates at once
+
+    Returns:
+        The template with its steps, and the ids of the steps updated or
+        deleted
+
+    Raises:
+        DuplicateStepCodes: Two steps share a code
+        StepsInUse: A step to delete has checklist results
+    """
+    check_step_codes(steps_in)
+    # Concurrent replacements of the same steps would both insert new codes;
+    # the template row lock makes them run one after the other
+    db.exec(
+        select(Template)
+        .where(Template.id == template.id)
+        .with_for_update()
+        .execution_options(populate_existing=True)
+    ).one()
+
+    existing: Dict[str, Step] = {}
+    removed: List[Step] = []
+    for step in db.exec(
+        select(Step).where(Step.template_id == template.id).order_by(Step.id)
+    ):
+        if step.code in existing:
+            # Duplicate codes predate this endpoint; the oldest step is kept
+            removed.append(step)
+        else:
+            existing[step.code] = step
+
+    updates: List[Dict] = []
+    inserts: List[Tuple[int, StepBase]] = []
+    for position, step_in in enumerate(steps_in):
+        values = {**step_in.model_dump(), "position": position}
+        step = existing.pop(step_in.code, None)
+        if step is None:
+            inserts.append((position, step_in))
+        elif any(getattr(step, field) != value for field, value in values.items()):
+            updates.append({"id": step.id, **values})
+    removed.extend(existing.values())
+
+    removed_ids = [step.id for step in removed]
+    if removed_ids:
+        in_use = db.exec(
+            select(Step.code)
+            .where(Step.id.in_(removed_ids), Step.id.in_(select(QCResult.step_id)))
+            .order_by(Step.code)
+        ).all()
+        if in_use:
+            raise StepsInUse(
+                f"Steps with checklist results cannot be removed: {', '.join(in_use)}"
+            )
+        db.execute(delete(Step).where(Step.id.in_(removed_ids)))
+        record_changes(
+            db,
+            STEP,
+            [(step_id, template.id) for step_id in removed_ids],
+            ChangeOp.DELETE,
+        )
+        count_bulk_steps(db, template.id, -len(removed_ids))
+    if updates:
+        db.execute(update(Step), updates)
+        record_changes(
+            db,
+            STEP,
+            [(values["id"], template.id) for values in updates],
+            ChangeOp.UPSERT,
+        )
+    _insert_steps(db, template.id, inserts)
+
+    if removed_ids or updates or inserts:
+        # Offline bundles are rebuilt when the template changes
+        template.updated_at = datetime.utcnow()
+        db.add(template)
+    template_revisions.record_revision(db, template)
+    if commit:
+        db.commit()
+    return _with_steps(db, template), [values["id"] for values in updates] + removed_ids
@@ -0,0 +1,435 @@
+"""
+Resumable photo uploads.
+
+A client on an unreliable network creates an upload session for a file of
+known size, sends the file in chunks at explicit offsets, asks the session
+for its offset after a failure and resumes from there, and finally completes
+the session into a photo.
+
+Sessions live on local disk under ``UPLOAD_SESSIONS_DIR``: ``<id>.json``
+holds the metadata and ``<id>.part`` the bytes received so far, so the
+offset is simply the size of the part file and survives restarts. Chunks are
+appended in place, so completing a session only hashes the file in chunks
+and hands a hard link of it (``<id>.store``) to photo storage. The part
+file is only removed once the session records its photo, so a completion
+that fails, e.g. on a database error, can be retried without sending the
+file again. Each session is locked with ``flock`` while
+a chunk is written or the session completes, which keeps concurrent requests
+from several workers from interleaving. Sessions without activity for
+``UPLOAD_SESSION_TTL_SECONDS`` are garbage-collected.
+"""
+
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import re
+import shutil
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import AsyncIterator, BinaryIO, NamedTuple, Optional
+
+from fastapi import HTTPException, Request, status
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.services.photo_upload import ReceivedFile, hash_file
+
+logger = logging.getLogger(__name__)
+
+SESSION_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+class UploadSession(NamedTuple):
+    id: str
+    owner_id: int
+    filename: str
+    extension: str
+    size: int
+    checklist_id: Optional[int]
+    note: Optional[str]
+    created_at: datetime
+    # Set once the session completed, so a retried completion is answered
+    photo_id: Optional[int] = None
+
+
+def _root() -> Path:
+    return Path(settings.UPLOAD_SESSIONS_DIR)
+
+
+def _meta_path(upload_id: str) -> Path:
+    return _root() / f"{upload_id}.json"
+
+
+def _part_path(upload_id: str) -> Path:
+    return _root() / f"{upload_id}.part"
+
+
+def _store_path(upload_id: str) -> Path:
+    return _root() / f"{upload_id}.store"
+
+
+def _link(source: Path, target: Path) -> None:
+    target.unlink(missing_ok=True)
+    try:
+        os.link(source, target)
+    except OSError:
+        # File systems without hard links
+        shutil.copyfile(source, target)
+
+
+def _not_found() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_404_NOT_FOUND, detail="Upload session not found"
+    )
+
+
+def _past_end(session: "UploadSession") -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"Chunk exceeds the declared file size ({session.size} bytes)",
+    )
+
+
+def _write_meta(session: UploadSession) -> None:
+    data = session._asdict()
+    data["created_at"] = session.created_at.isoformat()
+    path = _meta_path(session.id)
+    tmp_path = path.with_suffix(".json.tmp")
+    tmp_path.write_text(json.dumps(data))
+    os.replace(tmp_path, path)
+
+
+def _read_meta(upload_id: str) -> Optional[UploadSession]:
+    try:
+        data = json.loads(_meta_path(upload_id).read_text())
+    except FileNotFoundError:
+        return None
+    data["created_at"] = datetime.fromisoformat(data["created_at"])
+    return UploadSession(**data)
+
+
+def _create(session: UploadSession) -> None:
+    _root().mkdir(parents=True, exist_ok=True)
+    _part_path(session.id).touch(exist_ok=False)
+    _write_meta(session)
+
+
+def _offset(upload_id: str) -> int:
+    try:
+        return _part_path(upload_id).stat().st_size
+    except FileNotFoundError:
+        return 0
+
+
+def _lock(upload_id: str) -> Optional[BinaryIO]:
+    """
+    Open the part file for writing and lock it, None if it doesn't exist.
+
+    Raises:
+        BlockingIOError: The session is locked by another request
+    """
+    try:
+        part = open(_part_path(upload_id), "r+b")
+    except FileNotFoundError:
+        return None
+    try:
+        fcntl.flock(part, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        part.close()
+        raise
+    return part
+
+
+def _open_locked(upload_id: str) -> Optional[BinaryIO]:
+    try:
+        return _lock(upload_id)
+    except BlockingIOError:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Another request is writing to this upload session",
+        )
+
+
+def _write(part: BinaryIO, chunk: bytes) -> None:
+    part.write(chunk)
+    part.flush()
+
+
+def _offset_mtime(upload_id: str) -> float:
+    try:
+        return _part_path(upload_id).stat().st_mtime
+    except FileNotFoundError:
+        return 0.0
+
+
+def _remove(upload_id: str) -> None:
+    _part_path(upload_id).unlink(missing_ok=True)
+    _store_path(upload_id).unlink(missing_ok=True)
+    _meta_path(upload_id).unlink(missing_ok=True)
+
+
+def expires_at(session: UploadSession) -> datetime:
+    """When the session is collected if nothing more is received."""
+    last_activity = max(
+        _meta_path(session.id).stat().st_mtime, _offset_mtime(session.id)
+    )
+    return datetime.utcfromtimestamp(last_activity) + timedelta(
+        seconds=settings.UPLOAD_SESSION_TTL_SECONDS
+    )
+
+
+def offset_of(session: UploadSession) -> int:
+    """Number of bytes received so far."""
+    return session.size if session.photo_id is not None else _offset(session.id)
+
+
+async def create_session(
+    owner_id: int,
+    filename: str,
+    size: int,
+    checklist_id: Optional[int] = None,
+    note: Optional[str] = None,
+) -> UploadSession:
+    """
+    Start a resumable upload.
+
+    Args:
+        owner_id: User uploading the photo; nobody else can see the session
+        filename: Client file name, whose extension must be allowed
+        size: Size of the whole file in bytes
+        checklist_id: Checklist of the photo
+        note: Note of the photo
+
+    Returns:
+        The new session
+
+    Raises:
+        HTTPException: 413 if ``size`` exceeds ``MAX_UPLOAD_SIZE``, 415 for a
+            disallowed extension
+    """
+    filename = os.path.basename(filename)
+    extension = os.path.splitext(filename)[1].lower()
+    if extension not in settings.ALLOWED_UPLOAD_EXTENSIONS:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail=f"File extension not allowed. Allowed extensions: {', '.join(settings.ALLOWED_UPLOAD_EXTENSIONS)}",
+        )
+    if size > settings.MAX_UPLOAD_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"File size exceeds maximum allowed ({settings.MAX_UPLOAD_SIZE} bytes)",
+        )
+
+    session = UploadSession(
+        id=uuid.uuid4().hex,
+        owner_id=owner_id,
+        filename=filename,
+        extension=extension,
+        size=size,
+        checklist_id=checklist_id,
+        note=note,
+        created_at=datetime.utcnow(),
+    )
+    await run_in_threadpool(_create, session)
+    return session
+
+
+async def get_session(upload_id: str, owner_id: int) -> UploadSession:
+    """
+    Load a session of ``owner_id``.
+
+    Raises:
+        HTTPException: 404 if there is no such session
+    """
+    if not SESSION_ID.match(upload_id):
+        raise _not_found()
+    session = await run_in_threadpool(_read_meta, upload_id)
+    if session is None or session.owner_id != owner_id:
+        raise _not_found()
+    return session
+
+
+async def _buffered(request: Request) -> AsyncIterator[bytes]:
+    """Re-chunk the request body into pieces of ``UPLOAD_CHUNK_SIZE``."""
+    buffer = bytearray()
+    async for body_chunk in request.stream():
+        buffer += body_chunk
+        while len(buffer) >= settings.UPLOAD_CHUNK_SIZE:
+            yield bytes(buffer[: settings.UPLOAD_CHUNK_SIZE])
+            del buffer[: settings.UPLOAD_CHUNK_SIZE]
+    if buffer:
+        yield bytes(buffer)
+
+
+async def append_chunk(session: UploadSession, offset: int, request: Request) -> int:
+    """
+    Write the request body to the session at ``offset``.
+
+    Bytes written before a client disconnect are kept, so the client resumes
+    from the offset reported afterwards.
+
+    Args:
+        session: The session
+        offset: Position of the chunk in the file; must equal the bytes
+            received so far
+        request: Request whose raw body is the chunk
+
+    Returns:
+        The new offset
+
+    Raises:
+        HTTPException: 409 if ``offset`` isn't the current offset, the
+            session is completed or another chunk is being written, 413 if
+            the chunk runs past the declared size
+    """
+    if session.photo_id is not None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Upload session is already completed",
+        )
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and offset + int(content_length) > session.size:
+        raise _past_end(session)
+    part = await run_in_threadpool(_open_locked, session.id)
+    if part is None:
+        raise _not_found()
+    try:
+        current = os.fstat(part.fileno()).st_size
+        if offset != current:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"Upload offset is {current}, not {offset}",
+            )
+        part.seek(current)
+        async for chunk in _buffered(request):
+            current += len(chunk)
+            if current > session.size:
+                await run_in_threadpool(part.truncate, offset)
+                raise _past_end(session)
+            await run_in_threadpool(_write, part, chunk)
+    finally:
+        # Also runs on client disconnects and cancellation, so don't await
+        part.close()
+    return current
+
+
+async def complete_session(session: UploadSession, store) -> int:
+    """
+    Turn a fully received session into a photo.
+
+    Args:
+        session: The session
+        store: Coroutine function creating the photo from a
+            :class:`ReceivedFile` and returning its id; it takes ownership of
+            the file, a link to the received bytes. Run again if a previous
+            completion failed
+
+    Returns:
+        Id of the photo; the same one when completion is retried
+
+    Raises:
+        HTTPException: 409 if the file isn't complete or the session is busy
+    """
+    if session.photo_id is not None:
+        return session.photo_id
+    part = await run_in_threadpool(_open_locked, session.id)
+    if part is None:
+        # Completed by a concurrent request in the meantime
+        completed = await run_in_threadpool(_read_meta, session.id)
+        if completed is None or completed.photo_id is None:
+            raise _not_found()
+        return completed.photo_id
+    try:
+        received_size = os.fstat(part.fileno()).st_size
+        if received_size != session.size:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"Upload is incomplete: {received_size} of {session.size} bytes received",
+            )
+        path = _part_path(session.id)
+        sha256, _ = await run_in_threadpool(hash_file, str(path))
+        # Storing consumes the file; the part stays until the photo is recorded
+        store_path = _store_path(session.id)
+        await run_in_threadpool(_link, path, store_path)
+        received = ReceivedFile(
+            path=store_path,
+            filename=session.filename,
+            extension=session.extension,
+            size=session.size,
+            sha256=sha256,
+        )
+        try:
+            photo_id = await store(received)
+        finally:
+            store_path.unlink(missing_ok=True)
+        await run_in_threadpool(_write_meta, session._replace(photo_id=photo_id))
+        await run_in_threadpool(path.unlink, True)
+    finally:
+        part.close()
+    return photo_id
+
+
+async def abort_session(session: UploadSession) -> None:
+    """Discard a session and the bytes received."""
+    await run_in_threadpool(_remove, session.id)
+
+
+def collect_stale_sessions(max_age: int) -> int:
+    """
+    Delete sessions, completed or not, without activity for ``max_age`` seconds.
+
+    Returns:
+        Number of sessions deleted
+    """
+    root = _root()
+    if not root.is_dir():
+        return 0
+    cutoff = time.time() - max_age
+    collected = 0
+    with os.scandir(root) as entries:
+        for entry in entries:
+            upload_id, _, suffix = entry.name.partition(".")
+            if suffix != "json" or not SESSION_ID.match(upload_id):
+                continue
+            if max(entry.stat().st_mtime, _offset_mtime(upload_id)) >= cutoff:
+                continue
+            try:
+                part = _lock(upload_id)
+            except BlockingIOError:
+                continue
+            _remove(upload_id)
+            if part is not None:
+                part.close()
+            collected += 1
+    # Part files left behind by a crash between creating both files, and
+    # links of completions interrupted by one
+    with os.scandir(root) as entries:
+        for entry in entries:
+            upload_id, _, suffix = entry.name.partition(".")
+            if suffix == "store" and entry.stat().st_mtime < cutoff:
+                Path(entry.path).unlink(missing_ok=True)
+            elif (
+                suffix == "part"
+                and not _meta_path(upload_id).exists()
+                and entry.stat().st_mtime < cutoff
+            ):
+                Path(entry.path).unlink(missing_ok=True)
+    return collected
+
+
+async def collect_periodically(interval: int) -> None:
+    """Collect stale upload sessions every ``interval`` seconds."""
+    while True:
+        try:
+            collected = await run_in_threadpool(
+                collect_stale_sessions, settings.UPLOAD_SESSION_TTL_SECONDS
+            )
+            if collected:
+                logger.info("Collected %d stale upload sessions", collected)
+        except Exception:
+            logger.exception("Upload session collection failed")
+        await asyncio.sleep(interval)
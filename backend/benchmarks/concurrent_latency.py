@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark of request latency while slow database queries are in flight.
+
+Compares an endpoint that queries through the synchronous Session (the old
+API layer) with one that awaits the AsyncSession. While a burst of slow DB
+requests runs, a trivial endpoint is polled; with the synchronous session
+every query blocks the event loop and the trivial endpoint stalls too.
+
+Usage:
+    DATABASE_URL=sqlite:///./bench.db python benchmarks/concurrent_latency.py [--requests 50]
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import httpx
+from fastapi import FastAPI
+from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from app.core.config import settings  # noqa: E402
+
+
+def slow_query(dialect: str):
+    """A query taking tens of milliseconds on the server."""
+    if dialect == "postgresql":
+        return text("SELECT pg_sleep(0.05)")
+    return text(
+        "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c WHERE x < 200000) "
+        "SELECT count(*) FROM c"
+    )
+
+
+def build_app() -> FastAPI:
+    engine = create_engine(settings.DATABASE_URL, pool_size=20)
+    async_engine = create_async_engine(settings.ASYNC_DATABASE_URL, pool_size=20)
+    query = slow_query(engine.dialect.name)
+    app = FastAPI()
+
+    @app.get("/ping")
+    async def ping():
+        return {"ok": True}
+
+    @app.get("/sync-db")
+    async def sync_db():
+        with engine.connect() as connection:
+            return {"value": connection.execute(query).scalar()}
+
+    @app.get("/async-db")
+    async def async_db():
+        async with async_engine.connect() as connection:
+            return {"value": (await connection.execute(query)).scalar()}
+
+    return app
+
+
+async def measure(client: httpx.AsyncClient, path: str, requests: int) -> tuple:
+    """
+    Probe /ping every few milliseconds while ``requests`` requests to ``path``
+    run concurrently.
+
+    Returns:
+        Probe latencies in ms (time past the scheduled probe) and burst duration in s
+    """
+    latencies = []
+    interval = 0.005
+    done = asyncio.Event()
+
+    async def probe():
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            await client.get("/ping")
+            latencies.append((time.perf_counter() - start - interval) * 1000)
+
+    probe_task = asyncio.create_task(probe())
+    await asyncio.sleep(interval * 4)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client.get(path) for _ in range(requests)))
+    duration = time.perf_counter() - start
+
+    done.set()
+    await probe_task
+    return latencies, duration
+
+
+def report(label: str, result: tuple) -> None:
+    latencies, duration = result
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(
+        f"{label:<14} burst={duration:6.2f} s  samples={len(latencies):<5} "
+        f"p50={statistics.median(latencies):8.2f} ms  p99={p99:8.2f} ms  max={latencies[-1]:8.2f} ms"
+    )
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument(
+        "--requests", type=int, default=50, help="concurrent slow DB requests"
+    )
+    args = parser.parse_args()
+
+    transport = httpx.ASGITransport(app=build_app())
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench"
+    ) as client:
+        # Warm up both connection pools
+        await client.get("/sync-db")
+        await client.get("/async-db")
+
+        print(f"/ping latency during {args.requests} concurrent slow DB requests")
+        report("sync Session", await measure(client, "/sync-db", args.requests))
+        report("AsyncSession", await measure(client, "/async-db", args.requests))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark of request latency during a burst of logins.
+
+Compares password verification inline in the handler (the old login) with
+verification on the password hashing pool. While the logins run, a trivial
+endpoint is polled; with inline bcrypt every login blocks the event loop for
+the duration of the hash and the trivial endpoint stalls too.
+
+Usage:
+    PASSWORD_HASH_WORKERS=4 python benchmarks/login_burst.py [--logins 100]
+"""
+
+import argparse
+import asyncio
+import sys
+from pathlib import Path
+
+import httpx
+from fastapi import FastAPI
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from app.core.config import settings  # noqa: E402
+from app.core.security import (
+    get_password_hash,
+    verify_password,
+    verify_password_async,
+)  # noqa: E402
+
+from concurrent_latency import measure, report  # noqa: E402
+
+PASSWORD = "operator-password"
+
+
+def build_app() -> FastAPI:
+    hashed_password = get_password_hash(PASSWORD)
+    app = FastAPI()
+
+    @app.get("/ping")
+    async def ping():
+        return {"ok": True}
+
+    @app.get("/login-inline")
+    async def login_inline():
+        return {"ok": verify_password(PASSWORD, hashed_password)}
+
+    @app.get("/login-pool")
+    async def login_pool():
+        return {"ok": await verify_password_async(PASSWORD, hashed_password)}
+
+    return app
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--logins", type=int, default=100, help="concurrent logins")
+    args = parser.parse_args()
+
+    transport = httpx.ASGITransport(app=build_app())
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench", timeout=None
+    ) as client:
+        print(
+            f"/ping latency during {args.logins} concurrent logins ({settings.PASSWORD_HASH_WORKERS} hash workers)"
+        )
+        report("inline bcrypt", await measure(client, "/login-inline", args.logins))
+        report("hash pool", await measure(client, "/login-pool", args.logins))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark of JSON-schema validation per template.
+
+Validates typical templates of a few to a hundred and fifty steps with
+``jsonschema`` alone and with the compiled checks that validation uses for
+documents without errors, and reports the time per template. The goal is
+well under a millisecond for a template of a few dozen steps.
+
+Usage:
+    python benchmarks/template_validation.py [--repeat 1000]
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from app.models.step import StepCategory  # noqa: E402
+from app.services import schema_validation  # noqa: E402
+
+STEP_COUNTS = (5, 20, 50, 150)
+
+
+def build_template(step_count: int) -> dict:
+    categories = [category.value for category in StepCategory]
+    return {
+        "name": "Final assembly inspection",
+        "template_id": "FA-100",
+        "revision": "C",
+        "status": "published",
+        "model_id": 1,
+        "stage_id": 3,
+        "metadata": {
+            "standard": "ISO 9001",
+            "tags": ["assembly", "final"],
+            "owner": {"team": "qa"},
+        },
+        "steps": [
+            {
+                "code": f"FA-{number:03d}",
+                "description": f"Check the torque of fastener {number}",
+                "requirement": "12 Nm +/- 1 Nm",
+                "category": categories[number % len(categories)],
+                "photo_required": number % 4 == 0,
+                "std_time": 45,
+                "metadata": {"tool": "torque wrench", "position": number},
+            }
+            for number in range(1, step_count + 1)
+        ],
+    }
+
+
+def per_call_ms(function, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument(
+        "--repeat", type=int, default=1000, help="validations per measurement"
+    )
+    args = parser.parse_args()
+
+    kind = schema_validation.TEMPLATE
+    schema = schema_validation.get_schema(
+        kind, schema_validation.CURRENT_VERSIONS[kind]
+    )
+    print(f"{'steps':>5}  {'jsonschema':>12}  {'compiled':>12}")
+    for step_count in STEP_COUNTS:
+        template = build_template(step_count)
+        assert not schema_validation.errors(kind, template)
+        # jsonschema is an order of magnitude slower; fewer rounds suffice
+        slow = per_call_ms(
+            lambda: list(schema.validator.iter_errors(template)),
+            max(args.repeat // 10, 1),
+        )
+        fast = per_call_ms(
+            lambda: schema_validation.errors(kind, template), args.repeat
+        )
+        print(f"{step_count:>5}  {slow:>9.3f} ms  {fast:>9.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
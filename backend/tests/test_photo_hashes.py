@@ -0,0 +1,88 @@
+"""
+The multi-index hash table must find exactly what a linear Hamming-distance
+scan finds, at every radius the near-duplicate search uses.
+"""
+
+import random
+
+import pytest
+
+from app.services.photo_hashes import MultiIndexHashTable, to_signed, to_unsigned
+
+
+def _flip(value, bits, rng):
+    for bit in rng.sample(range(64), bits):
+        value ^= 1 << bit
+    return value
+
+
+def _brute_force(hashes, value, max_distance):
+    matches = [
+        (key, distance)
+        for key, stored in hashes.items()
+        if (distance := (stored ^ value).bit_count()) <= max_distance
+    ]
+    return sorted(matches, key=lambda match: (match[1], match[0]))
+
+
+@pytest.fixture(scope="module")
+def hashes():
+    # Clusters of near copies, so every radius has matches, among unrelated hashes
+    rng = random.Random(20261017)
+    values = {}
+    for center_id in range(200):
+        center = rng.getrandbits(64)
+        values[len(values) + 1] = center
+        for _ in range(10):
+            values[len(values) + 1] = _flip(center, rng.randint(0, 8), rng)
+    for _ in range(3000):
+        values[len(values) + 1] = rng.getrandbits(64)
+    return values
+
+
+@pytest.fixture(scope="module")
+def table(hashes):
+    table = MultiIndexHashTable()
+    for key, value in hashes.items():
+        table.add(key, value)
+    return table
+
+
+@pytest.mark.parametrize("max_distance", range(7))
+def test_query_matches_brute_force(hashes, table, max_distance):
+    rng = random.Random(max_distance)
+    found = 0
+    for key in rng.sample(sorted(hashes), 300):
+        # Stored hashes, and queries near them that are not stored themselves
+        for value in (hashes[key], _flip(hashes[key], rng.randint(1, 4), rng)):
+            expected = _brute_force(hashes, value, max_distance)
+            assert table.query(value, max_distance) == expected
+            found += len(expected)
+    assert found
+
+
+def test_query_after_updates_matches_brute_force(hashes):
+    rng = random.Random(7)
+    current = dict(hashes)
+    table = MultiIndexHashTable()
+    for key, value in current.items():
+        table.add(key, value)
+
+    for key in rng.sample(sorted(current), 500):
+        table.remove(key)
+        del current[key]
+    for key in rng.sample(sorted(current), 500):
+        current[key] = _flip(current[key], rng.randint(1, 3), rng)
+        table.add(key, current[key])
+    table.remove(-1)  # unknown keys are ignored
+
+    assert len(table) == len(current)
+    for key in rng.sample(sorted(current), 200):
+        assert table.query(current[key], 6) == _brute_force(current, current[key], 6)
+
+
+def test_signed_round_trip():
+    for value in (0, 1, (1 << 63) - 1, 1 << 63, (1 << 64) - 1):
+        signed = to_signed(value)
+        assert -(1 << 63) <= signed < 1 << 63
+        assert to_unsigned(signed) == value
@@ -0,0 +1,177 @@
+"""
+The compiled checks must accept exactly the documents jsonschema accepts:
+a document they wrongly accept is stored unchecked, and one they wrongly
+reject fails with an empty error list.
+"""
+
+import copy
+
+import pytest
+
+from app.services import schema_validation
+from app.services.schema_validation import (
+    CURRENT_VERSIONS,
+    RESULT,
+    SCHEMAS,
+    STEP,
+    TEMPLATE,
+)
+
+VALID_STEP = {
+    "code": "S-01",
+    "description": "Check the torque of the mounting bolts",
+    "requirement": "25 Nm +/- 2",
+    "category": "major",
+    "photo_required": True,
+    "std_time": 90,
+    "metadata": {
+        "tool": "torque wrench",
+        "limits": [23, 27],
+        "units": {"torque": "Nm"},
+    },
+}
+
+VALID_TEMPLATE = {
+    "name": "Final assembly",
+    "template_id": "FA-100",
+    "revision": "B",
+    "status": "published",
+    "model_id": 1,
+    "stage_id": None,
+    "metadata": {"owner": "qc", "line.no": 4},
+    "steps": [VALID_STEP, {**VALID_STEP, "code": "S-02", "metadata": {}}],
+}
+
+VALID_RESULT = {
+    "step_id": 3,
+    "ok_flag": False,
+    "comment": "Scratch on the left panel",
+    "photo_path": None,
+    "execution_time": 42,
+    "metadata": None,
+}
+
+VALID = {TEMPLATE: VALID_TEMPLATE, STEP: VALID_STEP, RESULT: VALID_RESULT}
+
+# Values of every JSON type, including those jsonschema treats specially:
+# booleans are not integers, 1.0 is an integer
+ODD_VALUES = [
+    None,
+    True,
+    False,
+    0,
+    1,
+    -1,
+    1.0,
+    1.5,
+    10**6,
+    "",
+    " ",
+    "x",
+    " padded ",
+    "x" * 3000,
+    "critical",
+    "draft",
+    [],
+    ["a"],
+    [1, [2]],
+    ["x"] * 101,
+    {},
+    {"a": 1},
+    {"a": {"b": 1}},
+    {"bad key": 1},
+    {f"k{i}": i for i in range(51)},
+]
+
+
+def _mutations(document):
+    """The document with each property removed or replaced by each odd value, recursively."""
+    yield document
+    if isinstance(document, dict):
+        for name, value in document.items():
+            yield {key: item for key, item in document.items() if key != name}
+            for odd in ODD_VALUES:
+                yield {**document, name: odd}
+            for mutated in _mutations(value):
+                if mutated is not value:
+                    yield {**document, name: mutated}
+    elif isinstance(document, list) and document:
+        for mutated in _mutations(document[0]):
+            yield [mutated, *document[1:]]
+
+
+def _documents(kind):
+    yield from _mutations(copy.deepcopy(VALID[kind]))
+    yield from ODD_VALUES
+
+
+@pytest.mark.parametrize(
+    "kind,version", [(kind, version) for kind in SCHEMAS for version in SCHEMAS[kind]]
+)
+def test_compiled_checks_match_jsonschema(kind, version):
+    schema = schema_validation.get_schema(kind, version)
+    outcomes = set()
+    for document in _documents(kind):
+        expected = schema.validator.is_valid(document)
+        assert schema.is_valid(document) == expected, document
+        outcomes.add(expected)
+    # Both valid and invalid documents were compared
+    assert outcomes == {True, False}
+
+
+@pytest.mark.parametrize("kind", list(SCHEMAS))
+def test_valid_documents_have_no_errors(kind):
+    assert schema_validation.errors(kind, VALID[kind]) == []
+    schema_validation.validate(kind, VALID[kind], CURRENT_VERSIONS[kind])
+
+
+def test_errors_are_located_in_the_document():
+    document = copy.deepcopy(VALID_TEMPLATE)
+    document["name"] = ""
+    document["steps"][1]["std_time"] = -5
+
+    found = schema_validation.errors(TEMPLATE, document)
+
+    assert sorted(error.loc for error in found) == [("name",), ("steps", 1, "std_time")]
+
+
+def test_validate_all_locates_errors_by_position():
+    documents = [
+        VALID_STEP,
+        {**VALID_STEP, "code": " S-02"},
+        {**VALID_STEP, "category": "fatal", "metadata": {"bad key": 1}},
+    ]
+
+    with pytest.raises(schema_validation.SchemaValidationError) as raised:
+        schema_validation.validate_all(STEP, documents)
+
+    errors = raised.value.errors
+    assert sorted(error.loc for error in errors) == [
+        (1, "code"),
+        (2, "category"),
+        (2, "metadata"),
+    ]
+    detail = raised.value.detail("body", "steps")
+    assert sorted(tuple(item["loc"]) for item in detail) == [
+        ("body", "steps", 1, "code"),
+        ("body", "steps", 2, "category"),
+        ("body", "steps", 2, "metadata"),
+    ]
+    assert all(item["type"] == "value_error.schema" for item in detail)
+
+
+def test_validate_all_accepts_valid_documents():
+    schema_validation.validate_all(RESULT, [VALID_RESULT, {}, {"ok_flag": True}])
+
+
+def test_messages_prefix_the_location():
+    found = [
+        schema_validation.SchemaError((0, "code"), "too long"),
+        schema_validation.SchemaError((), "not an object"),
+    ]
+
+    assert schema_validation.messages(found, "steps") == [
+        "steps.0.code: too long",
+        "steps: not an object",
+    ]
+    assert schema_validation.messages(found[1:]) == ["__root__: not an object"]
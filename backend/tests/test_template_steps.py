@@ -0,0 +1,187 @@
+"""
+Creating templates with their steps and replacing all steps of a template,
+through the API on a throwaway SQLite database.
+"""
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+from sqlmodel import Session, SQLModel, create_engine, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+import app.db.base  # noqa: F401  registers every table
+from app.api.deps import get_current_user
+from app.api.endpoints import templates
+from app.db.session import get_async_db
+from app.models.checklist import QCDoc, QCResult
+from app.models.step import Step
+from app.models.user import User, UserRole
+from app.services.cache import Cache, MemoryBackend, set_cache
+
+
+def _step(code, **values):
+    return {"code": code, "description": f"Check {code}", "requirement": "OK", **values}
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = tmp_path / "test.db"
+    engine = create_engine(f"sqlite:///{path}")
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.add(
+            User(
+                id=1,
+                username="engineer",
+                email="engineer@example.com",
+                role=UserRole.QC_ENGINEER,
+                hashed_password="-",
+            )
+        )
+        session.commit()
+    engine.dispose()
+    return path
+
+
+@pytest.fixture
+def engine(database):
+    engine = create_engine(f"sqlite:///{database}")
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def client(database):
+    # The test client runs the app in its own event loop, so no pooled connections
+    async_engine = create_async_engine(
+        f"sqlite+aiosqlite:///{database}", poolclass=NullPool
+    )
+    sessions = async_sessionmaker(
+        async_engine, class_=AsyncSession, expire_on_commit=False
+    )
+
+    async def get_test_db():
+        async with sessions() as session:
+            yield session
+
+    async def get_test_user():
+        async with sessions() as session:
+            return await session.get(User, 1)
+
+    api = FastAPI()
+    api.include_router(templates.router, prefix="/templates")
+    api.dependency_overrides[get_async_db] = get_test_db
+    api.dependency_overrides[get_current_user] = get_test_user
+    set_cache(Cache(MemoryBackend(), "test:", 60))
+    yield TestClient(api)
+    set_cache(None)
+
+
+def _create(client, steps):
+    response = client.post(
+        "/templates",
+        json={
+            "name": "Assembly",
+            "template_id": "ASM-1",
+            "revision": "A",
+            "steps": steps,
+        },
+    )
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def _stored_codes(engine, template_id):
+    with Session(engine) as session:
+        steps = session.exec(
+            select(Step).where(Step.template_id == template_id).order_by(Step.position)
+        ).all()
+        return [step.code for step in steps]
+
+
+def test_create_keeps_step_order(client, engine):
+    template = _create(client, [_step("C"), _step("A"), _step("B")])
+
+    assert [step["code"] for step in template["steps"]] == ["C", "A", "B"]
+    assert [step["position"] for step in template["steps"]] == [0, 1, 2]
+    assert _stored_codes(engine, template["id"]) == ["C", "A", "B"]
+
+
+def test_replace_keeps_ids_and_takes_the_request_order(client, engine):
+    template = _create(client, [_step("A"), _step("B"), _step("C")])
+    ids = {step["code"]: step["id"] for step in template["steps"]}
+
+    response = client.put(
+        f"/templates/{template['id']}/steps",
+        json=[
+            _step("C"),
+            _step("A"),
+            _step("X"),
+            _step("B", requirement="Torque 25 Nm"),
+        ],
+    )
+
+    assert response.status_code == 200, response.text
+    steps = response.json()["steps"]
+    assert [step["code"] for step in steps] == ["C", "A", "X", "B"]
+    assert [step["position"] for step in steps] == [0, 1, 2, 3]
+    assert {step["code"]: step["id"] for step in steps if step["code"] != "X"} == ids
+    assert steps[3]["requirement"] == "Torque 25 Nm"
+    assert _stored_codes(engine, template["id"]) == ["C", "A", "X", "B"]
+
+
+def test_replace_deletes_missing_steps(client, engine):
+    template = _create(client, [_step("A"), _step("B"), _step("C")])
+
+    response = client.put(
+        f"/templates/{template['id']}/steps", json=[_step("C"), _step("A")]
+    )
+
+    assert response.status_code == 200, response.text
+    assert [step["code"] for step in response.json()["steps"]] == ["C", "A"]
+    assert _stored_codes(engine, template["id"]) == ["C", "A"]
+
+
+def test_replace_refuses_to_delete_steps_with_results(client, engine):
+    template = _create(client, [_step("A"), _step("B")])
+    with Session(engine) as session:
+        checklist = QCDoc(serial_no="SN-1", template_id=template["id"], created_by_id=1)
+        session.add(checklist)
+        session.flush()
+        session.add(
+            QCResult(
+                qc_doc_id=checklist.id, step_id=template["steps"][1]["id"], ok_flag=True
+            )
+        )
+        session.commit()
+
+    response = client.put(f"/templates/{template['id']}/steps", json=[_step("A")])
+
+    assert response.status_code == 409
+    assert "B" in response.json()["detail"]
+    assert _stored_codes(engine, template["id"]) == ["A", "B"]
+
+
+def test_duplicate_codes_are_rejected(client, engine):
+    response = client.post(
+        "/templates",
+        json={
+            "name": "Assembly",
+            "template_id": "ASM-1",
+            "revision": "A",
+            "steps": [_step("A"), _step("A")],
+        },
+    )
+    assert response.status_code == 422
+    assert "A" in response.json()["detail"]
+
+    template = _create(client, [_step("A"), _step("B")])
+    response = client.put(
+        f"/templates/{template['id']}/steps", json=[_step("B"), _step("A"), _step("B")]
+    )
+
+    assert response.status_code == 422
+    assert "B" in response.json()["detail"]
+    assert _stored_codes(engine, template["id"]) == ["A", "B"]
@@ -153,7 +153,8 @@ export interface SyncQueueItem {
 }
 
 export interface SyncResponse {
-  sync_time: string;
+  cursor: string; // send back as ?cursor= on the next sync
   templates?: Template[];
   checklists?: QCDocWithDetails[];
+  deleted?: Record<string, number[]>; // ids per entity, e.g. checklists and results
 }